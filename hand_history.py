@@ -0,0 +1,268 @@
+# ハンド履歴：終わったハンドを列ごとの固定長バイナリファイルに追記する（Discordに依存しない）
+# 各列は array の生データをそのまま並べたものなので、mmap や numpy.fromfile でもそのまま読める
+# プレイヤーごとの集計は追記のたびに更新し、期間の集計は時刻列の二分探索と列の切り出しで求める
+import os
+import shutil
+import time
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
+from poker_engine import HAND_NAMES, evaluate_cards, hand_category
+
+HISTORY_DIR = "history"
+HISTORY_FLUSH_EVERY = 20  # この件数のハンドが溜まったらファイルに書き出す
+
+# 列の定義（名前 -> array の型コード）
+HAND_COLUMNS = {"time": "q", "channel": "q", "pot": "q", "seats": "b"}
+SEAT_COLUMNS = {"hand": "q", "player": "q", "cards": "q", "category": "b",
+                "contributed": "q", "net": "q", "won": "b", "folded": "b"}
+ACTION_COLUMNS = {"hand": "q", "player": "q", "kind": "b", "amount": "q"}
+ACTION_KINDS = ("bet", "call", "check", "allin", "raise", "fold", "timeout", "exchange")
+ACTION_CODES = {kind: i for i, kind in enumerate(ACTION_KINDS)}
+
+def pack_cards(cards):
+    # 5枚のカード（0〜51）を 6bit ずつ1つの整数に詰める
+    packed = 0
+    for card in cards:
+        packed = packed << 6 | card
+    return packed
+
+def unpack_cards(packed, count=5):
+    return [(packed >> (6 * i)) & 63 for i in reversed(range(count))]
+
+class ColumnGroup:
+    # 同じ行数を持つ列の集まり。flushed より後ろがまだファイルに書いていない行
+    def __init__(self, directory, name, columns):
+        self.paths = {col: os.path.join(directory, f"{name}.{col}.bin") for col in columns}
+        self.columns = {col: array(code) for col, code in columns.items()}
+        self.flushed = 0
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def load(self):
+        for col, arr in self.columns.items():
+            path = self.paths[col]
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                # 値の途中で書き込みが止まった末尾の半端なバイトは読まない（truncate でファイルからも除く）
+                arr.frombytes(data[:len(data) - len(data) % arr.itemsize])
+
+    def truncate(self, rows):
+        # 書き込み途中で落ちて列の長さがそろっていない場合は、そろっている行までに切り詰める
+        for col, arr in self.columns.items():
+            if len(arr) > rows:
+                del arr[rows:]
+            path = self.paths[col]
+            if os.path.exists(path) and os.path.getsize(path) != rows * arr.itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * arr.itemsize)
+        self.flushed = rows
+
+    def append(self, **values):
+        for col, arr in self.columns.items():
+            arr.append(values[col])
+
+    def flush(self):
+        for col, arr in self.columns.items():
+            with open(self.paths[col], "ab") as f:
+                arr[self.flushed:].tofile(f)
+        self.flushed = len(self)
+
+class PlayerStats:
+    __slots__ = ("hands", "wins", "net", "wagered", "category_hands", "category_wins")
+
+    def __init__(self):
+        self.hands = 0
+        self.wins = 0
+        self.net = 0
+        self.wagered = 0
+        self.category_hands = [0] * len(HAND_NAMES)
+        self.category_wins = [0] * len(HAND_NAMES)
+
+    def add(self, category, contributed, net, won, folded=False):
+        self.hands += 1
+        self.wins += won
+        self.net += net
+        self.wagered += contributed
+        # 役ごとの集計はショウダウンまで残った手だけ（フォールドした手の役は数えない）
+        if not folded:
+            self.category_hands[category] += 1
+            self.category_wins[category] += won
+
+class HandHistory:
+    def __init__(self, directory=HISTORY_DIR, flush_every=HISTORY_FLUSH_EVERY):
+        self.directory = directory
+        self.flush_every = flush_every
+        self.hands = ColumnGroup(directory, "hands", HAND_COLUMNS)
+        self.seats = ColumnGroup(directory, "seats", SEAT_COLUMNS)
+        self.actions = ColumnGroup(directory, "actions", ACTION_COLUMNS)
+        self.players = {}     # プレイヤーID -> PlayerStats
+        self.pending = {}     # 卓ID -> 進行中のハンド（拠出額とアクション）
+        self.loaded = False
+
+    def load(self):
+        # merge の途中で落ちていたら、入れ替え前なら書きかけを捨て、入れ替えの途中なら書き終えた方を使う
+        merging, old = self.directory + ".merging", self.directory + ".old"
+        if os.path.isdir(merging):
+            if os.path.isdir(self.directory):
+                shutil.rmtree(merging)
+            else:
+                os.rename(merging, self.directory)
+        if os.path.isdir(old):
+            shutil.rmtree(old)
+        os.makedirs(self.directory, exist_ok=True)
+        for group in (self.hands, self.seats, self.actions):
+            group.load()
+        # ハンドの行は最後に書くので、ハンドの列がそろっている行数までを正とする
+        rows = min(len(arr) for arr in self.hands.columns.values())
+        self.hands.truncate(rows)
+        self.seats.truncate(min(bisect_left(self.seats.columns["hand"], rows), *map(len, self.seats.columns.values())))
+        self.actions.truncate(min(bisect_left(self.actions.columns["hand"], rows), *map(len, self.actions.columns.values())))
+
+        self.players = {}
+        seats = self.seats.columns
+        for player, category, contributed, net, won, folded in zip(seats["player"], seats["category"], seats["contributed"],
+                                                                   seats["net"], seats["won"], seats["folded"]):
+            self._stats(player).add(category, contributed, net, won, folded)
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _stats(self, player):
+        stats = self.players.get(player)
+        if stats is None:
+            stats = self.players[player] = PlayerStats()
+        return stats
+
+    def record(self, table, event):
+        # PokerTable の listener として使う。table には channel_id が必要
+        key = table.channel_id
+        if event.kind == "deal":
+            self.pending[key] = {"contributions": {}, "actions": []}
+            return
+        hand = self.pending.get(key)
+        if hand is None:
+            return
+        if event.kind == "fees":
+            for pid in event.data:
+                hand["contributions"][pid] = hand["contributions"].get(pid, 0) + event.amount
+        elif event.kind in ACTION_CODES:
+            hand["actions"].append((event.player, ACTION_CODES[event.kind], event.amount))
+            if event.kind in ("bet", "call", "allin", "raise"):
+                hand["contributions"][event.player] = hand["contributions"].get(event.player, 0) + event.amount
+        elif event.kind == "settle":
+            del self.pending[key]
+            self.append(table, hand["contributions"], dict(event.data), hand["actions"])
+        elif event.kind == "abort":
+            del self.pending[key]
+
+    def append(self, table, contributions, payouts, actions, now=None):
+        self._ensure_loaded()
+        index = len(self.hands)
+        seated = [pid for pid in table.players if pid in table.hands]
+        for pid in seated:
+            cards = table.hands[pid]
+            category = hand_category(evaluate_cards(cards))
+            contributed = contributions.get(pid, 0)
+            net = payouts.get(pid, 0) - contributed
+            won = pid in payouts and net > 0
+            folded = pid in table.folded
+            self.seats.append(hand=index, player=pid, cards=pack_cards(cards), category=category,
+                              contributed=contributed, net=net, won=won, folded=folded)
+            self._stats(pid).add(category, contributed, net, won, folded)
+        for pid, kind, amount in actions:
+            self.actions.append(hand=index, player=pid, kind=kind, amount=amount)
+        # 時刻列は二分探索に使うので、時計が戻っても前のハンドより小さくしない
+        times = self.hands.columns["time"]
+        now = int(now if now is not None else time.time())
+        if times and now < times[-1]:
+            now = times[-1]
+        self.hands.append(time=now, channel=table.channel_id,
+                          pot=sum(contributions.values()), seats=len(seated))
+        if len(self.hands) - self.hands.flushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        # ハンドの行を最後に書く（途中で落ちても、読み込み時にハンドの行数でそろえられる）
+        if not self.loaded:
+            return
+        self.seats.flush()
+        self.actions.flush()
+        self.hands.flush()
+
+    def merge(self, other):
+        # 別のディレクトリの履歴（シャードの割り当てを変える前のもの）を時刻順に混ぜて書き直す
+        # 別のディレクトリに書き終えてから入れ替えるので、途中で落ちても履歴は欠けない（続きは load が片付ける）
+        self._ensure_loaded()
+        marker = "merged." + os.path.basename(os.path.normpath(other.directory))
+        if os.path.exists(os.path.join(self.directory, marker)):
+            return False  # 取り込み済み（元のディレクトリを消す前に落ちた）
+        other._ensure_loaded()
+        self.flush()
+        order = sorted([(t, 0, i) for i, t in enumerate(self.hands.columns["time"])] +
+                       [(t, 1, i) for i, t in enumerate(other.hands.columns["time"])])
+        merging = self.directory + ".merging"
+        if os.path.isdir(merging):
+            shutil.rmtree(merging)
+        merged = HandHistory(merging)
+        merged.load()
+        sources = (self, other)
+        for index, (_, source, i) in enumerate(order):
+            source = sources[source]
+            merged.hands.append(**{col: arr[i] for col, arr in source.hands.columns.items()})
+            for group, target in ((source.seats, merged.seats), (source.actions, merged.actions)):
+                hands = group.columns["hand"]
+                for row in range(bisect_left(hands, i), bisect_left(hands, i + 1)):
+                    values = {col: arr[row] for col, arr in group.columns.items()}
+                    values["hand"] = index
+                    target.append(**values)
+        merged.flush()
+        open(os.path.join(merging, marker), "wb").close()
+        old = self.directory + ".old"
+        os.rename(self.directory, old)
+        os.rename(merging, self.directory)
+        shutil.rmtree(old)
+        # 進行中のハンド（pending）はそのまま残し、列と集計を読み直す
+        self.hands = ColumnGroup(self.directory, "hands", HAND_COLUMNS)
+        self.seats = ColumnGroup(self.directory, "seats", SEAT_COLUMNS)
+        self.actions = ColumnGroup(self.directory, "actions", ACTION_COLUMNS)
+        self.load()
+        return True
+
+    # 集計
+    def player_stats(self, player):
+        self._ensure_loaded()
+        return self.players.get(player)
+
+    def _seat_range(self, since, until):
+        times = self.hands.columns["time"]
+        first, last = bisect_left(times, since), bisect_left(times, until)
+        hands = self.seats.columns["hand"]
+        return bisect_left(hands, first), bisect_left(hands, last)
+
+    def net_between(self, player, since, until=float("inf")):
+        # 期間内の収支。列を切り出して、プレイヤーが一致する行だけを C 実装のイテレータで合計する
+        self._ensure_loaded()
+        lo, hi = self._seat_range(since, until)
+        seats = self.seats.columns
+        return sum(compress(seats["net"][lo:hi], map(player.__eq__, seats["player"][lo:hi])))
+
+    def category_win_rates(self, since=0, until=float("inf")):
+        # 期間内の役カテゴリごとの (ハンド数, 勝ち数)。フォールドした手は除く
+        self._ensure_loaded()
+        lo, hi = self._seat_range(since, until)
+        showdown = [not folded for folded in self.seats.columns["folded"][lo:hi]]
+        categories = list(compress(self.seats.columns["category"][lo:hi], showdown))
+        won = list(compress(self.seats.columns["won"][lo:hi], showdown))
+        hands = [0] * len(HAND_NAMES)
+        wins = [0] * len(HAND_NAMES)
+        for category in range(len(HAND_NAMES)):
+            matches = list(map(category.__eq__, categories))
+            hands[category] = sum(matches)
+            wins[category] = sum(compress(won, matches))
+        return list(zip(hands, wins))
@@ -1,15 +1,76 @@
-from flask import Flask
-from threading import Thread
+# 管理・ヘルスチェック用の HTTP サーバー
+# Bot と同じイベントループ上で aiohttp を動かす（別スレッドや WSGI サーバーは使わない）
+import math
+import os
 
-app = Flask('')
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "Bot is alive!"
+import metrics
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+PORT = int(os.environ.get("PORT", "8080"))
+HEALTH_MAX_LOOP_LAG = float(os.environ.get("HEALTH_MAX_LOOP_LAG", "1.0"))  # これを超える遅延は不健康とみなす（秒）
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+def gateway_connected(bot):
+    if bot.is_closed():
+        return False
+    shards = getattr(bot, "shards", None)
+    if shards is not None:
+        # AutoShardedBot は bot.ws を使わないので、このプロセスが担当するシャードがすべてつながっているかを見る
+        expected = bot.shard_ids or list(shards)
+        return bool(expected) and all(shard_id in shards and not shards[shard_id].is_closed()
+                                      and math.isfinite(shards[shard_id].latency) for shard_id in expected)
+    ws = bot.ws
+    return ws is not None and ws.open and math.isfinite(bot.latency)
+
+def make_app(bot, ready, tables, ledger):
+    # ready / tables / ledger は Bot 側の状態を返す関数
+    async def home(request):
+        return web.Response(text="Bot is alive!")
+
+    async def healthz(request):
+        checks = {
+            "gateway": gateway_connected(bot),
+            "loop_lag": metrics.loop_lag < HEALTH_MAX_LOOP_LAG,
+        }
+        body = {"ok": all(checks.values()), "checks": checks,
+                "loop_lag_ms": round(metrics.loop_lag * 1000, 1),
+                "latency_ms": round(bot.latency * 1000, 1) if math.isfinite(bot.latency) else None}
+        return web.json_response(body, status=200 if body["ok"] else 503)
+
+    async def readyz(request):
+        checks = ready()
+        ok = all(checks.values())
+        return web.json_response({"ok": ok, "checks": checks}, status=200 if ok else 503)
+
+    async def list_tables(request):
+        return web.json_response(tables())
+
+    async def ledger_totals(request):
+        return web.json_response(ledger())
+
+    async def metrics_endpoint(request):
+        if not metrics.ENABLED:
+            return web.Response(text="metrics disabled (set METRICS_ENABLED=1)\n", status=404)
+        return web.Response(text=metrics.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/tables", list_tables)
+    app.router.add_get("/ledger", ledger_totals)
+    app.router.add_get("/metrics", metrics_endpoint)
+    return app
+
+def keep_alive(bot, ready=lambda: {}, tables=lambda: [], ledger=lambda: {}):
+    # bot.run() の前に呼ぶ。Bot の setup_hook でサーバーとループ遅延の計測を開始する
+    previous_hook = bot.setup_hook
+
+    async def setup_hook():
+        await previous_hook()
+        runner = web.AppRunner(make_app(bot, ready, tables, ledger), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", PORT).start()
+        bot.loop.create_task(metrics.sample_loop_lag())
+
+    bot.setup_hook = setup_hook
@@ -0,0 +1,542 @@
+# 負荷試験：Discord の代わりにメモリ上の偽クライアントで main.py のコマンドと View を動かす
+# 卓の数を増やしながら、フェーズごとの所要時間・イベントループの遅延・台帳I/O・メモリを測る
+#
+#   python loadtest.py --tables 1,10,100 --players 4 --think-ms 200 --output loadtest_baseline.json
+#   python loadtest.py --tables 1,10,100 --compare loadtest_baseline.json
+#   python loadtest.py --tables 10 --player-threads   # DM の代わりに本人専用スレッドで手札・操作をやりとりする
+#   python loadtest.py --journal-hands 100000   # 卓ジャーナルの再生速度を測る
+#   python loadtest.py --ranking-users 100000   # 順位表と全件読み込み＋並べ替えを比べる
+#   python loadtest.py --ledger-users 1000,10000,100000   # 台帳の方式ごとに1操作あたりの時間を測る
+#   python loadtest.py --evaluate-hands 1000000   # 役判定の速度（ハンド/秒）を測る
+#   python loadtest.py --settle-players 2,6,10   # ポット精算1回あたりの時間を測る
+#   python loadtest.py --image-hands 20   # 手札画像の形式・縮尺ごとのバイト数とエンコード時間を測る
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BOT_ID = 1
+IDS = itertools.count(10_000)
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"count": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+class Metrics:
+    def __init__(self):
+        self.phases = {}
+        self.loop_lag = []
+        self.ledger = {"reads": 0, "writes": 0, "compactions": 0}
+
+    def record(self, phase, seconds):
+        self.phases.setdefault(phase, []).append(seconds * 1000)
+
+class FakeMessage:
+    def __init__(self, channel, content=None, author=None, embeds=(), guild=None):
+        self.id = next(IDS)
+        self.channel = channel
+        self.content = content or ""
+        self.author = author
+        self.embeds = list(embeds)
+        self.guild = guild
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+class FakeChannel:
+    def __init__(self, guild=None):
+        self.id = next(IDS)
+        self.guild = guild
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(self, content, guild=self.guild)
+        self.sent.append(message)
+        return message
+
+    async def create_thread(self, name=None, **kwargs):
+        return FakeThread(self)
+
+class FakeThread(FakeChannel):
+    # 本人専用スレッド：送られた内容は add_user された模擬プレイヤーに渡す
+    def __init__(self, parent):
+        super().__init__(parent.guild)
+        self.parent = parent
+        self.user = None
+
+    async def add_user(self, user):
+        self.user = user
+
+    async def send(self, content=None, file=None, view=None, **kwargs):
+        message = await super().send(content)
+        self.user.receive(self, content, view)
+        return message
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, view=None, **kwargs):
+        self.interaction.sent.append((content, view))
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.sent.append((content, None))
+
+class FakeInteraction:
+    def __init__(self, user, channel):
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild and channel.guild.id
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent = []
+
+class SimUser:
+    # 模擬プレイヤー：DMでアクションや交換を求められたら、考える時間をおいて応答する
+    def __init__(self, harness):
+        self.id = next(IDS)
+        self.mention = f"<@{self.id}>"
+        self.name = self.display_name = f"user{self.id}"
+        self.harness = harness
+        self.dm = FakeChannel()
+
+    async def send(self, content=None, file=None, view=None, **kwargs):
+        self.receive(self.dm, content, view)
+        return FakeMessage(self.dm, content)
+
+    def receive(self, channel, content, view):
+        # DM またはスレッドに届いた内容に応じて応答する
+        if view is not None:
+            self.harness.spawn(self.act(view, channel))
+        elif content and "カード交換フェーズ" in content:
+            self.harness.spawn(self.exchange(channel))
+
+    async def reply(self, channel, text):
+        self.harness.dispatch(FakeMessage(channel, text, author=self, guild=channel.guild))
+
+    async def act(self, view, channel):
+        await self.harness.think()
+        interaction = FakeInteraction(self, channel)
+        game = view.game
+        # 残高（トーナメントならチップ）で払える範囲の金額を選ぶ
+        limit = min(game.max_bet, game.wallet.balance(self.id) + game.round_bets.get(self.id, 0))
+        roll = random.random()
+        start = time.perf_counter()
+        if view.is_first_player and limit < game.min_bet:
+            await view.fold_button.callback(interaction)
+        elif view.is_first_player:
+            task = asyncio.create_task(view.bet_button.callback(interaction))
+            await asyncio.sleep(0)
+            await self.reply(channel, str(random.randint(game.min_bet, limit)))
+            await task
+        elif roll < 0.1:
+            await view.fold_button.callback(interaction)
+        elif roll < 0.2 and game.current_bet < limit:
+            task = asyncio.create_task(view.raise_button.callback(interaction))
+            await asyncio.sleep(0)
+            await self.reply(channel, str(random.randint(game.current_bet + 1, limit)))
+            await task
+        else:
+            await view.call_button.callback(interaction)
+        self.harness.metrics.record("action", time.perf_counter() - start)
+
+    async def exchange(self, channel):
+        await self.harness.think()
+        await self.reply(channel, random.choice(["0", "1,2", "3", "1,4,5"]))
+
+class Harness:
+    def __init__(self, main, think_ms):
+        self.main = main
+        self.think_ms = think_ms
+        self.metrics = Metrics()
+        self.tasks = set()
+        self.users = {}
+        self.guild = SimpleNamespace(id=next(IDS))
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def think(self):
+        await asyncio.sleep(random.expovariate(1000 / self.think_ms) if self.think_ms else 0)
+
+    def dispatch(self, message):
+        self.main.INPUTS.dispatch(message)
+
+    def new_user(self):
+        user = SimUser(self)
+        self.users[user.id] = user
+        return user
+
+    async def timed(self, phase, coro):
+        start = time.perf_counter()
+        result = await coro
+        self.metrics.record(phase, time.perf_counter() - start)
+        return result
+
+    async def sample_loop_lag(self, interval=0.01):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.metrics.loop_lag.append((time.perf_counter() - start - interval) * 1000)
+
+    async def charge(self, user, channel):
+        interaction = FakeInteraction(user, channel)
+        task = asyncio.create_task(self.main.chargem.callback(interaction, 1000))
+        await self.think()
+        deposit = SimpleNamespace(description=f"<@{user.id}>から<@{BOT_ID}>へ`1000` Spt 送金されました")
+        start = time.perf_counter()
+        self.dispatch(FakeMessage(channel, author=SimpleNamespace(id=self.main.VIRTUALCRYPTO_ID), embeds=[deposit], guild=self.guild))
+        await task
+        self.metrics.record("chargem", time.perf_counter() - start)
+
+    async def run_table(self, players):
+        main = self.main
+        channel = FakeChannel(self.guild)
+        users = [self.new_user() for _ in range(players)]
+        await asyncio.gather(*(self.charge(user, channel) for user in users))
+
+        owner = users[0]
+        interaction = FakeInteraction(owner, channel)
+        await self.timed("joinpoker", main.join_poker.callback(interaction))
+        join_view = interaction.sent[-1][1]
+        for user in users:
+            await self.timed("join_button", join_view.join.callback(FakeInteraction(user, channel)))
+
+        # フェーズの切り替わりを状況表示の更新から拾う
+        game = main.POKER_GAMES.get(channel.id)
+        phase_started = {}
+        original_update = game.status.update
+
+        def update(phase=None, turn=None):
+            if phase is not None and phase.split(" ")[0] not in phase_started:
+                now = time.perf_counter()
+                for name, started in list(phase_started.items()):
+                    if started is not None:
+                        self.metrics.record(f"phase:{name}", now - started)
+                        phase_started[name] = None
+                phase_started[phase.split(" ")[0]] = now
+            original_update(phase=phase, turn=turn)
+
+        game.status.update = update
+        await self.timed("hand", main.start_poker.callback(FakeInteraction(owner, channel)))
+
+def count_ledger_io(main, metrics):
+    # 台帳の get / apply / compact を数える版に差し替え、元に戻す関数を返す
+    store = main.CURRENCY
+    get, apply = store.get, store.apply
+    restore = {"get": get, "apply": apply}
+
+    def counted_get(user_id):
+        metrics.ledger["reads"] += 1
+        return get(user_id)
+
+    def counted_apply(changes):
+        metrics.ledger["writes"] += 1
+        return apply(changes)
+
+    store.get, store.apply = counted_get, counted_apply
+    if hasattr(store, "compact"):
+        compact = store.compact
+
+        def counted_compact():
+            metrics.ledger["compactions"] += 1
+            return compact()
+
+        store.compact = counted_compact
+        restore["compact"] = compact
+    return lambda: [setattr(store, name, func) for name, func in restore.items()]
+
+async def run(main, tables, players, think_ms):
+    harness = Harness(main, think_ms)
+    uncount = count_ledger_io(main, harness.metrics)
+    main.bot.get_user = harness.users.get
+    main.bot._connection.user = SimpleNamespace(id=BOT_ID, name="PokerBot")
+
+    # 本番の on_ready と同じく、交換シミュレーションの子プロセスを先に起動しておく
+    await asyncio.gather(*map(asyncio.wrap_future, main.warm_odds_workers()))
+    sampler = asyncio.create_task(harness.sample_loop_lag())
+    start = time.perf_counter()
+    await asyncio.gather(*(harness.run_table(players) for _ in range(tables)))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    for task in list(harness.tasks):
+        task.cancel()
+    uncount()
+
+    metrics = harness.metrics
+    return {
+        "tables": tables,
+        "players": players,
+        "elapsed_s": elapsed,
+        "phases_ms": {name: percentiles(samples) for name, samples in sorted(metrics.phases.items())},
+        "loop_lag_ms": percentiles(metrics.loop_lag),
+        "ledger": metrics.ledger,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def journal_benchmark(main, hands, players, tables=100):
+    # セルフプレイで大きな卓ジャーナルを作り、起動時の読み込み（再生＋スナップショット）にかかる時間を測る
+    from poker_engine import DictWallet, PokerTable
+    import selfplay
+
+    class BenchTable(PokerTable):
+        pass
+
+    journal = main.TableJournal("bench_tables.json", "bench_tables.journal", compact_every=float("inf"))
+    wallet = DictWallet({pid: 10 ** 12 for pid in range(players)})
+    strategies = {pid: selfplay.STRATEGIES[pid % len(selfplay.STRATEGIES)] for pid in range(players)}
+    rng = random.Random(0)
+    seats = []
+    for channel_id in range(tables):
+        table = BenchTable(owner_id=0, wallet=wallet)
+        table.channel_id = channel_id
+        table.listener = journal.record
+        journal.write(str(channel_id), "open", 0)
+        for pid in range(players):
+            table.join(pid)
+        seats.append(table)
+
+    start = time.perf_counter()
+    for i in range(hands):
+        selfplay.play_hand(seats[i % tables], strategies, rng)
+    written = time.perf_counter() - start
+    journal.journal.close()
+    size = os.path.getsize(journal.journal_file)
+
+    start = time.perf_counter()
+    replayed = main.TableJournal(journal.snapshot_file, journal.journal_file)
+    replayed.load()
+    elapsed = time.perf_counter() - start
+    print(f"📼 {hands} ハンド / {journal.seq} 件 / {size / 1024 / 1024:.1f} MB：書き込み {written:.2f} 秒"
+          f" / 再生 {elapsed * 1000:.0f} ms（{journal.seq / elapsed:,.0f} 件/秒）")
+    replayed.journal.close()
+    start = time.perf_counter()
+    main.TableJournal(journal.snapshot_file, journal.journal_file).load()
+    print(f"📸 スナップショットからの再起動 {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def ranking_benchmark(main, users, queries=1000, scans=20):
+    # ランキング1回分（上位10件＋自分の順位）を、順位表と従来の「全件読み込み＋並べ替え」で比べる
+    rng = random.Random(0)
+    balances = {str(uid): rng.randint(1, 10 ** 6) for uid in range(users)}
+    main.save_currency(balances, "bench_currency.json")
+    sample = rng.sample(list(balances), min(queries, users))
+
+    start = time.perf_counter()
+    for uid in sample[:scans]:
+        ordered = sorted(main.load_currency("bench_currency.json").items(), key=lambda kv: (-kv[1], kv[0]))
+        ordered[:10], next(i for i, (u, _) in enumerate(ordered) if u == uid)
+    scan = (time.perf_counter() - start) / scans
+
+    start = time.perf_counter()
+    index = main.BalanceIndex(balances.items())
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for uid in sample:
+        index.top(10), index.rank(uid, balances[uid])
+    query = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    for uid in sample:
+        new = rng.randint(1, 10 ** 6)
+        index.update(uid, balances[uid], new)
+        balances[uid] = new
+    update = (time.perf_counter() - start) / len(sample)
+
+    ordered = sorted(balances.items(), key=lambda kv: (-kv[1], kv[0]))
+    step = max(1, users // 100)
+    assert all(index.rank(uid, bal) == i + 1 for i, (uid, bal) in enumerate(ordered) if i % step == 0)
+    print(f"🏆 {users} 人：全件読み込み＋並べ替え {scan * 1000:.1f} ms / 順位表 {query * 1e6:.1f} µs"
+          f"（{scan / query:,.0f} 倍）/ 更新 {update * 1e6:.1f} µs / 構築 {build * 1000:.0f} ms")
+
+def evaluate_benchmark(hands, batch=10000):
+    # 役判定1回ずつ（文字列・整数）とまとめて評価する場合の速度を比べる
+    from poker_engine import CARD_DECK, CARD_DECK_INT, evaluate_cards, evaluate_hand, evaluate_hands
+    rng = random.Random(0)
+    int_hands = [rng.sample(CARD_DECK_INT, 5) for _ in range(min(hands, 100000))]
+    name_hands = [rng.sample(CARD_DECK, 5) for _ in range(min(hands, 100000))]
+
+    def rate(func):
+        done = 0
+        start = time.perf_counter()
+        while done < hands:
+            func()
+            done += len(int_hands)
+        return done / (time.perf_counter() - start)
+
+    single_names = rate(lambda: [evaluate_hand(h) for h in name_hands])
+    single = rate(lambda: [evaluate_cards(h) for h in int_hands])
+    batched = rate(lambda: [evaluate_hands(int_hands[i:i + batch]) for i in range(0, len(int_hands), batch)])
+    print(f"🂡 役判定 {hands:,} ハンド：文字列 {single_names:,.0f} / 整数 {single:,.0f}"
+          f" / まとめて（{batch} 件ずつ）{batched:,.0f} ハンド/秒")
+
+def settle_benchmark(player_counts, hands=20000):
+    # 人数ごとに、オールイン・フォールドが混じったランダムな拠出額で settle_pots 1回あたりの時間を測る
+    from poker_engine import settle_pots
+    rng = random.Random(0)
+    for players in player_counts:
+        order = list(range(players))
+        cases = []
+        for _ in range(hands):
+            contributions = {pid: rng.choice([10, 10, 30, 60, 100, rng.randint(10, 200)]) for pid in order}
+            alive = rng.sample(order, rng.randint(1, players))
+            cases.append((contributions, {pid: rng.randint(0, 1 << 20) for pid in alive}))
+        start = time.perf_counter()
+        pots = 0
+        for contributions, strengths in cases:
+            pots += len(settle_pots(contributions, strengths, order)[1])
+        elapsed = time.perf_counter() - start
+        print(f"💰 {players:2} 人：{elapsed / hands * 1e6:.1f} µs/回（平均 {pots / hands:.1f} ポット）")
+
+def ledger_benchmark(main, user_counts, ops=2000, json_ops=20):
+    # ユーザー数を増やしながら、残高の読み取り・更新1回あたりの時間を台帳の方式ごとに比べる
+    # 従来方式（json）は1回ごとにファイル全体を読み書きするので回数を減らして測る
+    rng = random.Random(0)
+    for users in user_counts:
+        balances = {str(uid): rng.randint(1, 10 ** 6) for uid in range(users)}
+        for name, factory in main.CURRENCY_STORES.items():
+            directory = tempfile.mkdtemp(prefix=f"ledger-{name}-")
+            os.chdir(directory)
+            main.save_currency(balances)   # 既存の currency.json からの移行も含めて測る
+            store = factory()
+            start = time.perf_counter()
+            if hasattr(store, "load"):
+                store.load()
+            load = time.perf_counter() - start
+
+            count = json_ops if name == "json" else ops
+            sample = [rng.randrange(users) for _ in range(count)]
+            start = time.perf_counter()
+            for uid in sample:
+                store.get(uid)
+            read = (time.perf_counter() - start) / count
+            start = time.perf_counter()
+            for i, uid in enumerate(sample):
+                store.apply([(uid, -1), (sample[i - 1], 1)])
+            write = (time.perf_counter() - start) / count
+            compact = ""
+            if hasattr(store, "compact"):
+                start = time.perf_counter()
+                store.compact()
+                compact = f" / 圧縮 {(time.perf_counter() - start) * 1000:.1f} ms"
+            print(f"💾 {users} 人 {name:6}：読み込み {load * 1000:.0f} ms / 読 {read * 1e6:,.1f} µs / 書 {write * 1e6:,.1f} µs{compact}")
+    print(f"（LEDGER_FSYNC={'1' if main.LEDGER_FSYNC else '0'}）")
+
+def image_benchmark(main, hands, formats=("png", "palette", "webp"), scales=(1.0, 0.6)):
+    # よくある5枚の手札について、形式と縮尺ごとに平均バイト数と描画＋エンコード時間を比べる
+    # キャッシュは通さず、毎回 render_hand_png を呼ぶ（縮小済みカードの準備は計測前に済ませる）
+    rng = random.Random(0)
+    samples = [tuple(rng.sample(main.CARD_DECK, 5)) for _ in range(hands)]
+    main.load_card_images()
+    for scale in scales:
+        for name in main.CARD_DECK:
+            main.get_scaled_card(name, scale)
+        for fmt in formats:
+            sizes, times = [], []
+            for cards in samples:
+                start = time.perf_counter()
+                data = main.render_hand_png(cards, scale, fmt)
+                times.append((time.perf_counter() - start) * 1000)
+                sizes.append(len(data))
+            stats = percentiles(times)
+            print(f"🖼️ {fmt:7} ×{scale:.1f}：平均 {sum(sizes) / len(sizes) / 1024:.1f} KB"
+                  f" / p50 {stats['p50']:.1f} ms / p95 {stats['p95']:.1f} ms")
+    print(f"（{hands} ハンド、HAND_IMAGE_QUALITY={main.HAND_IMAGE_QUALITY}）")
+
+def compare(results, baseline):
+    # p95 が基準より 20% 以上悪化したフェーズを表示する
+    previous = {r["tables"]: r for r in baseline}
+    for result in results:
+        base = previous.get(result["tables"])
+        if not base:
+            continue
+        for name, stats in result["phases_ms"].items():
+            old = base["phases_ms"].get(name)
+            if old and old["p95"] > 0 and stats["p95"] > old["p95"] * 1.2:
+                print(f"⚠️ {result['tables']} 卓 {name}: p95 {old['p95']:.1f} → {stats['p95']:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="偽の Discord クライアントによる負荷試験")
+    parser.add_argument("--tables", default="1,10,100", help="卓の数（カンマ区切りで段階的に）")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--think-ms", type=float, default=200)
+    parser.add_argument("--output", help="結果を保存する JSON ファイル")
+    parser.add_argument("--compare", help="比較する基準の JSON ファイル")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--player-threads", action="store_true", help="DM の代わりに本人専用スレッドを使う")
+    parser.add_argument("--journal-hands", type=int, help="卓ジャーナルの再生速度だけを測る（ハンド数）")
+    parser.add_argument("--ranking-users", type=int, help="順位表の速度だけを測る（ユーザー数）")
+    parser.add_argument("--evaluate-hands", type=int, help="役判定の速度だけを測る（ハンド数）")
+    parser.add_argument("--ledger-users", help="台帳の1操作あたりの時間だけを測る（ユーザー数、カンマ区切り）")
+    parser.add_argument("--settle-players", help="ポット精算の速度だけを測る（人数、カンマ区切り）")
+    parser.add_argument("--image-hands", type=int, help="手札画像のエンコードだけを測る（ハンド数）")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    repo = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo)
+    if args.evaluate_hands:
+        evaluate_benchmark(args.evaluate_hands)
+        return
+    if args.settle_players:
+        settle_benchmark([int(n) for n in args.settle_players.split(",")])
+        return
+    os.environ.setdefault("LEDGER_FSYNC", "0")
+    os.chdir(tempfile.mkdtemp(prefix="loadtest-"))  # 台帳ファイルは一時ディレクトリに作る
+    import main as bot_main
+    if args.player_threads:
+        bot_main.USE_PLAYER_THREADS = True
+
+    if args.journal_hands:
+        journal_benchmark(bot_main, args.journal_hands, args.players)
+        return
+    if args.ranking_users:
+        ranking_benchmark(bot_main, args.ranking_users)
+        return
+    if args.ledger_users:
+        ledger_benchmark(bot_main, [int(n) for n in args.ledger_users.split(",")])
+        return
+    if args.image_hands:
+        image_benchmark(bot_main, args.image_hands)
+        return
+
+    # 段階はすべて1つのイベントループで測る（main のセマフォなどはループに結びつくため）
+    async def sweep():
+        results = []
+        for tables in (int(t) for t in args.tables.split(",")):
+            result = await run(bot_main, tables, args.players, args.think_ms)
+            results.append(result)
+            hand = result["phases_ms"].get("hand", {})
+            print(f"🃏 {tables} 卓：{result['elapsed_s']:.1f} 秒 / ハンド p50 {hand.get('p50', 0):.0f} ms p95 {hand.get('p95', 0):.0f} ms"
+                  f" / ループ遅延 p99 {result['loop_lag_ms']['p99']:.1f} ms / 台帳 読 {result['ledger']['reads']} 書 {result['ledger']['writes']}"
+                  f" / 最大RSS {result['peak_rss_mb']:.0f} MB")
+        return results
+
+    results = asyncio.run(sweep())
+
+    if args.output:
+        with open(os.path.join(repo, args.output), "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(os.path.join(repo, args.compare), "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
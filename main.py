@@ -1,180 +1,1331 @@
+import time
+BOOT_STARTED_AT = time.perf_counter()
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import os
+import sys
 import json 
 from keep_alive import keep_alive
+from hand_history import HandHistory
+from tournament import Seating
+import metrics
+from poker_engine import (
+    CARD_DECK, ENTRY_FEE, HAND_NAMES, DictWallet, PokerTable, RuleError,
+    discard_odds, hand_category, int_to_card, uncalled_bet,
+)
 import random
-from PIL import Image
 import io
-import aiohttp
 import asyncio
+import re
+import hashlib
+import shutil
+import sqlite3
+import bisect
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+# PIL と aiohttp は画像を描画・取得するときに初めて読み込む（起動を速くするため）
+BOOT_TIMES = {"import": time.perf_counter() - BOOT_STARTED_AT}
 
 VIRTUALCRYPTO_ID = 800892182633381950
 
-# カード定義
-CARD_SUITS = ['spades', 'hearts', 'clubs', 'diamonds']
-CARD_NUMBERS = [str(i) for i in range(2, 11)] + ['J', 'Q', 'K', 'A']
-CARD_DECK = [f"{suit}_{number}" for suit in CARD_SUITS for number in CARD_NUMBERS]
 CARD_IMAGE_BASE_URL = "https://raw.githubusercontent.com/yuuyuu661/bot5/main/cards/"
 
+# 計測（METRICS_ENABLED=1 のときだけ記録し、/metrics で公開する）
+COMMAND_LATENCY = metrics.Histogram("poker_command_seconds", "Slash command handling time", ("command",))
+VIEW_LATENCY = metrics.Histogram("poker_view_callback_seconds", "Button callback handling time", ("view",))
+RENDER_LATENCY = metrics.Histogram("poker_image_seconds", "Card image creation time", ("image",))
+EVALUATE_LATENCY = metrics.Histogram("poker_evaluate_seconds", "Hand evaluation time", ("stage",))
+LEDGER_LATENCY = metrics.Histogram("poker_ledger_seconds", "Ledger read/write time", ("op",),
+                                   buckets=(0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+DISCORD_API_CALLS = metrics.Counter("discord_api_requests_total", "Discord REST API requests (status 429 = rate limited)",
+                                    ("method", "status"))
+
+def discord_http_trace():
+    import aiohttp
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_end(session, context, params):
+        DISCORD_API_CALLS.inc(method=params.method, status=params.response.status)
+
+    async def on_request_exception(session, context, params):
+        DISCORD_API_CALLS.inc(method=params.method, status="error")
+
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+# シャード：SHARD_COUNT を指定しなければ Discord の推奨数で自動分割する
+# SHARD_IDS（例 "0,1"）と SHARD_COUNT を指定して一部のシャードだけを担当すれば、複数のプロセスに分けて動かせる
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(i) for i in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+# プロセスごとに持つファイル（卓の記録・ハンド履歴）の名前に付ける印。台帳と換金申請は CURRENCY_BACKEND=sqlite で共有する
+# 割り当てを変えて取り残された別の印のファイルは、担当シャードが重なるプロセスが起動時に引き継ぐ
+PROCESS_TAG = "-shards-" + "-".join(map(str, SHARD_IDS)) if SHARD_IDS else ""
+
+def process_tags(prefix, suffix=""):
+    # 作業ディレクトリにある「prefix＋印＋suffix」のファイル・ディレクトリの印の一覧（印なしは ""）
+    pattern = re.compile(re.escape(prefix) + r"(-shards-\d+(?:-\d+)*)?" + re.escape(suffix))
+    return sorted(m.group(1) or "" for m in map(pattern.fullmatch, os.listdir(".")) if m)
+
+def orphaned_tags(prefix, suffix=""):
+    # シャードの割り当てを変えて取り残された、担当シャードが今のプロセスと重なる別の印
+    tags = []
+    for tag in process_tags(prefix, suffix):
+        shards = set(map(int, tag.split("-")[2:])) if tag else None
+        if tag != PROCESS_TAG and (shards is None or SHARD_IDS is None or shards & set(SHARD_IDS)):
+            tags.append(tag)
+    return tags
+
+def claim(name):
+    # 引き継ぐファイルに印を付け、同じファイルを複数のプロセスが取り込まないようにする
+    marker = f"{name}.claimed"
+    owner = PROCESS_TAG or "-all"
+    try:
+        fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        with open(marker, "r", encoding="utf-8") as f:
+            if f.read() == owner:
+                return True  # 前回の引き継ぎが途中で止まっていた
+        print(f"⚠️ {name} は別のプロセスが引き継ぎ中のため取り込みません（{marker}）")
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(owner)
+    return True
+
+def release(name):
+    os.remove(f"{name}.claimed")
+
 # Botセットアップ
-intents = discord.Intents.default()
+# メンバー一覧は使わないので members インテントとメンバーキャッシュは切り、起動時のメンバー取得もしない
+# message_content はベット額・交換カードの入力と VirtualCrypto の送金通知を読むために必要
+intents = discord.Intents.none()
+intents.guilds = True
+intents.guild_messages = True
+intents.dm_messages = True
 intents.message_content = True
-intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = commands.AutoShardedBot(
+    command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+    member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False, max_messages=None,
+    allowed_contexts=app_commands.AppCommandContext(guild=True),
+    http_trace=discord_http_trace() if metrics.ENABLED else None,
+)
 
-GUILD_ID = 1398607685158440991
-POKER_GAMES = {}
+GUILD_ID = 1398607685158440991  # 最初に導入したサーバー（既存の換金申請はこのサーバーのものとして扱う）
 
-CURRENCY_FILE = "currency.json"
+def shard_of(guild_id):
+    # Discord と同じ規則でサーバーの担当シャードを求める
+    return (guild_id >> 22) % (bot.shard_count or 1) if guild_id else 0
 
-def load_currency():
-    if not os.path.exists(CURRENCY_FILE):
+CURRENCY_FILE = "currency.json"
+CURRENCY_JOURNAL_FILE = "currency.journal"
+CURRENCY_DB_FILE = "currency.db"
+CURRENCY_BACKEND = os.environ.get("CURRENCY_BACKEND", "ledger")  # "ledger"（ジャーナル方式）/ "json"（従来方式）/ "sqlite"（複数プロセスで共有）
+LEDGER_COMPACT_EVERY = 1000   # この件数ごとにスナップショットを書き出してジャーナルを圧縮
+LEDGER_FSYNC = os.environ.get("LEDGER_FSYNC", "1") == "1"
+LEDGER_SEQ_KEY = "__ledger_seq__"  # スナップショットに含まれる最終ジャーナル番号
+
+def load_currency(path=CURRENCY_FILE):
+    if not os.path.exists(path):
         return {}
-    with open(CURRENCY_FILE, "r", encoding="utf-8") as f:
+    with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def save_currency(data):
-    with open(CURRENCY_FILE, "w", encoding="utf-8") as f:
+def save_currency(data, path=CURRENCY_FILE):
+    # 一時ファイルに書いてから置き換える（書き込み途中で落ちても壊れない）
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# 残高の順位表：(-残高, ユーザーID) を小さなソート済みバケットに分けて保持する
+# 更新はバケット内の挿入・削除だけで済み、順位はバケットの長さを足すだけで求まる（残高0のユーザーは載せない）
+RANK_BUCKET_SIZE = 512
+
+class BalanceIndex:
+    def __init__(self, balances=()):
+        items = sorted((-amount, uid) for uid, amount in balances if amount > 0)
+        self.buckets = [items[i:i + RANK_BUCKET_SIZE] for i in range(0, len(items), RANK_BUCKET_SIZE)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.size = len(items)
+
+    def __len__(self):
+        return self.size
+
+    def _locate(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        return min(i, len(self.buckets) - 1)
+
+    def insert(self, key):
+        self.size += 1
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            return
+        i = self._locate(key)
+        bucket = self.buckets[i]
+        bisect.insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > RANK_BUCKET_SIZE * 2:
+            half = bucket[RANK_BUCKET_SIZE:]
+            del bucket[RANK_BUCKET_SIZE:]
+            self.buckets.insert(i + 1, half)
+            self.maxes[i] = bucket[-1]
+            self.maxes.insert(i + 1, half[-1])
+
+    def remove(self, key):
+        i = self._locate(key)
+        bucket = self.buckets[i]
+        j = bisect.bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return
+        del bucket[j]
+        self.size -= 1
+        if bucket:
+            self.maxes[i] = bucket[-1]
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+
+    def update(self, user_id, old, new):
+        if old > 0:
+            self.remove((-old, user_id))
+        if new > 0:
+            self.insert((-new, user_id))
+
+    def rank(self, user_id, balance):
+        # 1始まりの順位（残高0なら None）
+        if balance <= 0 or not self.buckets:
+            return None
+        key = (-balance, user_id)
+        i = self._locate(key)
+        return sum(len(bucket) for bucket in self.buckets[:i]) + bisect.bisect_left(self.buckets[i], key) + 1
+
+    def top(self, k):
+        # [(ユーザーID, 残高), ...] を残高の多い順に k 件
+        result = []
+        for bucket in self.buckets:
+            for amount, user_id in bucket:
+                if len(result) >= k:
+                    return result
+                result.append((user_id, -amount))
+        return result
+
+# 従来方式：毎回 currency.json を読み書きする
+class JsonCurrencyStore:
+    def __init__(self, path=CURRENCY_FILE, journal_file=CURRENCY_JOURNAL_FILE):
+        self.path = path
+        self.journal_file = journal_file
+        self.loaded = False
+
+    def load(self):
+        # ジャーナル方式から戻したときは、スナップショットにまだ入っていないジャーナルの変更を取り込んでから使う
+        # （取り込んだらジャーナルを消す。残すとジャーナル方式に戻したときに二重に適用される）
+        if os.path.exists(self.journal_file):
+            ledger = CurrencyLedger(self.path, self.journal_file)
+            ledger.load()
+            ledger.journal.close()
+            save_currency(ledger.balances, self.path)
+            os.remove(self.journal_file)
+        self.read()
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def read(self):
+        # ジャーナル方式のスナップショットに残っている最終ジャーナル番号は口座ではないので除く
+        data = load_currency(self.path)
+        data.pop(LEDGER_SEQ_KEY, None)
+        return data
+
+    @metrics.timed(LEDGER_LATENCY, op="read")
+    def get(self, user_id):
+        self._ensure_loaded()
+        return self.read().get(str(user_id), 0)
+
+    @metrics.timed(LEDGER_LATENCY, op="write")
+    def apply(self, changes):
+        self._ensure_loaded()
+        data = self.read()
+        for uid, delta in changes:
+            if data.get(str(uid), 0) + delta < 0:
+                return False
+        for uid, delta in changes:
+            data[str(uid)] = data.get(str(uid), 0) + delta
+        save_currency(data, self.path)
+        return True
+
+    def ranking(self):
+        # 従来方式では順位表を保持しないので、毎回読み込んで作る
+        self._ensure_loaded()
+        return BalanceIndex(self.read().items())
+
+    def totals(self):
+        if not self.loaded:
+            return {"backend": "json", "loaded": False}
+        data = self.read()
+        return {"backend": "json", "loaded": True, "accounts": len(data), "total": sum(data.values())}
+
+# ジャーナル方式：残高はメモリに保持し、変更は追記専用ジャーナルに1行ずつ記録
+# currency.json はスナップショットとして使うので、既存ファイルはそのまま移行される
+class CurrencyLedger:
+    def __init__(self, snapshot_file=CURRENCY_FILE, journal_file=CURRENCY_JOURNAL_FILE, compact_every=LEDGER_COMPACT_EVERY):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.balances = {}
+        self.index = BalanceIndex()
+        self.seq = 0
+        self.pending = 0
+        self.journal = None
+        self.loaded = False
+
+    def load(self):
+        data = load_currency(self.snapshot_file)
+        base_seq = data.pop(LEDGER_SEQ_KEY, 0)
+        self.balances = data
+        self.seq = base_seq
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # 書き込み途中でクラッシュした末尾行は無視
+                    if entry["seq"] <= base_seq:
+                        continue
+                    for uid, delta in entry["ops"]:
+                        self.balances[uid] = self.balances.get(uid, 0) + delta
+                    self.seq = entry["seq"]
+        self.index = BalanceIndex(self.balances.items())
+        self.compact()
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if self.journal is None:
+            self.load()
+
+    @metrics.timed(LEDGER_LATENCY, op="read")
+    def get(self, user_id):
+        self._ensure_loaded()
+        return self.balances.get(str(user_id), 0)
+
+    @metrics.timed(LEDGER_LATENCY, op="write")
+    def apply(self, changes):
+        # changes: [(user_id, 増減額), ...] を1件のジャーナル行として原子的に適用
+        self._ensure_loaded()
+        ops = [(str(uid), delta) for uid, delta in changes]
+        after = {}
+        for uid, delta in ops:
+            after[uid] = after.get(uid, self.balances.get(uid, 0)) + delta
+            if after[uid] < 0:
+                return False
+
+        self.seq += 1
+        self.journal.write(json.dumps({"seq": self.seq, "ops": ops}, separators=(",", ":")) + "\n")
+        self.journal.flush()
+        if LEDGER_FSYNC:
+            os.fsync(self.journal.fileno())
+        for uid, balance in after.items():
+            self.index.update(uid, self.balances.get(uid, 0), balance)
+        self.balances.update(after)
+
+        self.pending += 1
+        if self.pending >= self.compact_every:
+            self.compact()
+        return True
+
+    @metrics.timed(LEDGER_LATENCY, op="compact")
+    def compact(self):
+        # スナップショットを書き出した後でジャーナルを空にする
+        # （間で落ちても seq により二重適用されない）
+        if self.journal:
+            self.journal.close()
+        snapshot = dict(self.balances)
+        snapshot[LEDGER_SEQ_KEY] = self.seq
+        save_currency(snapshot, self.snapshot_file)
+        self.journal = open(self.journal_file, "w", encoding="utf-8")
+        self.pending = 0
+
+    def ranking(self):
+        self._ensure_loaded()
+        return self.index
+
+    def totals(self):
+        # 監視用の集計では読み込みを起こさない
+        if not self.loaded:
+            return {"backend": "ledger", "loaded": False}
+        return {"backend": "ledger", "loaded": True, "accounts": len(self.balances), "total": sum(self.balances.values()),
+                "seq": self.seq, "journal_entries": self.pending}
+
+# SQLite 方式：複数のプロセス（シャードの分割）で1つの台帳を共有する
+# WAL モードで読み取りは書き込みを待たず、更新は BEGIN IMMEDIATE でプロセス間でも1件ずつ原子的に行う
+# ロック待ちはイベントループを止めるので短く切り上げて LedgerBusy にし、呼び出し側が await で待ってやり直す
+LEDGER_BUSY_TIMEOUT = int(os.environ.get("LEDGER_BUSY_TIMEOUT", "50"))  # 他のプロセスの書き込みを同期的に待つ上限（ミリ秒）
+LEDGER_RETRY_DELAYS = (0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 3.2)              # LedgerBusy のときに待つ間隔（秒）
+
+class LedgerBusy(Exception):
+    """台帳が他のプロセスの書き込みでロックされている。何も変更していないので、少し待てばやり直せる"""
+
+def sqlite_busy(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+async def retry_ledger(func, *args):
+    # 台帳に触れる同期処理を、LedgerBusy の間はループを止めずに待ってから呼び直す
+    for delay in LEDGER_RETRY_DELAYS:
+        try:
+            return func(*args)
+        except LedgerBusy:
+            await asyncio.sleep(delay)
+    return func(*args)
+
+class SqliteCurrencyStore:
+    def __init__(self, path=CURRENCY_DB_FILE):
+        self.path = path
+        self.db = None
+        self.loaded = False
+
+    def load(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, isolation_level=None)
+            self.db.execute(f"PRAGMA busy_timeout={LEDGER_BUSY_TIMEOUT}")
+        try:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(f"PRAGMA synchronous={'FULL' if LEDGER_FSYNC else 'NORMAL'}")
+            self.db.execute("CREATE TABLE IF NOT EXISTS balances (uid TEXT PRIMARY KEY, amount INTEGER NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS balances_rank ON balances (amount DESC, uid)")
+            # 初回はジャーナル方式の残高をそのまま取り込む
+            self.begin()
+        except sqlite3.OperationalError as e:
+            if not sqlite_busy(e):
+                raise
+            raise LedgerBusy(str(e)) from e
+        try:
+            if self.db.execute("SELECT COUNT(*) FROM balances").fetchone()[0] == 0 and os.path.exists(CURRENCY_FILE):
+                ledger = CurrencyLedger()
+                ledger.load()
+                self.db.executemany("INSERT INTO balances VALUES (?, ?)", ledger.balances.items())
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def begin(self):
+        # 書き込みのロックを取る。他のプロセスが書き込み中で取れなければ LedgerBusy（まだ何も変更していない）
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if not sqlite_busy(e):
+                raise
+            raise LedgerBusy(str(e)) from e
+
+    @metrics.timed(LEDGER_LATENCY, op="read")
+    def get(self, user_id):
+        self._ensure_loaded()
+        row = self.db.execute("SELECT amount FROM balances WHERE uid = ?", (str(user_id),)).fetchone()
+        return row[0] if row else 0
+
+    @metrics.timed(LEDGER_LATENCY, op="write")
+    def apply(self, changes):
+        self._ensure_loaded()
+        ops = [(str(uid), delta) for uid, delta in changes]
+        self.begin()
+        try:
+            if not self.change_balances(ops):
+                self.db.execute("ROLLBACK")
+                return False
+            self.db.execute("COMMIT")
+        except BaseException:
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK")
+            raise
+        return True
+
+    def change_balances(self, ops):
+        # begin() の後に呼ぶ。残高が足りなければ何も書かずに False（出金キューと同じトランザクションで使う）
+        after = {}
+        for uid, delta in ops:
+            uid = str(uid)
+            if uid not in after:
+                row = self.db.execute("SELECT amount FROM balances WHERE uid = ?", (uid,)).fetchone()
+                after[uid] = row[0] if row else 0
+            after[uid] += delta
+            if after[uid] < 0:
+                return False
+        self.db.executemany("INSERT INTO balances VALUES (?, ?) ON CONFLICT(uid) DO UPDATE SET amount = excluded.amount",
+                            after.items())
+        return True
+
+    def ranking(self):
+        self._ensure_loaded()
+        return SqliteRanking(self.db)
+
+    def totals(self):
+        if not self.loaded:
+            return {"backend": "sqlite", "loaded": False}
+        accounts, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM balances").fetchone()
+        return {"backend": "sqlite", "loaded": True, "accounts": accounts, "total": total}
+
+# 順位は他のプロセスの更新も反映させるため、メモリに持たず毎回インデックスを引く（BalanceIndex と同じ並び順）
+class SqliteRanking:
+    def __init__(self, db):
+        self.db = db
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM balances WHERE amount > 0").fetchone()[0]
+
+    def rank(self, user_id, balance):
+        if balance <= 0:
+            return None
+        query = "SELECT COUNT(*) FROM balances WHERE amount > ? OR (amount = ? AND uid < ?)"
+        return self.db.execute(query, (balance, balance, user_id)).fetchone()[0] + 1
+
+    def top(self, k):
+        query = "SELECT uid, amount FROM balances WHERE amount > 0 ORDER BY amount DESC, uid LIMIT ?"
+        return self.db.execute(query, (k,)).fetchall()
+
+CURRENCY_STORES = {"json": JsonCurrencyStore, "ledger": CurrencyLedger, "sqlite": SqliteCurrencyStore}
+if CURRENCY_BACKEND not in CURRENCY_STORES:
+    # 名前を間違えたまま別の台帳で動くと残高が消えたように見えるので、黙って既定に戻さず止める
+    raise ValueError(f"CURRENCY_BACKEND={CURRENCY_BACKEND!r} は使えません（{' / '.join(CURRENCY_STORES)} のどれかを指定してください）")
+CURRENCY = CURRENCY_STORES[CURRENCY_BACKEND]()
 
 def get_balance(user_id):
-    data = load_currency()
-    return data.get(str(user_id), 0)
+    return CURRENCY.get(user_id)
 
 def add_balance(user_id, amount):
-    data = load_currency()
-    uid = str(user_id)
-    data[uid] = data.get(uid, 0) + amount
-    save_currency(data)
+    CURRENCY.apply([(user_id, amount)])
 
 def subtract_balance(user_id, amount):
-    data = load_currency()
-    uid = str(user_id)
-    if data.get(uid, 0) >= amount:
-        data[uid] -= amount
-        save_currency(data)
-        return True
-    return False
-
-def evaluate_hand(cards):
-    values_order = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
-                    '7': 7, '8': 8, '9': 9, '10': 10,
-                    'J': 11, 'Q': 12, 'K': 13, 'A': 14}
-    suits = [c.split('_')[0] for c in cards]
-    values = sorted([values_order[c.split('_')[1]] for c in cards])
-    counts = {v: values.count(v) for v in set(values)}
-
-    is_flush = len(set(suits)) == 1
-    is_straight = values == list(range(min(values), max(values)+1))
-
-    if is_flush and is_straight:
-        return (8, max(values))  # ストレートフラッシュ
-    elif 4 in counts.values():
-        return (7, max(k for k, v in counts.items() if v == 4))  # フォーカード
-    elif sorted(counts.values()) == [2, 3]:
-        return (6, max(k for k, v in counts.items() if v == 3))  # フルハウス
-    elif is_flush:
-        return (5, max(values))  # フラッシュ
-    elif is_straight:
-        return (4, max(values))  # ストレート
-    elif 3 in counts.values():
-        return (3, max(k for k, v in counts.items() if v == 3))  # スリーカード
-    elif list(counts.values()).count(2) == 2:
-        return (2, max(k for k, v in counts.items() if v == 2))  # ツーペア
-    elif 2 in counts.values():
-        return (1, max(k for k, v in counts.items() if v == 2))  # ワンペア
-    else:
-        return (0, max(values))  # ハイカード
-# ゲーム状態クラス
-class PokerGameState:
-    def __init__(self, owner_id):
-        self.owner_id = owner_id
+    return CURRENCY.apply([(user_id, -amount)])
+
+def subtract_balances(user_ids, amount):
+    # 支払える人だけをまとめて1回の更新で引き落とし、支払えた人のIDを返す
+    paid = [uid for uid in user_ids if get_balance(uid) >= amount]
+    if paid and not CURRENCY.apply([(uid, -amount) for uid in paid]):
+        return []
+    return paid
+
+def add_balances(payouts):
+    # {user_id: 金額} をまとめて1回の更新で加算
+    changes = [(uid, amount) for uid, amount in payouts.items() if amount]
+    if changes:
+        CURRENCY.apply(changes)
+
+# エンジンから使う残高操作（台帳への橋渡し）
+class LedgerWallet:
+    def balance(self, user_id):
+        return get_balance(user_id)
+
+    def subtract(self, user_id, amount):
+        return subtract_balance(user_id, amount)
+
+    def subtract_many(self, user_ids, amount):
+        return subtract_balances(user_ids, amount)
+
+    def add_many(self, payouts):
+        add_balances(payouts)
+
+LEDGER_WALLET = LedgerWallet()
+
+# 交換シミュレーションは1ハンドあたり約 90 ms の純 Python の計算で、スレッドでは GIL を握ってループを止めてしまう
+# そのため別プロセスで実行する（forkserver：ループやスレッドを抱えたこのプロセスを直接 fork しない）
+ODDS_WORKERS = int(os.environ.get("ODDS_WORKERS", "2"))
+_odds_executor = None
+
+def get_odds_executor():
+    global _odds_executor
+    if _odds_executor is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _odds_executor = ProcessPoolExecutor(max_workers=ODDS_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _odds_executor
+
+def warm_odds_workers():
+    # 子プロセスの起動（forkserver の初回は import を含む）を最初の交換フェーズより前に済ませておく
+    executor = get_odds_executor()
+    return [executor.submit(len, ()) for _ in range(ODDS_WORKERS)]
+
+@metrics.timed(EVALUATE_LATENCY, stage="discard_odds")
+async def compute_discard_odds(hand):
+    global _odds_executor
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_odds_executor(), discard_odds, list(hand))
+    except BrokenProcessPool:
+        _odds_executor = None  # 子プロセスが落ちたら次回作り直す
+        raise
+
+async def format_discard_odds(hand, top=3):
+    results = await compute_discard_odds(hand)
+    lines = ["📊 **交換シミュレーション**（期待役が高い順）"]
+    for positions, expected, distribution in results[:top]:
+        label = ",".join(map(str, positions)) if positions else "交換なし"
+        likely = max(range(len(distribution)), key=distribution.__getitem__)
+        lines.append(f"・`{label}` → 期待値 {expected:.2f}（最多：{HAND_NAMES[likely]} {distribution[likely]:.0%}）")
+    return "\n".join(lines)
+
+# 入力待ちディスパッチャ：bot.wait_for の述語を全メッセージに当てる代わりに、辞書引きで待ち手に届ける
+DEPOSIT_PATTERN = re.compile(r"<@!?(\d+)>から<@!?(\d+)>へ\D*?([\d,]+)")
+
+def parse_deposit(message):
+    # VirtualCrypto の送金通知から (送金者, 受取人, 金額) を取り出す
+    description = message.embeds[0].description if message.embeds else ""
+    if not description or "Spt" not in description:
+        return None
+    match = DEPOSIT_PATTERN.search(description)
+    if not match:
+        return None
+    sender, recipient, amount = match.groups()
+    return int(sender), int(recipient), int(amount.replace(",", ""))
+
+class InputDispatcher:
+    def __init__(self):
+        self.texts = {}       # (チャンネルID または DMなら None, 発言者ID) -> 待ち手
+        self.deposits = {}    # (送金者ID, 受取人ID, 金額) -> 待ち手
+        self.consumed = deque(maxlen=1000)  # 処理済みの送金通知メッセージID
+
+    async def _wait(self, table, key, timeout):
+        future = asyncio.get_running_loop().create_future()
+        table.setdefault(key, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = table.get(key)
+            if waiters is not None:
+                if future in waiters:
+                    waiters.remove(future)
+                if not waiters:
+                    del table[key]
+
+    def wait_text(self, author_id, channel_id=None, timeout=None):
+        return self._wait(self.texts, (channel_id, author_id), timeout)
+
+    def wait_deposit(self, sender_id, recipient_id, amount, timeout=None):
+        return self._wait(self.deposits, (sender_id, recipient_id, amount), timeout)
+
+    def _deliver(self, table, key, message):
+        for future in table.get(key, ()):
+            if not future.done():
+                future.set_result(message)
+                return True
+        return False
+
+    def dispatch(self, message):
+        if message.author.id == VIRTUALCRYPTO_ID:
+            key = parse_deposit(message)
+            # 1件の送金通知は1件のチャージにだけ使う
+            if key and message.id not in self.consumed and self._deliver(self.deposits, key, message):
+                self.consumed.append(message.id)
+            return
+        channel_id = message.channel.id if message.guild else None
+        self._deliver(self.texts, (channel_id, message.author.id), message)
+
+    def pending_count(self):
+        return sum(len(w) for w in list(self.texts.values())) + sum(len(w) for w in list(self.deposits.values()))
+
+INPUTS = InputDispatcher()
+metrics.Gauge("poker_pending_inputs", "Pending text and deposit waiters", INPUTS.pending_count)
+
+@bot.listen("on_message")
+async def dispatch_inputs(message: discord.Message):
+    if message.author != bot.user:
+        INPUTS.dispatch(message)
+
+# 卓の記録：卓で起きた出来事を追記専用ジャーナルに1行ずつ書き、定期的にスナップショットにまとめる
+# 再起動時は進行中だったハンドの拠出額を返金し、募集中の卓と参加ボタンを元のチャンネルに復元する
+TABLE_JOURNAL_FILE = f"tables{PROCESS_TAG}.journal"
+TABLE_SNAPSHOT_FILE = f"tables{PROCESS_TAG}.json"
+TABLE_JOURNAL_COMPACT_EVERY = 5000
+MONEY_EVENTS = ("bet", "call", "allin", "raise", "buyin")
+
+class TableJournal:
+    def __init__(self, snapshot_file=TABLE_SNAPSHOT_FILE, journal_file=TABLE_JOURNAL_FILE, compact_every=TABLE_JOURNAL_COMPACT_EVERY):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.tables = {}    # チャンネルID(文字列) -> 卓の記録
+        self.seq = 0
+        self.pending = 0
+        self.journal = None
+
+    def apply(self, channel_id, kind, player, amount, data):
+        # 1件の出来事を卓の記録に反映する（書き込み時と再生時で同じ処理）
+        if kind == "open":
+            self.tables[channel_id] = {"owner": player, "players": [], "started": False, "contributions": {}, "message": None,
+                                       "tournament": data == "tournament"}
+            return
+        table = self.tables.get(channel_id)
+        if table is None:
+            return
+        contributions = table["contributions"]
+        if kind == "close":
+            del self.tables[channel_id]
+        elif kind == "reopen":
+            table["owner"] = player
+            table["players"] = []
+        elif kind == "message":
+            table["message"] = data
+        elif kind == "join":
+            table["players"].append(player)
+        elif kind == "deal":
+            table["started"] = True
+        elif kind == "fees":
+            for pid in data:
+                contributions[str(pid)] = contributions.get(str(pid), 0) + amount
+        elif kind in MONEY_EVENTS:
+            contributions[str(player)] = contributions.get(str(player), 0) + amount
+        elif kind in ("settle", "abort"):
+            table["started"] = False
+            table["contributions"] = {}
+
+    def load(self):
+        data = load_currency(self.snapshot_file)
+        self.seq = base_seq = data.get("seq", 0)
+        self.tables = data.get("tables", {})
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        seq, channel_id, kind, player, amount, data = json.loads(line)
+                    except ValueError:
+                        break  # 書き込み途中でクラッシュした末尾行は無視
+                    if seq <= base_seq:
+                        continue
+                    self.apply(channel_id, kind, player, amount, data)
+                    self.seq = seq
+        self.compact()
+
+    def _ensure_loaded(self):
+        if self.journal is None:
+            self.load()
+
+    def write(self, channel_id, kind, player=None, amount=0, data=None):
+        self._ensure_loaded()
+        self.seq += 1
+        self.apply(channel_id, kind, player, amount, data)
+        # お金の動きは台帳側でも記録しているので、ここでは flush だけにして書き込みを軽くする
+        self.journal.write(json.dumps([self.seq, channel_id, kind, player, amount, data], separators=(",", ":")) + "\n")
+        self.journal.flush()
+        self.pending += 1
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def record(self, table, event):
+        # PokerTable の listener として使う
+        self.write(str(table.channel_id), event.kind, event.player, event.amount, event.data)
+
+    def compact(self):
+        if self.journal:
+            self.journal.close()
+        save_currency({"seq": self.seq, "tables": self.tables}, self.snapshot_file)
+        self.journal = open(self.journal_file, "w", encoding="utf-8")
+        self.pending = 0
+
+    def recover(self):
+        # 進行中だったハンドを返金して中止し、(チャンネルID, 卓の記録, 返金額) を返す
+        self._ensure_loaded()
+        recovered = []
+        for channel_id, table in list(self.tables.items()):
+            refunds = {int(pid): amount for pid, amount in table["contributions"].items() if amount}
+            if refunds:
+                add_balances(refunds)
+                self.write(channel_id, "abort", amount=sum(refunds.values()), data=list(refunds.items()))
+            elif table["started"]:
+                self.write(channel_id, "abort")
+            recovered.append((channel_id, table, sum(refunds.values())))
+        self.compact()
+        return recovered
+
+TABLE_JOURNAL = TableJournal()
+HAND_HISTORY = HandHistory(directory=f"history{PROCESS_TAG}")
+
+def record_table_event(table, event):
+    # 卓の出来事を卓ジャーナルとハンド履歴の両方に渡す
+    TABLE_JOURNAL.record(table, event)
+    HAND_HISTORY.record(table, event)
+
+# 卓のアクター：卓の状態を変える操作は卓ごとのキューに積み、1つのタスクが順番に実行する
+# ボタンやコマンドの処理は操作を送って結果を待つだけなので、同じ卓への同時操作が混ざらない
+class TableActor:
+    def __init__(self, game):
+        self.game = game
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.closed = False
+
+    async def _run(self):
+        while True:
+            func, args, future = await self.queue.get()
+            if future.done():
+                continue  # 送った側が待つのをやめた
+            try:
+                # 操作は台帳を変更する前にだけ LedgerBusy になるので、待っている間も他の卓は進み、そのまま呼び直せる
+                result = await retry_ledger(func, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def send(self, func, *args):
+        if self.closed:
+            raise RuleError("このゲームはすでに終了しています。")
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((func, args, future))
+        return await future
+
+    def close(self):
+        self.closed = True
+        if self.task:
+            self.task.cancel()
+        while not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuleError("このゲームはすでに終了しています。"))
+
+# ゲーム状態クラス（ルールは PokerTable、ここでは Discord 側の付帯情報だけを持つ）
+class PokerGameState(PokerTable):
+    __slots__ = ("channel_id", "last_active", "views", "status", "actor", "hand_task", "tournament", "unit",
+                 "player_channels")
+
+    def __init__(self, owner_id, channel_id, wallet=LEDGER_WALLET, tournament=None, entry_fee=ENTRY_FEE):
+        super().__init__(owner_id, wallet, entry_fee=entry_fee)
+        self.channel_id = channel_id
+        self.tournament = tournament   # トーナメントの卓なら Tournament（チップで遊び、記録・返金の対象にしない）
+        self.unit = "チップ" if tournament else "Spt"
+        self.listener = None if tournament else record_table_event
+        self.views = set()        # この卓で待機中のView（卓の破棄時に停止する）
+        self.status = None        # 卓の状況表示メッセージ（TableStatus）
+        self.actor = TableActor(self)
+        self.hand_task = None     # 進行中のハンドを処理しているタスク（中止時にキャンセルする）
+        self.player_channels = {} # プレイヤーID -> 本人専用スレッドを作るタスク（スレッドを使うときだけ）
+        self.touch()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def seat(self, players):
+        # トーナメントの卓：次のハンドの参加者を席割りに合わせる
+        if self.started:
+            raise RuleError("ハンドの途中では席を変更できません。")
+        self.players = list(players)
+
+    def reopen(self, owner_id):
+        # 未開始の卓で参加者を募集し直す
+        if self.started:
+            raise RuleError("このチャンネルではすでにポーカーが進行中です。")
         self.players = []
-        self.started = False
-        self.turn_index = 0
-        self.folded = set()
-        self.bets = {}
-        self.pot = 0
-        self.round_bets = {}      # 各プレイヤーがこのラウンドで賭けた額
-        self.current_bet = 0      # 現在の最高ベット額
-        self.first_round = True   # 一巡目フラグ
-        self.hands = {}  # ← 追加：プレイヤーの手札保存用
-        
-async def exchange_cards(interaction: discord.Interaction, game: PokerGameState, deck: list):
-    await interaction.channel.send("🔄 手札交換フェーズを開始します。プレイヤー順にDMを送信します。")
-
-    for player in game.players:
-        if player.id in game.folded:
-            continue
-
-        hand = game.hands[player.id]
+        self.owner_id = owner_id
+        return self._emit("reopen", owner_id)
+
+    def close(self):
+        self._emit("close")
+        self.actor.close()
+        if self.hand_task and self.hand_task is not asyncio.current_task():
+            self.hand_task.cancel()
+        for view in self.views:
+            view.stop()
+        self.views.clear()
+        if self.status:
+            self.status.cancel()
+
+    @metrics.timed(EVALUATE_LATENCY, stage="settle")
+    def settle(self):
+        # 役の判定とポットの精算
+        return super().settle()
+
+    def memory_size(self):
+        size = sys.getsizeof(self)
+        for attr in ("players", "folded", "round_bets", "hands", "views", "contributions", "all_in", "deck"):
+            size += sys.getsizeof(getattr(self, attr))
+        size += sum(sys.getsizeof(hand) for hand in self.hands.values())
+        return size
+
+# 卓の管理：一定時間操作のない未開始の卓を破棄し、上限を超えたら古いものから破棄する
+TABLE_IDLE_TTL = 30 * 60  # 秒
+TABLE_MAX = 1000
+
+class TableRegistry:
+    def __init__(self, ttl=TABLE_IDLE_TTL, max_tables=TABLE_MAX):
+        self.ttl = ttl
+        self.max_tables = max_tables
+        self.tables = OrderedDict()  # 最近使われた順（末尾が最新）
+        self.evicted = 0
+
+    def get(self, channel_id, default=None):
+        game = self.tables.get(channel_id)
+        if game is None:
+            return default
+        game.touch()
+        self.tables.move_to_end(channel_id)
+        return game
+
+    def __contains__(self, channel_id):
+        return channel_id in self.tables
+
+    def __len__(self):
+        return len(self.tables)
+
+    def __setitem__(self, channel_id, game):
+        self.tables[channel_id] = game
+        self.tables.move_to_end(channel_id)
+        if len(self.tables) > self.max_tables:
+            for cid, old in list(self.tables.items()):
+                if len(self.tables) <= self.max_tables:
+                    break
+                if not old.started and not old.tournament:
+                    self._evict(cid)
+
+    def __delitem__(self, channel_id):
+        self.tables.pop(channel_id).close()
+
+    def items(self):
+        return self.tables.items()
+
+    def _evict(self, channel_id):
+        del self[channel_id]
+        self.evicted += 1
+
+    def evict_idle(self):
+        # 進行中の卓はタイムアウトで必ず終わるので、未開始の卓だけを対象にする
+        now = time.monotonic()
+        idle = [cid for cid, game in self.tables.items()
+                if not game.started and not game.tournament and now - game.last_active > self.ttl]
+        for cid in idle:
+            self._evict(cid)
+        return len(idle)
+
+    def stats(self):
+        live = sum(1 for game in self.tables.values() if game.started)
+        return {
+            "live": live,
+            "idle": len(self.tables) - live,
+            "evicted": self.evicted,
+            "memory_bytes": sum(game.memory_size() for game in self.tables.values()),
+        }
+
+POKER_GAMES = TableRegistry()
+metrics.Gauge("poker_tables", "Registered tables", lambda: len(POKER_GAMES))
+metrics.Gauge("poker_tables_live", "Tables with a hand in progress",
+              lambda: sum(1 for game in list(POKER_GAMES.tables.values()) if game.started))
+
+# 卓の状況表示：1卓につき1つのメッセージを編集し続け、短時間の更新はまとめて1回の編集にする
+TABLE_STATUS_INTERVAL = 1.5  # 秒
+TABLE_STATUS_LOG = 5         # 表示する直近のアクション数
+TABLE_STATUS_STATS = {"updates": 0, "api_calls": 0, "rate_limited": 0}
+
+class TableStatus:
+    def __init__(self, channel, game):
+        self.channel = channel
+        self.game = game
+        self.message = None
+        self.phase = "参加者募集中"
+        self.turn = None
+        self.actions = deque(maxlen=TABLE_STATUS_LOG)
+        self.flush_task = None
+
+    def update(self, phase=None, turn=None):
+        if phase is not None:
+            self.phase = phase
+        self.turn = turn
+        self._schedule()
+
+    def log(self, text):
+        self.actions.append(text)
+        self._schedule()
+
+    def _schedule(self, delay=TABLE_STATUS_INTERVAL):
+        TABLE_STATUS_STATS["updates"] += 1
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        content = self.render()
         try:
-            await player.send(
-                "✉️ **カード交換フェーズ**\n"
-                "交換したいカードの位置を `1,3,5` のようにカンマ区切りで入力してください（最大3枚まで）。\n"
-                "交換しない場合は `0` または `なし` と入力してください。\n"
-                f"現在の手札はこちら："
-            )
-            file = await create_hand_image(hand)
-            await player.send(file=file)
-        except discord.Forbidden:
-            await interaction.channel.send(f"⚠️ {player.mention} にDMを送れませんでした。交換スキップします。")
-            continue
+            if self.message is None:
+                self.message = await self.channel.send(content)
+            else:
+                await self.message.edit(content=content)
+            TABLE_STATUS_STATS["api_calls"] += 1
+        except discord.HTTPException as e:
+            if e.status != 429:
+                print(f"⚠️ 卓の状況表示を更新できませんでした：{e}")
+                return
+            # レート制限時は待ってから次の編集にまとめる
+            TABLE_STATUS_STATS["rate_limited"] += 1
+            self.flush_task = asyncio.create_task(self._flush_later(getattr(e, "retry_after", None) or 5))
+
+    def cancel(self):
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+
+    def render(self):
+        game = self.game
+        seats = []
+        for pid in game.players:
+            mark = "🙅" if pid in game.folded else ("▶️" if pid == self.turn else "・")
+            seats.append(f"{mark} {mention(pid)}")
+        lines = [
+            f"🃏 **ポーカー卓**（{self.phase}）",
+            f"💰 ポット：{game.pot} {game.unit} / 現在のベット額：{game.current_bet} {game.unit}",
+        ]
+        if self.turn is not None:
+            lines.append(f"🎯 現在のターン：{mention(self.turn)}")
+        lines.append("👥 参加者：" + (" ".join(seats) if seats else "なし"))
+        if self.actions:
+            lines.append("📝 " + "\n📝 ".join(self.actions))
+        return "\n".join(lines)
+
+def mention(user_id):
+    return f"<@{user_id}>"
+
+# MemberCacheFlags.none() では bot.get_user の弱参照キャッシュからユーザーがすぐに消え、
+# そのたびに fetch_user の REST 呼び出しになるので、卓に座った人は最近使った順に強参照で保持する
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "2048"))
+USER_CACHE = OrderedDict()
+
+def remember_user(user):
+    USER_CACHE[user.id] = user
+    USER_CACHE.move_to_end(user.id)
+    while len(USER_CACHE) > USER_CACHE_SIZE:
+        USER_CACHE.popitem(last=False)
+
+async def get_player(user_id):
+    user = USER_CACHE.get(user_id) or bot.get_user(user_id)
+    if user is None:
+        user = await bot.fetch_user(user_id)
+    remember_user(user)
+    return user
+
+# プレイヤー個人への送り先（手札・アクションのボタン・交換の入力）
+# DM とそのボタンは シャード0 にしか届かないので、シャードを複数のプロセスに分けたときは
+# 卓のチャンネルに本人だけが見えるプライベートスレッドを作り、入力が卓を担当するプロセスに届くようにする
+PLAYER_CHANNELS = os.environ.get("PLAYER_CHANNELS", "auto")  # "dm" / "thread" / "auto"（SHARD_IDS を指定したときだけスレッド）
+USE_PLAYER_THREADS = PLAYER_CHANNELS == "thread" or (PLAYER_CHANNELS == "auto" and bool(SHARD_IDS))
+PLAYER_CHANNEL_NAME = "専用スレッド" if USE_PLAYER_THREADS else "DM"
+
+async def open_player_thread(game, player):
+    channel = game.status.channel
+    parent = channel.parent if isinstance(channel, discord.Thread) else channel  # トーナメントの卓はスレッドなので親に作る
+    thread = await parent.create_thread(name=f"🂠 {player.display_name}", type=discord.ChannelType.private_thread,
+                                        invitable=False, auto_archive_duration=60)
+    await thread.add_user(player)
+    return thread
+
+async def get_player_channel(game, player_id):
+    # 送り先（DM なら User、スレッドなら Thread）を返す。スレッドは卓ごと・プレイヤーごとに1つだけ作る
+    player = await get_player(player_id)
+    if not USE_PLAYER_THREADS:
+        return player
+    pending = game.player_channels.get(player_id)
+    if pending is None:
+        pending = game.player_channels[player_id] = asyncio.ensure_future(open_player_thread(game, player))
+    try:
+        return await pending
+    except Exception:
+        if game.player_channels.get(player_id) is pending:
+            del game.player_channels[player_id]  # 次の送信で作り直す
+        raise
 
-        def check(m: discord.Message):
-            return m.author.id == player.id and isinstance(m.channel, discord.DMChannel)
+def input_channel_id(channel):
+    # InputDispatcher のキー：DM（User）は None、スレッドはスレッドのID（dispatch と同じくサーバーの有無で判断）
+    return channel.id if getattr(channel, "guild", None) else None
 
-        try:
-            msg = await bot.wait_for("message", check=check, timeout=60)
-            content = msg.content.strip().lower().replace(" ", "").replace("　", "")
+EXCHANGE_TIMEOUT = 60  # 交換フェーズ全体の制限時間（秒）
 
-            if content in ["0", "なし", "なし。", "交換なし"]:
-                await player.send("👌 カードを交換しませんでした。")
-                await interaction.channel.send(f"🔁 {player.mention} はカードを交換しませんでした。")
-                continue
+async def exchange_cards(game: PokerGameState):
+    active = await game.actor.send(game.reserve_exchange)
+    game.status.update(phase=f"手札交換 0/{len(active)}")
+    game.status.log(f"🔄 手札交換フェーズを開始しました。{PLAYER_CHANNEL_NAME}を確認してください。")
 
-            # カンマまたはスペース区切りの場合に対応
-            if ',' in content or ' ' in content:
-                tokens = content.replace('　', ' ').replace(',', ' ').split()
-                indexes = [int(t) for t in tokens if t.isdigit()]
-            else:
-                indexes = [int(c) for c in content if c.isdigit()]
+    deadline = asyncio.get_running_loop().time() + EXCHANGE_TIMEOUT
+    done = 0
+
+    async def run(player_id):
+        nonlocal done
+        try:
+            player = await get_player(player_id)
+            await exchange_player_cards(game, player, deadline)
+        finally:
+            done += 1
+            game.status.update(phase=f"手札交換 {done}/{len(active)}")
+
+    await asyncio.gather(*(run(pid) for pid in active))
+    await game.actor.send(game.finish_exchange)
+
+    game.status.log("✅ 全プレイヤーの交換が終了しました。")
+
+def parse_exchange_input(content):
+    # 交換するカードの位置（0始まり）を返す。交換しない場合は空リスト
+    content = content.strip().lower().replace(" ", "").replace("　", "")
+    if content in ["0", "なし", "なし。", "交換なし"]:
+        return []
+
+    # カンマまたはスペース区切りの場合に対応
+    if ',' in content or ' ' in content:
+        tokens = content.replace('　', ' ').replace(',', ' ').split()
+        indexes = [int(t) for t in tokens if t.isdigit()]
+    else:
+        indexes = [int(c) for c in content if c.isdigit()]
 
-            valid_indexes = [i - 1 for i in indexes if 1 <= i <= 5]
+    valid_indexes = [i - 1 for i in indexes if 1 <= i <= 5]
+    if not valid_indexes:
+        raise RuleError("入力が無効か、交換枚数が多すぎます。")
+    return valid_indexes
 
-            if len(valid_indexes) == 0 or len(valid_indexes) > 3:
-                await player.send("⚠️ 入力が無効か、交換枚数が多すぎます。交換はスキップされました。")
-                await interaction.channel.send(f"⚠️ {player.mention} の交換入力が無効でした。")
-                continue
+async def exchange_player_cards(game: PokerGameState, player, deadline: float):
+    hand = game.hands[player.id]
+    try:
+        odds_text = await format_discard_odds(hand) + "\n"
+    except Exception as e:
+        # 確率の表示は補助なので、計算できなくても交換は続ける
+        print(f"⚠️ 交換シミュレーションに失敗しました：{e}")
+        odds_text = ""
+    try:
+        channel = await get_player_channel(game, player.id)
+        await channel.send(
+            "✉️ **カード交換フェーズ**\n"
+            "交換したいカードの位置を `1,3,5` のようにカンマ区切りで入力してください（最大3枚まで）。\n"
+            "交換しない場合は `0` または `なし` と入力してください。\n"
+            f"{odds_text}"
+            f"現在の手札はこちら："
+        )
+        file = await create_hand_image(hand)
+        await channel.send(file=file)
+    except discord.HTTPException:
+        game.status.log(f"⚠️ {player.mention} に{PLAYER_CHANNEL_NAME}で送れませんでした。交換スキップします。")
+        return
 
-            for idx in valid_indexes:
-                hand[idx] = deck.pop()
+    try:
+        timeout = max(0, deadline - asyncio.get_running_loop().time())
+        msg = await INPUTS.wait_text(player.id, input_channel_id(channel), timeout=timeout)
+        try:
+            event = await game.actor.send(game.exchange, player.id, parse_exchange_input(msg.content))
+        except RuleError as e:
+            await channel.send(f"⚠️ {e}交換はスキップされました。")
+            game.status.log(f"⚠️ {player.mention} の交換入力が無効でした。")
+            return
 
-            game.hands[player.id] = hand
-            new_file = await create_hand_image(hand)
-            await player.send("🎴 交換後の手札はこちらです：", file=new_file)
-            await interaction.channel.send(f"🔁 {player.mention} が {len(valid_indexes)} 枚のカードを交換しました。")
+        if event.amount == 0:
+            await channel.send("👌 カードを交換しませんでした。")
+            game.status.log(f"🔁 {player.mention} はカードを交換しませんでした。")
+            return
 
-        except asyncio.TimeoutError:
-            await interaction.channel.send(f"⏱️ {player.mention} の交換が時間切れになりました。")
+        new_file = await create_hand_image(event.data)
+        await channel.send("🎴 交換後の手札はこちらです：", file=new_file)
+        game.status.log(f"🔁 {player.mention} が {event.amount} 枚のカードを交換しました。")
+
+    except asyncio.TimeoutError:
+        game.status.log(f"⏱️ {player.mention} の交換が時間切れになりました。")
+    except Exception as e:
+        game.status.log(f"⚠️ {player.mention} の交換処理でエラーが発生しました：{e}")
+
+# カード画像ストア（cards/*.png を一度だけ読み込み、メモリ上に保持）
+# 起動時に描画スレッドで全カードを先読みし、先読みが終わる前に必要になったカードは先読みの完了を待つ
+CARD_IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cards")
+CARD_REMOTE_FALLBACK = os.environ.get("CARD_REMOTE_FALLBACK", "0") == "1"  # ローカルに無いカードをGitHubから取得するか
+CARD_IMAGES = {}
+CARD_PRELOAD = None   # 起動時の先読み（on_ready で開始する Future）
+_http_session = None
+
+def load_card_image(name):
+    from PIL import Image
+    path = os.path.join(CARD_IMAGE_DIR, f"{name}.png")
+    if not os.path.exists(path):
+        return None
+    with Image.open(path) as img:
+        CARD_IMAGES[name] = img.convert("RGBA")
+    return CARD_IMAGES[name]
+
+def load_card_images():
+    for name in CARD_DECK:
+        if name not in CARD_IMAGES:
+            load_card_image(name)
+    return len(CARD_IMAGES)
+
+async def get_http_session():
+    # フォールバック取得用の共有セッション（接続をプールして使い回す）
+    global _http_session
+    import aiohttp
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8))
+    return _http_session
+
+async def fetch_card_image(name):
+    from PIL import Image
+    session = await get_http_session()
+    async with session.get(f"{CARD_IMAGE_BASE_URL}{name}.png") as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"カード画像の取得に失敗しました: {name} (HTTP {resp.status})")
+        img_bytes = await resp.read()
+    img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
+    CARD_IMAGES[name] = img
+    return img
+
+async def get_card_image(name):
+    img = CARD_IMAGES.get(name)
+    if img is None and CARD_PRELOAD is not None and not CARD_PRELOAD.done():
+        try:
+            await asyncio.shield(CARD_PRELOAD)
         except Exception as e:
-            await interaction.channel.send(f"⚠️ {player.mention} の交換処理でエラーが発生しました：{e}")
+            print(f"⚠️ カード画像の先読みに失敗しました：{e}")
+        img = CARD_IMAGES.get(name)
+    if img is None:
+        # 先読みしていないカードはその1枚だけを描画スレッドで読み込む
+        img = await asyncio.get_running_loop().run_in_executor(RENDERER.executor, load_card_image, name)
+    if img is None:
+        if not CARD_REMOTE_FALLBACK:
+            raise FileNotFoundError(f"カード画像が見つかりません: {name}")
+        img = await fetch_card_image(name)
+    return img
+
+# 描画ワーカー：PILの合成処理はスレッドプールで実行し、イベントループを止めない
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_QUEUE_LIMIT = 16  # 同時に受け付ける描画ジョブ数（超えた分は空きが出るまで待つ）
+
+class HandRenderer:
+    def __init__(self, workers=RENDER_WORKERS, limit=RENDER_QUEUE_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self.slots = asyncio.Semaphore(limit)
+        self.inflight = {}    # 同じ内容の描画を共有するための実行中ジョブ
+        self.waiting = 0
+        self.rendered = 0
+        self.shared = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    async def render(self, key, func, *args):
+        pending = self.inflight.get(key)
+        if pending is not None:
+            self.shared += 1
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.inflight[key] = future
+        try:
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                start = time.perf_counter()
+                result = await loop.run_in_executor(self.executor, func, *args)
+                elapsed = time.perf_counter() - start
+            finally:
+                self.slots.release()
+            self.rendered += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 共有待ちがいない場合の未取得警告を抑える
+            raise
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        return {
+            "queue_depth": self.waiting,
+            "in_flight": len(self.inflight),
+            "rendered": self.rendered,
+            "shared": self.shared,
+            "avg_ms": self.total_time / self.rendered * 1000 if self.rendered else 0.0,
+            "max_ms": self.max_time * 1000,
+        }
+
+RENDERER = HandRenderer()
+metrics.Gauge("poker_render_queue_depth", "Render jobs waiting for a worker", lambda: RENDERER.waiting)
+
+# 画像の出力形式："png"（従来）/ "palette"（256色PNG）/ "webp"
+HAND_IMAGE_FORMAT = os.environ.get("HAND_IMAGE_FORMAT", "png")
+HAND_IMAGE_QUALITY = int(os.environ.get("HAND_IMAGE_QUALITY", "80"))  # webp の品質
+HAND_CARD_SCALE = float(os.environ.get("HAND_CARD_SCALE", "1.0"))     # 0.6 程度でコンパクト表示
+HAND_IMAGE_CACHE_BYTES = int(os.environ.get("HAND_IMAGE_CACHE_BYTES", str(8 * 1024 * 1024)))
+SCALED_CARD_IMAGES = {}
+
+# エンコード済み画像のLRUキャッシュ（合計バイト数で上限を決める）
+class ImageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+HAND_IMAGE_CACHE = ImageCache(HAND_IMAGE_CACHE_BYTES)
+
+def get_scaled_card(name, scale):
+    if scale == 1.0:
+        return CARD_IMAGES[name]
+    img = SCALED_CARD_IMAGES.get((name, scale))
+    if img is None:
+        src = CARD_IMAGES[name]
+        img = src.resize((int(src.width * scale), int(src.height * scale)))
+        SCALED_CARD_IMAGES[(name, scale)] = img
+    return img
+
+def encode_image(img, fmt=HAND_IMAGE_FORMAT):
+    from PIL import Image
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        img.save(buffer, format="WEBP", quality=HAND_IMAGE_QUALITY, method=4)
+    elif fmt == "palette":
+        img.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(buffer, format="PNG", optimize=True)
+    else:
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
 
-    await interaction.channel.send("✅ 全プレイヤーの交換が終了しました。")
+def image_filename(stem, fmt=HAND_IMAGE_FORMAT):
+    return f"{stem}.webp" if fmt == "webp" else f"{stem}.png"
 
-# カード画像結合関数
-async def create_hand_image(card_names):
-    images = []
-    async with aiohttp.ClientSession() as session:
-        for name in card_names:
-            url = f"{CARD_IMAGE_BASE_URL}{name}.png"
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    img_bytes = await resp.read()
-                    img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
-                    images.append(img)
+def render_hand_png(card_names, scale=HAND_CARD_SCALE, fmt=HAND_IMAGE_FORMAT):
+    from PIL import Image
+    images = [get_scaled_card(name, scale) for name in card_names]
 
     widths, heights = zip(*(i.size for i in images))
     total_width = sum(widths)
@@ -185,10 +1336,92 @@ async def create_hand_image(card_names):
         combined.paste(img, (x_offset, 0))
         x_offset += img.width
 
-    buffer = io.BytesIO()
-    combined.save(buffer, format="PNG")
-    buffer.seek(0)
-    return discord.File(fp=buffer, filename="hand.png")
+    return encode_image(combined, fmt)
+
+# カード画像結合関数
+@metrics.timed(RENDER_LATENCY, image="hand")
+async def create_hand_image(cards):
+    card_names = tuple(int_to_card(c) for c in cards)
+    key = ("hand", HAND_IMAGE_FORMAT, HAND_CARD_SCALE) + card_names
+    data = HAND_IMAGE_CACHE.get(key)
+    if data is None:
+        for name in card_names:
+            await get_card_image(name)  # 未読み込みのカードをここで用意しておく
+        data = await RENDERER.render(key, render_hand_png, card_names)
+        HAND_IMAGE_CACHE.put(key, data)
+    return discord.File(fp=io.BytesIO(data), filename=image_filename("hand"))
+
+# ショウダウン画像：全員の手札を1枚にまとめ、勝者の行を強調する
+HAND_NAMES_EN = ["High Card", "One Pair", "Two Pair", "Three of a Kind", "Straight",
+                 "Flush", "Full House", "Four of a Kind", "Straight Flush"]
+SHOWDOWN_CARD_SCALE = 0.5
+SHOWDOWN_CACHE_BYTES = int(os.environ.get("SHOWDOWN_CACHE_BYTES", str(4 * 1024 * 1024)))  # 0 でキャッシュしない
+SHOWDOWN_CACHE = ImageCache(SHOWDOWN_CACHE_BYTES)
+# 日本語の表示名を描くためのフォント（未指定ならよくある場所を順に探す）
+SHOWDOWN_FONTS = [path for path in [os.environ.get("SHOWDOWN_FONT", ""),
+                                    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+                                    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+                                    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+                                    "/usr/share/fonts/opentype/ipafont-gothic/ipagp.ttf"] if path]
+
+@lru_cache(maxsize=None)
+def load_showdown_font(size=28):
+    from PIL import ImageFont
+    for path in SHOWDOWN_FONTS:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+def fit_label(draw, text, font, width):
+    # ラベル欄に収まらない名前は末尾を … で切り詰める
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > width:
+        text = text[:-1]
+    return text + "…"
+
+def render_showdown_png(rows):
+    from PIL import Image, ImageDraw
+    font = load_showdown_font()
+
+    sample = CARD_IMAGES[int_to_card(rows[0][1][0])]
+    card_w = int(sample.width * SHOWDOWN_CARD_SCALE)
+    card_h = int(sample.height * SHOWDOWN_CARD_SCALE)
+    label_w, pad = 260, 12
+    row_h = card_h + pad * 2
+    board = Image.new("RGBA", (label_w + card_w * 5 + pad * 2, row_h * len(rows)), (20, 90, 50, 255))
+    draw = ImageDraw.Draw(board)
+
+    for i, (name, cards, category, is_winner) in enumerate(rows):
+        top = i * row_h
+        if is_winner:
+            draw.rectangle([2, top + 2, board.width - 3, top + row_h - 3], outline=(255, 200, 0, 255), width=5)
+        color = (255, 215, 0, 255) if is_winner else (255, 255, 255, 255)
+        draw.text((pad * 2, top + pad * 2), fit_label(draw, name, font, label_w - pad * 3), fill=color, font=font)
+        draw.text((pad * 2, top + pad * 2 + 40), HAND_NAMES_EN[category], fill=color, font=font)
+        for j, card in enumerate(cards):
+            img = get_scaled_card(int_to_card(card), SHOWDOWN_CARD_SCALE)
+            board.paste(img, (label_w + j * card_w, top + pad), img)
+
+    return encode_image(board)
+
+@metrics.timed(RENDER_LATENCY, image="showdown")
+async def create_showdown_image(rows):
+    # rows: [(表示名, カード, 役カテゴリ, 勝者か), ...]
+    key = tuple(rows)
+    data = SHOWDOWN_CACHE.get(key)
+    if data is None:
+        for _, cards, _, _ in rows:
+            for card in cards:
+                await get_card_image(int_to_card(card))
+        data = await RENDERER.render(("showdown",) + key, render_showdown_png, rows)
+        SHOWDOWN_CACHE.put(key, data)
+    return discord.File(fp=io.BytesIO(data), filename=image_filename("showdown"))
 
 # 参加ボタン
 class PokerJoinView(discord.ui.View):
@@ -197,20 +1430,24 @@ class PokerJoinView(discord.ui.View):
         self.channel_id = channel_id
 
     @discord.ui.button(label="参加する", style=discord.ButtonStyle.primary, custom_id="poker_join_button")
+    @metrics.timed(VIEW_LATENCY, view="join")
     async def join(self, interaction: discord.Interaction, button: discord.ui.Button):
-        game = POKER_GAMES.get(self.channel_id)
-        if not game or game.started:
+        # 起動時に登録した共通のView（channel_id が None）は押されたチャンネルの卓を使う
+        game = POKER_GAMES.get(self.channel_id or interaction.channel_id)
+        if not game:
             await interaction.response.send_message("このチャンネルでは参加できません。", ephemeral=True)
             return
-        if interaction.user.id in [p.id for p in game.players]:
-            await interaction.response.send_message("すでに参加しています。", ephemeral=True)
+        try:
+            await game.actor.send(game.join, interaction.user.id)
+        except RuleError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
             return
+        remember_user(interaction.user)
 
-        game.players.append(interaction.user)
         await interaction.response.send_message("参加が完了しました！", ephemeral=True)
-        await interaction.channel.send(f"✅ {interaction.user.mention} さんがポーカーに参加しました！")
+        game.status.log(f"✅ {interaction.user.mention} さんがポーカーに参加しました！")
 
-# アクションボタン
+# アクションボタン（入力を受け取ってエンジンに渡すだけ。ルールの検査は PokerTable 側で行う）
 class PokerActionView(discord.ui.View):
     def __init__(self, game, player, is_first_player):
         super().__init__(timeout=60)
@@ -219,218 +1456,261 @@ class PokerActionView(discord.ui.View):
         self.is_first_player = is_first_player
         self.selected_amount = 0
         self.action = None
+        self.busy = False         # 処理中のボタンがある間は他のボタンを受け付けない
+
+    def finish(self, event):
+        self.selected_amount = event.amount
+        self.action = event.kind
+        self.stop()
+
+    async def claim(self, interaction):
+        # 連打や別ボタンの同時押しは、最初の1回が終わるまで受け付けない
+        if self.busy or self.action is not None:
+            await interaction.response.send_message("⏳ アクションはすでに受け付けています。", ephemeral=True)
+            return False
+        self.busy = True
+        return True
 
     @discord.ui.button(label="💰 ベット", style=discord.ButtonStyle.success, row=0)
+    @metrics.timed(VIEW_LATENCY, view="bet")
     async def bet_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not self.is_first_player:
             await interaction.response.send_message("このアクションは現在使用できません（すでにベットが行われています）。", ephemeral=True)
             return
+        if not await self.claim(interaction):
+            return
 
-        await interaction.response.send_message("💰 100〜500 Spt の間でベット額を入力してください。", ephemeral=True)
-
-        def check(m: discord.Message):
-            return m.author == interaction.user and m.channel == interaction.channel
+        await interaction.response.send_message(f"💰 {self.game.min_bet}〜{self.game.max_bet} {self.game.unit} の間でベット額を入力してください。", ephemeral=True)
 
         try:
-            msg = await bot.wait_for('message', timeout=30.0, check=check)
-            amount = int(msg.content)
-            if 100 <= amount <= 500:
-                if subtract_balance(self.player.id, amount):
-                    self.selected_amount = amount
-                    self.action = "bet"
-                    self.game.round_bets[self.player.id] = amount
-                    self.game.current_bet = amount
-                    self.game.pot += amount
-                    await interaction.followup.send(f"✅ {amount} Spt をベットしました！", ephemeral=True)
-                    self.stop()
-                else:
-                    await interaction.followup.send("❌ 残高が不足しています。", ephemeral=True)
-            else:
-                await interaction.followup.send("❌ 金額は100〜500の間で指定してください。", ephemeral=True)
+            msg = await INPUTS.wait_text(interaction.user.id, interaction.channel_id if interaction.guild_id else None, timeout=30.0)
+            event = await self.game.actor.send(self.game.bet, self.player.id, int(msg.content))
         except asyncio.TimeoutError:
             await interaction.followup.send("⏱️ 入力が時間切れになりました。", ephemeral=True)
         except ValueError:
             await interaction.followup.send("❌ 数値を入力してください。", ephemeral=True)
+        except RuleError as e:
+            await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        else:
+            self.game.status.log(f"💰 {self.player.mention} が {event.amount} {self.game.unit} をベット")
+            await interaction.followup.send(f"✅ {event.amount} {self.game.unit} をベットしました！", ephemeral=True)
+            self.finish(event)
+        finally:
+            self.busy = False
 
     @discord.ui.button(label="📞 コール", style=discord.ButtonStyle.primary, row=1)
+    @metrics.timed(VIEW_LATENCY, view="call")
     async def call_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.is_first_player:
-            await interaction.response.send_message("❌ 現在はコールできません。まずはベットしてください。", ephemeral=True)
+        if not await self.claim(interaction):
             return
-
-        required = self.game.current_bet - self.game.round_bets.get(self.player.id, 0)
-        if required <= 0:
-            await interaction.response.send_message("✅ すでに必要な額を支払っています。", ephemeral=True)
-            self.stop()
+        try:
+            event = await self.game.actor.send(self.game.call, self.player.id)
+        except RuleError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
             return
+        finally:
+            self.busy = False
 
-        if subtract_balance(self.player.id, required):
-            self.selected_amount = required
-            self.action = "call"
-            self.game.round_bets[self.player.id] = self.game.round_bets.get(self.player.id, 0) + required
-            self.game.pot += required
-            await interaction.response.send_message(f"📞 {required} Spt をコールしました！", ephemeral=True)
-            self.stop()
+        if event.kind == "check":
+            await interaction.response.send_message("✅ すでに必要な額を支払っています。", ephemeral=True)
+        elif event.kind == "allin":
+            self.game.status.log(f"🔥 {self.player.mention} が {event.amount} {self.game.unit} でオールイン")
+            await interaction.response.send_message(f"🔥 {event.amount} {self.game.unit} でオールインしました！", ephemeral=True)
         else:
-            await interaction.response.send_message("❌ 残高が不足しています。", ephemeral=True)
+            self.game.status.log(f"📞 {self.player.mention} が {event.amount} {self.game.unit} をコール")
+            await interaction.response.send_message(f"📞 {event.amount} {self.game.unit} をコールしました！", ephemeral=True)
+        self.finish(event)
 
     @discord.ui.button(label="📈 レイズ", style=discord.ButtonStyle.danger, row=1)
+    @metrics.timed(VIEW_LATENCY, view="raise")
     async def raise_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if self.is_first_player:
             await interaction.response.send_message("❌ 現在はレイズできません。まずはベットしてください。", ephemeral=True)
             return
+        if not await self.claim(interaction):
+            return
 
         current = self.game.current_bet
-        await interaction.response.send_message(f"📈 {current} Spt 以上の金額を入力してください（最大500）。", ephemeral=True)
-
-        def check(m: discord.Message):
-            return m.author == interaction.user and m.channel == interaction.channel
+        await interaction.response.send_message(f"📈 {current} {self.game.unit} 以上の金額を入力してください（最大{self.game.max_bet}）。", ephemeral=True)
 
         try:
-            msg = await bot.wait_for('message', timeout=30.0, check=check)
+            msg = await INPUTS.wait_text(interaction.user.id, interaction.channel_id if interaction.guild_id else None, timeout=30.0)
             raise_amount = int(msg.content)
-            if raise_amount > current and raise_amount <= 500:
-                if subtract_balance(self.player.id, raise_amount):
-                    self.selected_amount = raise_amount
-                    self.action = "raise"
-                    self.game.round_bets[self.player.id] = raise_amount
-                    self.game.current_bet = raise_amount
-                    self.game.pot += raise_amount
-                    await interaction.followup.send(f"📈 {raise_amount} Spt にレイズしました！", ephemeral=True)
-                    self.stop()
-                else:
-                    await interaction.followup.send("❌ 残高が不足しています。", ephemeral=True)
-            else:
-                await interaction.followup.send("❌ 有効なレイズ額を入力してください（現在のベットより多く、最大500まで）。", ephemeral=True)
+            event = await self.game.actor.send(self.game.raise_to, self.player.id, raise_amount)
         except asyncio.TimeoutError:
             await interaction.followup.send("⏱️ 入力が時間切れになりました。", ephemeral=True)
         except ValueError:
             await interaction.followup.send("❌ 数値を入力してください。", ephemeral=True)
+        except RuleError as e:
+            await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        else:
+            self.game.status.log(f"📈 {self.player.mention} が {raise_amount} {self.game.unit} にレイズ")
+            await interaction.followup.send(f"📈 {raise_amount} {self.game.unit} にレイズしました！", ephemeral=True)
+            self.finish(event)
+        finally:
+            self.busy = False
 
     @discord.ui.button(label="🙅 フォールド", style=discord.ButtonStyle.secondary, row=2)
+    @metrics.timed(VIEW_LATENCY, view="fold")
     async def fold_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.game.folded.add(self.player.id)
-        self.action = "fold"
+        if not await self.claim(interaction):
+            return
+        try:
+            event = await self.game.actor.send(self.game.fold, self.player.id)
+        except RuleError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
+        finally:
+            self.busy = False
+        self.game.status.log(f"🙅 {self.player.mention} がフォールド")
         await interaction.response.send_message("🙅‍♂️ フォールドしました。", ephemeral=True)
-        self.stop()
+        self.finish(event)
 
 # ターン処理関数（クラス外）
 
 
-async def play_turn(interaction: discord.Interaction, game: PokerGameState):
-    while game.turn_index < len(game.players):
-        player = game.players[game.turn_index]
-
-        # フォールド済プレイヤーはスキップ
-        if player.id in game.folded:
-            game.turn_index += 1
-            continue
-
-        # 一巡目の1人目ならベットのみ可、それ以外はコール／レイズも可
-        is_first_player = (game.turn_index == 0 and all(v == 0 for v in game.round_bets.values()))
-        view = PokerActionView(game, player, is_first_player=is_first_player)
-
-        await interaction.channel.send(
-            f"🎯 現在のターン：{player.mention}（現在のベット額：{game.current_bet} Spt）"
-        )
+async def play_turn(game: PokerGameState):
+    while (player_id := game.next_actor()) is not None:
+        game.touch()
+        player = await get_player(player_id)
+        view = PokerActionView(game, player, is_first_player=game.is_opening())
+        game.status.update(turn=player_id)
 
         try:
-            await player.send("あなたのアクションを選択してください：", view=view)
-        except discord.Forbidden:
-            await interaction.channel.send(f"⚠️ {player.mention} にDMを送信できませんでした。フォールド扱いにします。")
-            game.folded.add(player.id)
-            game.turn_index += 1
+            channel = await get_player_channel(game, player_id)
+            mention_text = f"{player.mention} " if USE_PLAYER_THREADS else ""  # スレッドでは本人に通知が届くように
+            await channel.send(f"{mention_text}あなたのアクションを選択してください：", view=view)
+        except discord.HTTPException:
+            game.status.log(f"⚠️ {player.mention} に{PLAYER_CHANNEL_NAME}で送信できませんでした。フォールド扱いにします。")
+            await game.actor.send(game.fold, player_id)
             continue
 
+        game.views.add(view)
         await view.wait()
-        game.turn_index += 1
+        game.views.discard(view)
+        if view.action is None:
+            await game.actor.send(game.timeout, player_id)
 
-    await interaction.channel.send("🟢 全員のアクションが完了しました。次のフェーズに進みます。")
+    game.status.update()
+    game.status.log("🟢 全員のアクションが完了しました。次のフェーズに進みます。")
 
 # showdown関数（同点対応版）
-async def showdown(interaction: discord.Interaction, game: PokerGameState):
-    results = []
+async def showdown(game: PokerGameState):
+    game.status.update(phase="ショウダウン")
+    await game.status.flush()
 
-    for player in game.players:
-        if player.id in game.folded:
-            continue
-        hand = game.hands.get(player.id)
-        if hand:
-            hand_value = evaluate_hand(hand)
-            results.append((player, hand_value))
-
-            # 🖼️ 手札画像をチャンネルに送信
-            file = await create_hand_image(hand)
-            await interaction.channel.send(content=f"🃏 {player.mention} の手札：", file=file)
+    # 💰 サイドポットを含めて精算し、払い戻しは1回の更新でまとめて反映
+    results, payouts, pots, contributions = await game.actor.send(game.settle)
 
-    if not results:
-        await interaction.channel.send("❌ 勝者を判定できませんでした。")
+    if not pots:
+        await game.status.channel.send("❌ 勝者を判定できませんでした。拠出額を返金しました。")
+        await reset_game(game)
         return
 
-    results.sort(key=lambda x: x[1], reverse=True)
-    top_score = results[0][1]
-    winners = [p for p, score in results if score == top_score]
-
-    await asyncio.sleep(1)  # 画像の送信後に少し間を空けると見やすい
+    # 誰にもコールされなかったベットは払い戻しとして分けて表示する（ポットを勝ち取ったわけではない）
+    returned = uncalled_bet(pots, contributions)
+    contested = pots[:-1] if returned else pots
+    result_lines = []
+    for i, (amount, winners) in enumerate(contested):
+        name = "ポット" if len(contested) == 1 else ("メインポット" if i == 0 else f"サイドポット{i}")
+        if len(winners) == 1:
+            result_lines.append(f"🏆 {name} {amount} {game.unit} は {mention(winners[0])} が獲得しました！")
+        else:
+            winner_mentions = ", ".join(mention(w) for w in winners)
+            result_lines.append(f"🤝 {name} {amount} {game.unit} は引き分け！{winner_mentions} で分け合いました。")
+    if returned:
+        result_lines.append(f"↩️ コールされなかったベット {returned[1]} {game.unit} を {mention(returned[0])} に返却しました。")
+    if any(len(winners) > 1 for _, winners in contested):
+        result_lines.append("💰 受取額：" + " / ".join(f"{mention(pid)} {amount} {game.unit}" for pid, amount in payouts.items()))
+
+    # 🖼️ 全員の手札を1枚の画像にまとめて、結果と一緒に1回で送信
+    # 勝者は収支（受取額 − 拠出額）がプラスの人（ハンド履歴と同じ基準）
+    players = await asyncio.gather(*(get_player(pid) for pid, _, _ in results))
+    rows = [(player.display_name, hand, hand_category(score), payouts.get(pid, 0) > contributions.get(pid, 0))
+            for player, (pid, score, hand) in zip(players, results)]
+    file = await create_showdown_image(rows)
+    lines = ["🃏 **ショウダウン**"]
+    for (pid, _, _), (_, _, category, is_winner) in zip(results, rows):
+        lines.append(f"{mention(pid)}：{HAND_NAMES[category]}{' 🏆' if is_winner else ''}")
+    lines += result_lines
+    await game.status.channel.send(content="\n".join(lines), file=file)
+
+    await reset_game(game)
+
+# 🟡 ゲーム状態リセット（再戦可能に）
+async def reset_game(game: PokerGameState):
+    await game.actor.send(game.reset)
+    game.hand_task = None
+    game.status.update(phase="参加者募集中")
 
-    if len(winners) == 1:
-        winner = winners[0]
-        add_balance(winner.id, game.pot)
-        await interaction.channel.send(f"🏆 勝者は {winner.mention} です！ポット {game.pot} Spt を獲得しました！")
-    else:
-        share = game.pot // len(winners)
-        for winner in winners:
-            add_balance(winner.id, share)
-        winner_mentions = ", ".join(w.mention for w in winners)
-        await interaction.channel.send(f"🤝 引き分けです！{winner_mentions} がそれぞれ {share} Spt を獲得しました。")
-
-    # 🟡 ゲーム状態リセット（再戦可能に）
-    game.started = False
-    game.turn_index = 0
-    game.folded = set()
-    game.bets = {}
-    game.round_bets = {}
-    game.current_bet = 0
-    game.pot = 0
-    game.hands = {}
 # コマンド定義
-@bot.tree.command(name="joinpoker", description="ポーカーの参加者を募集します", guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="joinpoker", description="ポーカーの参加者を募集します")
+@metrics.timed(COMMAND_LATENCY, command="joinpoker")
 async def join_poker(interaction: discord.Interaction):
     game = POKER_GAMES.get(interaction.channel_id)
     if game:
+        if game.tournament:
+            await interaction.response.send_message("トーナメントの卓では使用できません。", ephemeral=True)
+            return
         if game.started:
             await interaction.response.send_message("このチャンネルではすでにポーカーが進行中です。", ephemeral=True)
             return
         else:
             # 既存の未開始ゲームがあるなら再募集
-            game.players = []
-            game.owner_id = interaction.user.id
+            await game.actor.send(game.reopen, interaction.user.id)
+            game.status.message = None  # 状況表示は新しいメッセージで出し直す
+            game.status.update(phase="参加者募集中")
     else:
-        POKER_GAMES[interaction.channel_id] = PokerGameState(owner_id=interaction.user.id)
+        game = PokerGameState(owner_id=interaction.user.id, channel_id=interaction.channel_id,
+                              entry_fee=guild_config(interaction.guild_id)["entry_fee"])
+        game._emit("open", game.owner_id)
+        game.status = TableStatus(interaction.channel, game)
+        POKER_GAMES[interaction.channel_id] = game
 
     view = PokerJoinView(channel_id=interaction.channel_id)
-    await interaction.response.send_message("🃏 新たにポーカーを開始しました！参加するには以下のボタンを押してください👇", view=view)
+    game.views.add(view)
+    callback = await interaction.response.send_message("🃏 新たにポーカーを開始しました！参加するには以下のボタンを押してください👇", view=view)
+    # 再起動後に参加ボタンを同じメッセージへ付け直すため、メッセージIDを記録する
+    message_id = getattr(callback, "message_id", None)
+    if message_id:
+        game._emit("message", data=message_id)
     
-@bot.tree.command(name="abortpoker", description="現在のポーカーゲームを中止します（主催者のみ）", guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="abortpoker", description="現在のポーカーゲームを中止します（主催者のみ）")
+@metrics.timed(COMMAND_LATENCY, command="abortpoker")
 async def abort_poker(interaction: discord.Interaction):
     game = POKER_GAMES.get(interaction.channel_id)
     if not game:
         await interaction.response.send_message("⚠️ 現在このチャンネルで開催中のゲームはありません。", ephemeral=True)
         return
+    if game.tournament:
+        await interaction.response.send_message("❌ トーナメントの卓は `/canceltournamentm` で中止してください。", ephemeral=True)
+        return
 
     if interaction.user.id != game.owner_id:
         await interaction.response.send_message("❌ このコマンドは主催者のみ使用できます。", ephemeral=True)
         return
 
-    del POKER_GAMES[interaction.channel_id]
-    await interaction.response.send_message("🛑 ポーカーゲームを中止しました。", ephemeral=False)
+    # 進行中のハンドは卓のキューで中止して返金し、ハンドの処理タスクは卓の破棄時に止める
+    try:
+        event = await game.actor.send(game.abort)
+    except RuleError as e:
+        await interaction.response.send_message(f"⚠️ {e}", ephemeral=True)
+        return
+    if POKER_GAMES.get(interaction.channel_id) is game:
+        del POKER_GAMES[interaction.channel_id]
+    refund = f"\n💰 参加費・ベット計 {event.amount} Spt を返金しました。" if event.amount else ""
+    await interaction.response.send_message(f"🛑 ポーカーゲームを中止しました。{refund}", ephemeral=False)
 
-@bot.tree.command(name="chargem", description="VirtualCryptoで支払った分をBot内通貨にチャージします", guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="chargem", description="VirtualCryptoで支払った分をBot内通貨にチャージします")
 @app_commands.describe(amount="チャージする通貨量（例：1000）")
+@metrics.timed(COMMAND_LATENCY, command="chargem")
 async def chargem(interaction: discord.Interaction, amount: int):
     if amount <= 0:
         await interaction.response.send_message("⚠️ 金額は1以上で指定してください。", ephemeral=True)
         return
+    if not guild_config(interaction.guild_id)["charge"]:
+        await interaction.response.send_message("❌ このサーバーではチャージを受け付けていません。", ephemeral=True)
+        return
 
     await interaction.response.send_message(
         f"💰 `{amount}Spt` を VirtualCrypto 経由で「{bot.user.name}」宛に送金してください。\n"
@@ -438,127 +1718,1140 @@ async def chargem(interaction: discord.Interaction, amount: int):
         ephemeral=False
     )
 
-    def check(msg: discord.Message):
-        description = msg.embeds[0].description if msg.embeds else ""
-        return (
-            msg.author.id == VIRTUALCRYPTO_ID and
-            f"<@{interaction.user.id}>から<@{bot.user.id}>へ" in description and
-            f"{amount}" in description and
-            "Spt" in description
-        )
-
     try:
-        msg = await bot.wait_for("message", timeout=180, check=check)
-        add_balance(interaction.user.id, amount)
+        await INPUTS.wait_deposit(interaction.user.id, bot.user.id, amount, timeout=180)
+        await retry_ledger(add_balance, interaction.user.id, amount)
         await interaction.channel.send(f"✅ {interaction.user.mention} さん、{amount} Spt のチャージが完了しました！\n💼 現在の残高：{get_balance(interaction.user.id)} Spt")
     except asyncio.TimeoutError:
         await interaction.channel.send(f"⏱️ {interaction.user.mention} さん、**3分以内に送金が確認できませんでした**。もう一度 `/chargem` を実行してください。")
 
-LOG_CHANNEL_ID = 1401466622149005493  # ログチャンネルのIDを必ず設定
+LOG_CHANNEL_ID = 1401466622149005493  # 最初に導入したサーバーのログチャンネル（他のサーバーは !guildconfig で設定）
+
+# サーバーごとの設定：guilds/<サーバーID>.json に1サーバー1ファイルで保存する
+# サーバーを担当するプロセスは1つだけなので、複数のプロセスで動かしても書き込みがぶつからない
+GUILD_CONFIG_DIR = "guilds"
+GUILD_DEFAULTS = {
+    "log_channel": None,     # 換金申請の通知先チャンネル
+    "charge": True,          # /chargem を受け付けるか
+    "withdraw": True,        # /changem を受け付けるか
+    "entry_fee": ENTRY_FEE,  # 卓の参加費
+}
+GUILD_CONFIGS = {}
+
+def guild_config(guild_id):
+    config = GUILD_CONFIGS.get(guild_id)
+    if config is None:
+        config = dict(GUILD_DEFAULTS)
+        if guild_id == GUILD_ID:
+            config["log_channel"] = LOG_CHANNEL_ID
+        config.update(load_currency(os.path.join(GUILD_CONFIG_DIR, f"{guild_id}.json")))
+        GUILD_CONFIGS[guild_id] = config
+    return config
+
+def set_guild_config(guild_id, key, value):
+    config = guild_config(guild_id)
+    config[key] = value
+    os.makedirs(GUILD_CONFIG_DIR, exist_ok=True)
+    save_currency(config, os.path.join(GUILD_CONFIG_DIR, f"{guild_id}.json"))
+
+def parse_guild_setting(key, value):
+    # !guildconfig の値を設定の型に変換する（不正な値は ValueError）
+    if key == "log_channel":
+        return None if value == "none" else int(value.strip("<#>"))
+    if key in ("charge", "withdraw"):
+        if value not in ("on", "off"):
+            raise ValueError(value)
+        return value == "on"
+    if key == "entry_fee":
+        if int(value) < 0:
+            raise ValueError(value)
+        return int(value)
+    raise KeyError(key)
+
+# 換金申請の待ち行列：申請は残高の引き落としと同時に追記専用ジャーナルへ記録し、ログチャンネルへの通知は後から送る
+# 通知はワーカーがまとめて（1通に複数件）送り、失敗したら間隔を空けて再送する。振込済み・取消は運営がまとめて処理する
+WITHDRAWAL_JOURNAL_FILE = "withdrawals.journal"
+WITHDRAWAL_SNAPSHOT_FILE = "withdrawals.json"
+WITHDRAWAL_COMPACT_EVERY = 1000
+WITHDRAWAL_KEEP_DAYS = 30          # 処理済みの申請をスナップショットに残す日数
+WITHDRAWAL_BATCH_DELAY = 5.0       # 最初の申請から通知を送るまで待って、後続の申請をまとめる（秒）
+WITHDRAWAL_DIGEST_SPACING = 1.5    # 通知を複数通に分けるときの間隔（チャンネルのレート制限は 5 通 / 5 秒）
+WITHDRAWAL_RETRY_BASE = 5.0        # 送信失敗時の再送間隔（失敗のたびに倍にする）
+WITHDRAWAL_RETRY_MAX = 600.0
+WITHDRAWAL_MESSAGE_LIMIT = 1900    # 1通の文字数の上限（Discord は 2000 文字）
+WITHDRAWAL_POLL_INTERVAL = 60.0    # 複数のプロセスで動かすときに未通知の申請を確認する間隔（秒）
+
+class WithdrawalQueue:
+    def __init__(self, snapshot_file=WITHDRAWAL_SNAPSHOT_FILE, journal_file=WITHDRAWAL_JOURNAL_FILE, compact_every=WITHDRAWAL_COMPACT_EVERY):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.requests = {}   # 申請番号 -> {"user", "amount", "time", "guild", "state", "notified"}
+        self.next_id = 1
+        self.seq = 0
+        self.pending = 0
+        self.journal = None
+        self.loaded = False
+        self.wake = asyncio.Event()
+
+    def apply(self, kind, request_id, data):
+        # 1件の出来事を申請の記録に反映する（書き込み時と再生時で同じ処理）
+        if kind == "request":
+            guild_id = data[3] if len(data) > 3 else GUILD_ID
+            self.requests[request_id] = {"user": data[0], "amount": data[1], "time": data[2], "guild": guild_id,
+                                         "state": "pending", "notified": False}
+            self.next_id = max(self.next_id, request_id + 1)
+            return
+        entry = self.requests.get(request_id)
+        if entry is None:
+            return
+        if kind == "notified":
+            entry["notified"] = True
+        elif kind in ("paid", "cancelled"):
+            entry["state"] = kind
+            entry["closed"] = data
+
+    def load(self):
+        data = load_currency(self.snapshot_file)
+        self.seq = base_seq = data.get("seq", 0)
+        self.next_id = data.get("next_id", 1)
+        self.requests = {int(rid): entry for rid, entry in data.get("requests", {}).items()}
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        seq, kind, request_id, data = json.loads(line)
+                    except ValueError:
+                        break  # 書き込み途中でクラッシュした末尾行は無視
+                    if seq <= base_seq:
+                        continue
+                    self.apply(kind, request_id, data)
+                    self.seq = seq
+        self.compact()
+        self.loaded = True
+        if self.unnotified():
+            self.wake.set()
+
+    def _ensure_loaded(self):
+        if self.journal is None:
+            self.load()
+
+    def write(self, events):
+        # events: [(種類, 申請番号, データ), ...] をまとめて追記し、1回だけ fsync する
+        self._ensure_loaded()
+        lines = []
+        for kind, request_id, data in events:
+            self.seq += 1
+            self.apply(kind, request_id, data)
+            lines.append(json.dumps([self.seq, kind, request_id, data], separators=(",", ":")) + "\n")
+        self.journal.write("".join(lines))
+        self.journal.flush()
+        if LEDGER_FSYNC:
+            os.fsync(self.journal.fileno())
+        self.pending += len(lines)
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        if self.journal:
+            self.journal.close()
+        cutoff = time.time() - WITHDRAWAL_KEEP_DAYS * 24 * 3600
+        self.requests = {rid: entry for rid, entry in self.requests.items()
+                         if entry["state"] == "pending" or entry["closed"] >= cutoff}
+        save_currency({"seq": self.seq, "next_id": self.next_id, "requests": self.requests}, self.snapshot_file)
+        self.journal = open(self.journal_file, "w", encoding="utf-8")
+        self.pending = 0
+
+    def request(self, user_id, amount, guild_id):
+        # 引き落としと申請の記録を await を挟まずに続けて行う。残高不足なら None
+        self._ensure_loaded()
+        if not subtract_balance(user_id, amount):
+            return None
+        request_id = self.next_id
+        self.write([("request", request_id, [user_id, amount, int(time.time()), guild_id])])
+        self.wake.set()
+        return request_id
+
+    def open_requests(self, request_ids=None, guild_id=None):
+        # 未処理の申請（guild_id を指定すればそのサーバーの申請だけ）
+        self._ensure_loaded()
+        if request_ids is None:
+            request_ids = self.requests
+        return [(rid, self.requests[rid]) for rid in request_ids
+                if rid in self.requests and self.requests[rid]["state"] == "pending"
+                and guild_id in (None, self.requests[rid]["guild"])]
+
+    def unnotified(self):
+        return [(rid, entry) for rid, entry in self.open_requests() if not entry["notified"]]
+
+    def last_id(self):
+        self._ensure_loaded()
+        return self.next_id - 1
+
+    def mark_notified(self, request_ids):
+        self.write([("notified", rid, None) for rid in request_ids])
+
+    def mark_paid(self, request_ids, guild_id=None):
+        # 未処理の申請だけを振込済みにして、処理した (申請番号, 記録) を返す
+        targets = self.open_requests(request_ids, guild_id)
+        now = int(time.time())
+        if targets:
+            self.write([("paid", rid, now) for rid, _ in targets])
+        return targets
+
+    def cancel(self, request_ids, guild_id=None):
+        # 未処理の申請を取り消し、まとめて1回の更新で返金する
+        targets = self.open_requests(request_ids, guild_id)
+        if not targets:
+            return targets
+        refunds = {}
+        for _, entry in targets:
+            refunds[entry["user"]] = refunds.get(entry["user"], 0) + entry["amount"]
+        add_balances(refunds)
+        now = int(time.time())
+        self.write([("cancelled", rid, now) for rid, _ in targets])
+        return targets
+
+    def pending_count(self):
+        return len(self.open_requests()) if self.loaded else 0
+
+    def totals(self):
+        if not self.loaded:
+            return {"loaded": False}
+        requests = self.open_requests()
+        return {"loaded": True, "pending": len(requests), "pending_amount": sum(entry["amount"] for _, entry in requests),
+                "unnotified": len(self.unnotified())}
+
+class SqliteWithdrawalQueue:
+    # CURRENCY_BACKEND=sqlite のときは申請も台帳と同じデータベースに置き、引き落としと申請の記録を1つのトランザクションで行う
+    # 全プロセスで共有するので、SHARD_IDS を変えても申請が取り残されない。ジャーナル方式の申請は起動時に取り込む
+    COLUMNS = "id, user, amount, time, guild, state, notified"
+
+    def __init__(self, store):
+        self.store = store
+        self.loaded = False
+        self.wake = asyncio.Event()
+
+    def load(self):
+        self.store._ensure_loaded()
+        self._write(self._create)
+        for tag in sorted(set(process_tags("withdrawals", ".json")) | set(process_tags("withdrawals", ".journal"))):
+            self.import_queue(tag)
+        self.loaded = True
+        if self.unnotified():
+            self.wake.set()
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _write(self, func, *args):
+        # 書き込みのロックを取って func(db, ...) を実行し、まとめて確定する（途中で失敗すれば何も変えない）
+        db = self.store.db
+        self.store.begin()
+        try:
+            result = func(db, *args)
+            db.execute("COMMIT" if result is not None else "ROLLBACK")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _create(self, db):
+        db.execute("CREATE TABLE IF NOT EXISTS withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, user INTEGER NOT NULL, "
+                   "amount INTEGER NOT NULL, time INTEGER NOT NULL, guild INTEGER NOT NULL, "
+                   "state TEXT NOT NULL DEFAULT 'pending', notified INTEGER NOT NULL DEFAULT 0, closed INTEGER)")
+        db.execute("CREATE INDEX IF NOT EXISTS withdrawals_open ON withdrawals (state, guild)")
+        db.execute("CREATE TABLE IF NOT EXISTS withdrawal_imports (digest TEXT PRIMARY KEY)")
+        cutoff = int(time.time() - WITHDRAWAL_KEEP_DAYS * 24 * 3600)
+        return db.execute("DELETE FROM withdrawals WHERE state != 'pending' AND closed < ?", (cutoff,))
+
+    def import_queue(self, tag):
+        # ジャーナル方式の申請を番号を振り直して取り込む。同じ内容は二度取り込まない（取り込んだ後に落ちても二重にならない）
+        name = f"withdrawals{tag}"
+        queue = WithdrawalQueue(f"{name}.json", f"{name}.journal")
+        queue.load()
+        queue.journal.close()
+        requests = sorted(queue.requests.items())
+        digest = hashlib.sha256(json.dumps(requests, sort_keys=True).encode()).hexdigest()
+        self._write(self._import, requests, digest)
+        for path in (queue.snapshot_file, queue.journal_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        pending = sum(entry["state"] == "pending" for _, entry in requests)
+        print(f"換金申請 {name} を取り込みました（未処理 {pending} 件。番号は振り直し、改めて通知します）")
+
+    def _import(self, db, requests, digest):
+        if db.execute("SELECT 1 FROM withdrawal_imports WHERE digest = ?", (digest,)).fetchone():
+            return False
+        db.executemany("INSERT INTO withdrawals (user, amount, time, guild, state, notified, closed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(entry["user"], entry["amount"], entry["time"], entry["guild"], entry["state"],
+                         entry["state"] != "pending", entry.get("closed")) for _, entry in requests])
+        db.execute("INSERT INTO withdrawal_imports VALUES (?)", (digest,))
+        return True
+
+    def request(self, user_id, amount, guild_id):
+        # 引き落としと申請の記録を同じトランザクションで行う。残高不足なら None
+        self._ensure_loaded()
+        request_id = self._write(self._request, user_id, amount, guild_id)
+        if request_id is not None:
+            self.wake.set()
+        return request_id
+
+    def _request(self, db, user_id, amount, guild_id):
+        if not self.store.change_balances([(user_id, -amount)]):
+            return None
+        return db.execute("INSERT INTO withdrawals (user, amount, time, guild) VALUES (?, ?, ?, ?)",
+                          (user_id, amount, int(time.time()), guild_id)).lastrowid
+
+    def open_requests(self, request_ids=None, guild_id=None):
+        # 未処理の申請（guild_id を指定すればそのサーバーの申請だけ）
+        self._ensure_loaded()
+        query = f"SELECT {self.COLUMNS} FROM withdrawals WHERE state = 'pending'"
+        params = ()
+        if guild_id is not None:
+            query += " AND guild = ?"
+            params = (guild_id,)
+        requests = [(row[0], {"user": row[1], "amount": row[2], "time": row[3], "guild": row[4],
+                              "state": row[5], "notified": bool(row[6])})
+                    for row in self.store.db.execute(query + " ORDER BY id", params)]
+        if request_ids is not None:
+            wanted = set(request_ids)
+            requests = [(rid, entry) for rid, entry in requests if rid in wanted]
+        return requests
+
+    def unnotified(self):
+        return [(rid, entry) for rid, entry in self.open_requests() if not entry["notified"]]
+
+    def last_id(self):
+        self._ensure_loaded()
+        return self.store.db.execute("SELECT COALESCE(MAX(id), 0) FROM withdrawals").fetchone()[0]
+
+    def mark_notified(self, request_ids):
+        self._ensure_loaded()
+        self._write(lambda db: db.executemany("UPDATE withdrawals SET notified = 1 WHERE id = ?",
+                                              [(rid,) for rid in request_ids]))
+
+    def mark_paid(self, request_ids, guild_id=None):
+        # 未処理の申請だけを振込済みにして、処理した (申請番号, 記録) を返す
+        self._ensure_loaded()
+        return self._write(self._close, request_ids, guild_id, "paid")
+
+    def cancel(self, request_ids, guild_id=None):
+        # 未処理の申請を取り消し、返金と同じトランザクションで記録する
+        self._ensure_loaded()
+        return self._write(self._close, request_ids, guild_id, "cancelled")
+
+    def _close(self, db, request_ids, guild_id, state):
+        targets = self.open_requests(request_ids, guild_id)
+        if state == "cancelled":
+            self.store.change_balances([(entry["user"], entry["amount"]) for _, entry in targets])
+        now = int(time.time())
+        db.executemany("UPDATE withdrawals SET state = ?, closed = ? WHERE id = ?", [(state, now, rid) for rid, _ in targets])
+        return targets
+
+    def pending_count(self):
+        if not self.loaded:
+            return 0
+        return self.store.db.execute("SELECT COUNT(*) FROM withdrawals WHERE state = 'pending'").fetchone()[0]
+
+    def totals(self):
+        if not self.loaded:
+            return {"loaded": False}
+        requests = self.open_requests()
+        return {"loaded": True, "pending": len(requests), "pending_amount": sum(entry["amount"] for _, entry in requests),
+                "unnotified": len(self.unnotified())}
+
+WITHDRAWALS = SqliteWithdrawalQueue(CURRENCY) if isinstance(CURRENCY, SqliteCurrencyStore) else WithdrawalQueue()
+metrics.Gauge("poker_pending_withdrawals", "Withdrawal requests waiting to be paid", WITHDRAWALS.pending_count)
+
+def withdrawal_line(request_id, entry):
+    return f"`#{request_id}` {mention(entry['user'])} {entry['amount']} Spt"
+
+def withdrawal_digests(entries):
+    # 申請を文字数の上限に収まるように複数通に分ける。(本文, 申請番号の一覧) を返す
+    digests, lines, ids = [], [], []
+    for request_id, entry in entries:
+        line = withdrawal_line(request_id, entry)
+        if lines and sum(len(l) + 1 for l in lines) + len(line) > WITHDRAWAL_MESSAGE_LIMIT:
+            digests.append((lines, ids))
+            lines, ids = [], []
+        lines.append(line)
+        ids.append(request_id)
+    if lines:
+        digests.append((lines, ids))
+    return [("\n".join([f"💸 **換金申請 {len(ids)} 件**（`/pay` で振込後に `!paid 番号` で処理済みにしてください）"] + lines), ids)
+            for lines, ids in digests]
+
+WITHDRAWAL_BACKOFF = {}   # 送信に失敗したサーバーID -> (連続失敗回数, 次に送ってよい時刻)
+
+async def post_withdrawal_digests():
+    # サーバーごとにそのサーバーのログチャンネルへ送る（未設定のサーバーは !withdrawals で確認してもらう）
+    # 送れなかったサーバーだけを後回しにして他のサーバーには送り続け、次に再送すべきまでの秒数（なければ None）を返す
+    by_guild = {}
+    for request_id, entry in WITHDRAWALS.unnotified():
+        by_guild.setdefault(entry["guild"], []).append((request_id, entry))
+    sent = 0
+    retry = None
+    for guild_id, entries in by_guild.items():
+        if SHARD_IDS and shard_of(guild_id) not in SHARD_IDS:
+            continue  # 申請は全プロセスで共有するので、通知はそのサーバーを担当するプロセスが送る
+        failures, retry_at = WITHDRAWAL_BACKOFF.get(guild_id, (0, 0.0))
+        wait = retry_at - time.monotonic()
+        if wait > 0:
+            retry = wait if retry is None else min(retry, wait)
+            continue
+        try:
+            channel_id = guild_config(guild_id)["log_channel"]
+            if not channel_id:
+                continue
+            channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+            for content, ids in withdrawal_digests(entries):
+                if sent:
+                    await asyncio.sleep(WITHDRAWAL_DIGEST_SPACING)
+                await channel.send(content, allowed_mentions=discord.AllowedMentions.none())
+                sent += 1
+                # 送信後に通知済みにする（ここで落ちた場合は次回もう一度通知される）
+                await retry_ledger(WITHDRAWALS.mark_notified, ids)
+        except Exception as e:
+            failures += 1
+            delay = min(WITHDRAWAL_RETRY_BASE * 2 ** (failures - 1), WITHDRAWAL_RETRY_MAX)
+            WITHDRAWAL_BACKOFF[guild_id] = (failures, time.monotonic() + delay)
+            retry = delay if retry is None else min(retry, delay)
+            print(f"⚠️ サーバー {guild_id} への換金申請の通知に失敗しました（{failures} 回目、{delay:.0f} 秒後に再送）：{e}")
+        else:
+            WITHDRAWAL_BACKOFF.pop(guild_id, None)
+    return retry
+
+WITHDRAWAL_TASKS = []
+
+async def withdrawal_worker():
+    failures = 0
+    while True:
+        try:
+            # 複数のプロセスで動かすときは、他のプロセスが取り込んだ申請にも気付くように時々確認する
+            await asyncio.wait_for(WITHDRAWALS.wake.wait(), WITHDRAWAL_POLL_INTERVAL if SHARD_IDS else None)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(WITHDRAWAL_BATCH_DELAY)
+        WITHDRAWALS.wake.clear()
+        try:
+            retry = await post_withdrawal_digests()
+            failures = 0
+        except Exception as e:
+            # サーバーごとの送信失敗以外の想定外のエラーでも、通知タスクを止めずに後で再送する
+            failures += 1
+            delay = min(WITHDRAWAL_RETRY_BASE * 2 ** (failures - 1), WITHDRAWAL_RETRY_MAX)
+            print(f"⚠️ 換金申請の通知に失敗しました（{failures} 回目、{delay:.0f} 秒後に再送）：{e}")
+            WITHDRAWALS.wake.set()
+            await asyncio.sleep(delay)
+            continue
+        if retry is not None:
+            # 後回しにしたサーバーの再送時刻に起こす（それまでに新しい申請があれば他のサーバーには先に送る）
+            asyncio.get_running_loop().call_later(retry, WITHDRAWALS.wake.set)
 
-@bot.tree.command(name="changem", description="Bot内通貨を換金申請します（手動振込）", guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="changem", description="Bot内通貨を換金申請します（手動振込）")
 @app_commands.describe(amount="換金する通貨量")
+@metrics.timed(COMMAND_LATENCY, command="changem")
 async def change(interaction: discord.Interaction, amount: int):
     if amount <= 0:
         await interaction.response.send_message("⚠️ 金額は1以上にしてください。", ephemeral=True)
         return
+    if not guild_config(interaction.guild_id)["withdraw"]:
+        await interaction.response.send_message("❌ このサーバーでは換金申請を受け付けていません。", ephemeral=True)
+        return
 
-    if subtract_balance(interaction.user.id, amount):
-        await interaction.response.send_message(f"💰 {amount} spt の換金申請を受け付けました。", ephemeral=True)
-
-        log_channel = bot.get_channel(LOG_CHANNEL_ID)
-        if log_channel:
-            await log_channel.send(f"💸 {interaction.user.mention} が {amount} spt の換金を申請しました。 `/pay` にて振込をお願いします。")
-        else:
-            await interaction.channel.send("⚠️ ログチャンネルが見つかりませんでした。")
-    else:
+    request_id = await retry_ledger(WITHDRAWALS.request, interaction.user.id, amount, interaction.guild_id)
+    if request_id is None:
         await interaction.response.send_message("❌ 残高が不足しています。", ephemeral=True)
+        return
+    await interaction.response.send_message(
+        f"💰 {amount} spt の換金申請を受け付けました（申請番号 #{request_id}）。運営が確認後に振り込みます。", ephemeral=True)
 
-@bot.tree.command(name="walletm", description="現在のBot内通貨残高を確認します", guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="walletm", description="現在のBot内通貨残高を確認します")
+@metrics.timed(COMMAND_LATENCY, command="walletm")
 async def wallet(interaction: discord.Interaction):
     balance = get_balance(interaction.user.id)
     await interaction.response.send_message(f"💼 あなたの残高は {balance} spt です。", ephemeral=True)
     
-@bot.tree.command(name="startpoker", description="ポーカーゲームを開始します（主催者のみ）", guild=discord.Object(id=GUILD_ID))
+LEADERBOARD_SIZE = 10
+
+@bot.tree.command(name="leaderboardm", description="Bot内通貨の残高ランキングを表示します")
+@metrics.timed(COMMAND_LATENCY, command="leaderboardm")
+async def leaderboard(interaction: discord.Interaction):
+    index = CURRENCY.ranking()
+    top = index.top(LEADERBOARD_SIZE)
+    if not top:
+        await interaction.response.send_message("📭 まだ残高のあるユーザーがいません。", ephemeral=True)
+        return
+
+    medals = ["🥇", "🥈", "🥉"]
+    lines = [f"🏆 **残高ランキング**（全 {len(index)} 人）"]
+    for i, (user_id, balance) in enumerate(top):
+        place = medals[i] if i < len(medals) else f"{i + 1}."
+        lines.append(f"{place} {mention(user_id)} {balance} Spt")
+    rank = index.rank(str(interaction.user.id), get_balance(interaction.user.id))
+    if rank and rank > LEADERBOARD_SIZE:
+        lines.append(f"…\n{rank}. {interaction.user.mention} {get_balance(interaction.user.id)} Spt")
+    await interaction.response.send_message("\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
+
+@bot.tree.command(name="rankm", description="あなたの残高の順位を確認します")
+@metrics.timed(COMMAND_LATENCY, command="rankm")
+async def rank(interaction: discord.Interaction):
+    index = CURRENCY.ranking()
+    balance = get_balance(interaction.user.id)
+    position = index.rank(str(interaction.user.id), balance)
+    if position is None:
+        await interaction.response.send_message("📭 残高がないため順位はありません。", ephemeral=True)
+        return
+    await interaction.response.send_message(f"📊 あなたの順位は {len(index)} 人中 {position} 位です（残高 {balance} Spt）。", ephemeral=True)
+
+@bot.tree.command(name="statsm", description="あなたのポーカー成績を表示します")
+@metrics.timed(COMMAND_LATENCY, command="statsm")
+async def stats(interaction: discord.Interaction):
+    player_stats = HAND_HISTORY.player_stats(interaction.user.id)
+    if player_stats is None:
+        await interaction.response.send_message("📭 まだ記録されたハンドがありません。", ephemeral=True)
+        return
+
+    week = HAND_HISTORY.net_between(interaction.user.id, time.time() - 7 * 24 * 3600)
+    lines = [
+        "📈 **あなたのポーカー成績**",
+        f"🃏 {player_stats.hands} ハンド / 勝利 {player_stats.wins} 回（勝率 {player_stats.wins / player_stats.hands:.1%}）",
+        f"💰 通算収支 {player_stats.net:+} Spt / 直近7日 {week:+} Spt / 賭け金合計 {player_stats.wagered} Spt",
+    ]
+    for category in reversed(range(len(HAND_NAMES))):
+        hands = player_stats.category_hands[category]
+        if hands:
+            lines.append(f"・{HAND_NAMES[category]}：{hands} 回（勝率 {player_stats.category_wins[category] / hands:.0%}）")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+@bot.tree.command(name="startpoker", description="ポーカーゲームを開始します（主催者のみ）")
+@metrics.timed(COMMAND_LATENCY, command="startpoker")
 async def start_poker(interaction: discord.Interaction):
     game = POKER_GAMES.get(interaction.channel_id)
     if not game:
         await interaction.response.send_message("ポーカーが開始されていません。", ephemeral=True)
         return
+    if game.tournament:
+        await interaction.response.send_message("トーナメントの卓は自動で進行します。", ephemeral=True)
+        return
     if interaction.user.id != game.owner_id:
         await interaction.response.send_message("このコマンドは主催者のみ使用できます。", ephemeral=True)
         return
-    if len(game.players) < 2:
-        await interaction.response.send_message("プレイヤーが2人以上必要です。", ephemeral=True)
-        return
-    if game.started:
-        await interaction.response.send_message("すでにゲームが開始されています。", ephemeral=True)
+    try:
+        await game.actor.send(game.deal, random)
+    except RuleError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
         return
 
-    game.started = True
+    game.hand_task = asyncio.current_task()
     await interaction.response.send_message("🃏 ポーカーを開始します！ プレイヤーに手札を配ります。")
+    await run_hand(game)
 
-    # デッキ準備
-    deck = CARD_DECK.copy()
-    random.shuffle(deck)
-
-    # 手札配布と参加費処理
-    for player in game.players:
-        hand = [deck.pop() for _ in range(5)]
-        game.hands[player.id] = hand
-        file = await create_hand_image(hand)
-
+# 配札後のハンドの進行（通常の卓とトーナメントの卓で共通）
+# 想定外の例外で止まったハンドは中止して返金し、卓を次のハンドに進める状態へ戻す（中止・破棄によるキャンセルはそのまま伝える）
+async def run_hand(game: PokerGameState):
+    try:
+        await play_hand(game)
+    except Exception as e:
+        print(f"⚠️ ハンドの進行中にエラーが発生しました（チャンネル {game.channel_id}）：{e!r}")
         try:
-            await player.send(content="🎴 あなたの手札はこちら：", file=file)
+            event = await game.actor.send(game.abort)
+        except RuleError:
+            return  # 卓はすでに閉じられている
+        game.hand_task = None
+        game.status.update(phase="参加者募集中")
+        refund = f"\n💰 参加費・ベット計 {event.amount} {game.unit} を返金しました。" if event.amount else ""
+        try:
+            await game.status.channel.send(f"⚠️ エラーが発生したため、このハンドを中止しました。{refund}")
+        except discord.HTTPException:
+            pass
+
+async def play_hand(game: PokerGameState):
+    # 手札はエンジンが全員分を先に配っているので、各プレイヤーへは並行して送信
+    async def send_hand(player_id):
+        file = await create_hand_image(game.hands[player_id])
+        channel = await get_player_channel(game, player_id)
+        await channel.send(content="🎴 あなたの手札はこちら：", file=file)
+
+    results = await asyncio.gather(*(send_hand(pid) for pid in game.players), return_exceptions=True)
+    unreachable = []
+    for player_id, result in zip(game.players, results):
+        if isinstance(result, discord.HTTPException):
+            unreachable.append(player_id)
+        elif isinstance(result, BaseException):
+            raise result
+
+    # 参加費はまとめて1回の更新で徴収
+    # トーナメントのアンティは送れなかった人からも取る（取らないとチップが減らず、脱落しないまま卓が終わらない）
+    reachable = [pid for pid in game.players if pid not in unreachable]
+    if game.tournament:
+        paid = await game.actor.send(game.collect_entry_fees, game.players, unreachable)
+    else:
+        paid = await game.actor.send(game.collect_entry_fees, reachable)
 
-            if subtract_balance(player.id, 100):
-                game.pot += 100
-                await player.send("💸 参加費として 100 Spt を支払いました。")
-            else:
-                await player.send("❌ 残高不足で参加費を支払えませんでした。フォールド扱いになります。")
-                game.folded.add(player.id)
-        except discord.Forbidden:
-            await interaction.channel.send(f"⚠️ {player.mention} にDMを送れませんでした。")
+    async def send_fee_result(player_id):
+        channel = await get_player_channel(game, player_id)
+        if player_id in paid:
+            await channel.send(f"💸 参加費として {game.entry_fee} {game.unit} を支払いました。")
+        else:
+            await channel.send(f"❌ {game.unit}が足りず参加費を支払えませんでした。フォールド扱いになります。")
 
-    # ゲーム状態初期化（1巡目）
-    game.turn_index = 0
-    game.first_round = True
-    game.round_bets = {}
-    game.current_bet = 0
+    results = await asyncio.gather(*(send_fee_result(pid) for pid in reachable), return_exceptions=True)
+    unreachable += [pid for pid, r in zip(reachable, results) if isinstance(r, discord.HTTPException)]
+
+    if unreachable:
+        mentions = ", ".join(mention(pid) for pid in unreachable)
+        game.status.log(f"⚠️ {mentions} に{PLAYER_CHANNEL_NAME}で送れませんでした。")
+    if game.tournament:
+        game.tournament.note_unreachable(game.players, unreachable)
 
     # ▶️ 1巡目アクション
-    await play_turn(interaction, game)
+    await game.actor.send(game.begin_round, True)
+    game.status.update(phase="1巡目")
+    await play_turn(game)
 
     # 🔁 カード交換フェーズ
-    await exchange_cards(interaction, game, deck)
-
-    # ゲーム状態初期化（2巡目）
-    game.turn_index = 0
-    game.first_round = False
-    game.round_bets = {}
-    game.current_bet = 0
+    await exchange_cards(game)
 
     # ▶️ 2巡目アクション
-    await play_turn(interaction, game)
+    await game.actor.send(game.begin_round, False)
+    game.status.update(phase="2巡目")
+    await play_turn(game)
 
     # 🏆 ショウダウン（勝敗判定）
-    await showdown(interaction, game)
-# 同期コマンド
+    await showdown(game)
+
+# トーナメント：1回の登録で参加者を複数の卓（スレッド）に振り分け、全卓のハンドを同時に進める
+# 各ハンドの後でチップが参加費を下回ったプレイヤーを脱落させ、卓の人数をそろえ直す（席割りは tournament.Seating）
+TOURNAMENT_CHIPS = 5000
+TOURNAMENT_LEVEL_HANDS = 5   # このハンド数ごとに参加費（アンティ）を倍にする
+TOURNAMENT_MISSED_HANDS = 3  # 続けてこのハンド数だけ手札を送れなかった人は脱落させる
+TOURNAMENTS = {}             # 登録チャンネルID -> Tournament
+
+class Tournament:
+    def __init__(self, channel, owner_id, buy_in, chips=TOURNAMENT_CHIPS):
+        self.channel = channel
+        self.owner_id = owner_id
+        self.buy_in = buy_in
+        self.chips = chips
+        self.players = []
+        self.wallet = DictWallet()    # トーナメントのチップ（Spt とは別）
+        self.seating = Seating()
+        self.games = {}               # 卓番号 -> PokerGameState
+        self.entry_fee = ENTRY_FEE
+        self.task = None
+        self.refunded = False
+        self.closed = False
+        self.missed = {}              # プレイヤーID -> 続けて手札を送れなかったハンド数
+        self.key = f"tournament:{channel.id}"   # 卓ジャーナルでの記録名（参加費を再起動後に返金するため）
+
+    def record(self, kind, player=None, amount=0, data=None):
+        TABLE_JOURNAL.write(self.key, kind, player, amount, data)
+
+    def register(self, player_id):
+        if self.task:
+            raise RuleError("トーナメントはすでに開始しています。")
+        if player_id in self.wallet.balances:
+            raise RuleError("すでに登録しています。")
+        if self.buy_in:
+            if not subtract_balance(player_id, self.buy_in):
+                raise RuleError("残高が不足しています。")
+            self.record("buyin", player_id, self.buy_in)
+        self.players.append(player_id)
+        self.wallet.balances[player_id] = self.chips
+
+    def refund(self):
+        if self.buy_in and not self.refunded:
+            refunds = {pid: self.buy_in for pid in self.players}
+            add_balances(refunds)
+            self.record("abort", amount=sum(refunds.values()), data=list(refunds.items()))
+        self.refunded = True
+
+    def close(self):
+        if not self.closed:
+            self.record("close")
+        self.closed = True
+
+    async def open_table(self, table):
+        thread = await self.channel.create_thread(name=f"🏆 トーナメント 卓{table + 1}", type=discord.ChannelType.public_thread)
+        game = PokerGameState(self.owner_id, thread.id, wallet=self.wallet, tournament=self)
+        game.status = TableStatus(thread, game)
+        POKER_GAMES[thread.id] = game
+        self.games[table] = game
+
+    def close_table(self, table):
+        game = self.games.pop(table)
+        if game.channel_id in POKER_GAMES:
+            del POKER_GAMES[game.channel_id]
+
+    async def play_table(self, table):
+        game = self.games[table]
+        await game.actor.send(game.seat, self.seating.tables[table])
+        game.entry_fee = self.entry_fee
+        await game.actor.send(game.deal, random)
+        await run_hand(game)
+
+    def note_unreachable(self, players, unreachable):
+        for pid in players:
+            self.missed[pid] = self.missed.get(pid, 0) + 1 if pid in unreachable else 0
+
+    def eliminate(self):
+        # チップが参加費を下回った人と、続けて手札を送れなかった人を脱落させ、(順位, プレイヤーID) を返す
+        # （全員が該当したらチップの最も多い1人は残す）。チップの少ない人から順に、残っている人数の順位を付ける
+        busted = sorted((pid for pid in self.seating.table_of
+                         if self.wallet.balance(pid) < self.entry_fee or self.missed.get(pid, 0) >= TOURNAMENT_MISSED_HANDS),
+                        key=self.wallet.balance)
+        if len(busted) == len(self.seating):
+            busted.pop()
+        places = []
+        for pid in busted:
+            places.append((len(self.seating), pid))
+            self.seating.remove(pid)
+        return places
+
+    def table_name(self, table):
+        return f"<#{self.games[table].channel_id}>" if table in self.games else f"卓{table + 1}"
+
+    async def run(self):
+        try:
+            self.seating.seat_all(self.players)
+            await asyncio.gather(*(self.open_table(t) for t in self.seating.tables))
+            lines = [f"🏆 **トーナメント開始**（{len(self.players)} 人 / {len(self.games)} 卓）"]
+            for table, players in self.seating.tables.items():
+                lines.append(f"{self.table_name(table)}：" + " ".join(mention(pid) for pid in players))
+            await self.channel.send("\n".join(lines))
+
+            hand = 0
+            while len(self.seating) > 1:
+                hand += 1
+                entry_fee = ENTRY_FEE * 2 ** ((hand - 1) // TOURNAMENT_LEVEL_HANDS)
+                if entry_fee != self.entry_fee:
+                    self.entry_fee = entry_fee
+                    await self.channel.send(f"⏫ 参加費が {entry_fee} チップに上がりました。")
+                tables = [t for t, players in self.seating.tables.items() if len(players) >= 2]
+                await asyncio.gather(*(self.play_table(t) for t in tables))
+
+                lines = [f"💀 {place}位：{mention(pid)}" for place, pid in self.eliminate()]
+                moves, closed = self.seating.rebalance()
+                lines += [f"🔀 {mention(pid)}：{self.table_name(src)} → {self.table_name(dst)}" for pid, src, dst in moves]
+                for table in closed:
+                    await self.games[table].status.channel.send("🏁 この卓は解散しました。")
+                    self.close_table(table)
+                if lines:
+                    await self.channel.send("\n".join(lines))
+
+            winner = next(iter(self.seating.table_of))
+            prize = self.buy_in * len(self.players)
+            if prize:
+                await retry_ledger(add_balance, winner, prize)
+                self.record("settle", data=[(winner, prize)])
+            self.refunded = True  # 賞金を払ったので中止時の返金はしない
+            await self.channel.send(f"🥇 優勝：{mention(winner)}！" + (f" 賞金 {prize} Spt を獲得しました。" if prize else ""))
+        except Exception as e:
+            print(f"⚠️ トーナメントが異常終了しました：{e}")
+            await retry_ledger(self.refund)
+            await self.channel.send("⚠️ トーナメントを続行できなくなったため中止し、参加費を返金しました。")
+        finally:
+            for table in list(self.games):
+                self.close_table(table)
+            self.close()
+            if TOURNAMENTS.get(self.channel.id) is self:
+                del TOURNAMENTS[self.channel.id]
+
+# トーナメントの登録ボタン
+class TournamentJoinView(discord.ui.View):
+    def __init__(self, channel_id):
+        super().__init__(timeout=None)
+        self.channel_id = channel_id
+
+    @discord.ui.button(label="登録する", style=discord.ButtonStyle.primary)
+    @metrics.timed(VIEW_LATENCY, view="tournament_join")
+    async def register(self, interaction: discord.Interaction, button: discord.ui.Button):
+        tournament = TOURNAMENTS.get(self.channel_id)
+        if not tournament:
+            await interaction.response.send_message("このトーナメントは終了しています。", ephemeral=True)
+            return
+        try:
+            await retry_ledger(tournament.register, interaction.user.id)
+        except RuleError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+        remember_user(interaction.user)
+        await interaction.response.send_message("🏆 トーナメントに登録しました！", ephemeral=True)
+        await interaction.channel.send(f"✅ {interaction.user.mention} さんが登録しました（{len(tournament.players)} 人）")
+
+@bot.tree.command(name="tournamentm", description="ポーカートーナメントの参加者を募集します")
+@app_commands.describe(buy_in="参加費（Spt、優勝者が総取り）", chips="開始時のチップ")
+@metrics.timed(COMMAND_LATENCY, command="tournamentm")
+async def tournament(interaction: discord.Interaction, buy_in: int = 0, chips: int = TOURNAMENT_CHIPS):
+    if buy_in < 0 or chips < ENTRY_FEE:
+        await interaction.response.send_message(f"⚠️ 参加費は0以上、チップは{ENTRY_FEE}以上で指定してください。", ephemeral=True)
+        return
+    if interaction.channel_id in TOURNAMENTS:
+        await interaction.response.send_message("このチャンネルではすでにトーナメントを募集・開催中です。", ephemeral=True)
+        return
+    tournament = Tournament(interaction.channel, interaction.user.id, buy_in, chips)
+    tournament.record("open", interaction.user.id, data="tournament")
+    TOURNAMENTS[interaction.channel_id] = tournament
+    await interaction.response.send_message(
+        f"🏆 ポーカートーナメントの参加者を募集します！（参加費 {buy_in} Spt / 開始チップ {chips}）\n"
+        f"参加者は自動で卓に振り分けられます👇",
+        view=TournamentJoinView(interaction.channel_id),
+    )
+
+@bot.tree.command(name="starttournamentm", description="トーナメントを開始します（主催者のみ）")
+@metrics.timed(COMMAND_LATENCY, command="starttournamentm")
+async def start_tournament(interaction: discord.Interaction):
+    tournament = TOURNAMENTS.get(interaction.channel_id)
+    if not tournament or tournament.task:
+        await interaction.response.send_message("開始できるトーナメントがありません。", ephemeral=True)
+        return
+    if interaction.user.id != tournament.owner_id:
+        await interaction.response.send_message("このコマンドは主催者のみ使用できます。", ephemeral=True)
+        return
+    if len(tournament.players) < 2:
+        await interaction.response.send_message("プレイヤーが2人以上必要です。", ephemeral=True)
+        return
+    tournament.task = asyncio.create_task(tournament.run())
+    await interaction.response.send_message("🏆 トーナメントを開始します！各卓のスレッドを確認してください。")
+
+@bot.tree.command(name="canceltournamentm", description="トーナメントを中止して参加費を返金します（主催者のみ）")
+@metrics.timed(COMMAND_LATENCY, command="canceltournamentm")
+async def cancel_tournament(interaction: discord.Interaction):
+    tournament = TOURNAMENTS.get(interaction.channel_id)
+    if not tournament:
+        await interaction.response.send_message("⚠️ 現在このチャンネルで開催中のトーナメントはありません。", ephemeral=True)
+        return
+    if interaction.user.id != tournament.owner_id:
+        await interaction.response.send_message("❌ このコマンドは主催者のみ使用できます。", ephemeral=True)
+        return
+    await retry_ledger(tournament.refund)
+    tournament.close()
+    del TOURNAMENTS[interaction.channel_id]
+    if tournament.task:
+        tournament.task.cancel()
+    await interaction.response.send_message("🛑 トーナメントを中止し、参加費を返金しました。")
+
+# コマンド定義のハッシュが前回の同期時から変わったときだけ同期する
+COMMAND_HASH_FILE = ".command_tree_hash.json"
+
+def command_tree_hash(guild):
+    payload = []
+    for cmd in bot.tree.get_commands(guild=guild):
+        params = [(p.name, p.description, str(p.type), p.required) for p in getattr(cmd, "parameters", [])]
+        payload.append((cmd.name, getattr(cmd, "description", ""), params))
+    return hashlib.sha256(json.dumps(sorted(payload), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def sync_command_tree(force=False):
+    # コマンドはすべてのサーバーで使えるグローバルコマンドとして同期する
+    digest = command_tree_hash(None)
+    stored = {}
+    if os.path.exists(COMMAND_HASH_FILE):
+        with open(COMMAND_HASH_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    if not force and stored.get("global") == digest:
+        return False
+    await bot.tree.sync()
+    # 以前サーバー単位で登録していたコマンドは二重に表示されるので消しておく
+    # まだグローバルで同期したことがなければ、ハッシュの記録がなくても最初のサーバーの登録を消す
+    guild_ids = [key for key in stored if key != "global"]
+    if "global" not in stored and str(GUILD_ID) not in guild_ids:
+        guild_ids.append(str(GUILD_ID))
+    for guild_id in guild_ids:
+        await bot.tree.sync(guild=discord.Object(id=int(guild_id)))
+        stored.pop(guild_id, None)
+    stored["global"] = digest
+    with open(COMMAND_HASH_FILE, "w", encoding="utf-8") as f:
+        json.dump(stored, f)
+    return True
+
+# 同期コマンド（強制的に再同期）。全サーバーに効き、同期の回数制限もあるので Bot の所有者だけが使える
 @bot.command()
+@commands.is_owner()
 async def sync(ctx):
-    await bot.tree.sync(guild=ctx.guild)
+    await sync_command_tree(force=True)
     await ctx.send("✅ コマンドを再同期しました")
 
+# サーバーごとの設定の確認と変更（運営用）。例：!guildconfig log_channel #換金ログ / !guildconfig charge off
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def guildconfig(ctx, key=None, value=None):
+    if key is not None:
+        try:
+            set_guild_config(ctx.guild.id, key, parse_guild_setting(key, value or ""))
+        except KeyError:
+            await ctx.send(f"⚠️ 設定項目は {' / '.join(GUILD_DEFAULTS)} のいずれかです。")
+            return
+        except ValueError:
+            await ctx.send(f"⚠️ `{key}` の値が正しくありません。")
+            return
+    config = guild_config(ctx.guild.id)
+    lines = [f"⚙️ **{ctx.guild.name} の設定**（シャード {shard_of(ctx.guild.id)}）"]
+    lines += [f"・{name}：{config[name]}" for name in GUILD_DEFAULTS]
+    await ctx.send("\n".join(lines))
+
+# 内部の状況（Bot 全体の数字なので、所有者かサーバーの管理者だけが見られる）
+owner_or_admin = commands.check_any(commands.is_owner(), commands.has_permissions(administrator=True))
+
+# 入力待ちの件数
+@bot.command()
+@owner_or_admin
+async def inputstats(ctx):
+    await ctx.send(f"⌨️ 入力待ち：{INPUTS.pending_count()} 件")
+
+# 卓の状況
+@bot.command()
+@owner_or_admin
+async def tablestats(ctx):
+    stats = POKER_GAMES.stats()
+    shards = ",".join(map(str, bot.shard_ids)) if bot.shard_ids else "すべて"
+    await ctx.send(
+        f"🛰️ シャード {shards} / 全 {bot.shard_count} / 担当サーバー {len(bot.guilds)}\n"
+        f"🃏 進行中 {stats['live']} 卓 / 待機中 {stats['idle']} 卓（破棄 {stats['evicted']} 卓）\n"
+        f"💾 使用メモリ 約 {stats['memory_bytes'] / 1024:.1f} KB\n"
+        f"📝 状況表示の更新 {TABLE_STATUS_STATS['updates']} 件 → API {TABLE_STATUS_STATS['api_calls']} 回"
+        f"（レート制限 {TABLE_STATUS_STATS['rate_limited']} 回）"
+    )
+
+# 描画ワーカーの状況
+@bot.command()
+@owner_or_admin
+async def renderstats(ctx):
+    stats = RENDERER.stats()
+    await ctx.send(
+        f"🖼️ 待機中 {stats['queue_depth']} / 実行中 {stats['in_flight']} / 描画 {stats['rendered']} 回（共有 {stats['shared']} 回）\n"
+        f"⏱️ 平均 {stats['avg_ms']:.1f} ms / 最大 {stats['max_ms']:.1f} ms\n"
+        f"🗃️ 手札キャッシュ {len(HAND_IMAGE_CACHE.entries)} 件 / {HAND_IMAGE_CACHE.size / 1024:.0f} KB"
+        f"（ヒット {HAND_IMAGE_CACHE.hits} / ミス {HAND_IMAGE_CACHE.misses}）"
+    )
+
+# 役ごとの勝率（ショウダウンまで残った手だけ）。例：!handstats（通算） / !handstats 7（直近7日）
+@bot.command()
+@owner_or_admin
+async def handstats(ctx, days: int = 0):
+    since = time.time() - days * 24 * 3600 if days > 0 else 0
+    rates = HAND_HISTORY.category_win_rates(since)
+    lines = [f"📊 **役ごとの勝率**（{f'直近{days}日' if days > 0 else '通算'}）"]
+    for category in reversed(range(len(HAND_NAMES))):
+        hands, wins = rates[category]
+        if hands:
+            lines.append(f"・{HAND_NAMES[category]}：{hands} 回（勝率 {wins / hands:.0%}）")
+    if len(lines) == 1:
+        lines.append("📭 まだ記録されたハンドがありません。")
+    await ctx.send("\n".join(lines))
+
+# 換金申請の一覧と一括処理（運営用）。番号は「12 15 20-40」のように並べるか、all で未処理すべて
+def parse_request_ids(args, last_id):
+    # 範囲指定は実在する申請番号（1〜last_id）に切り詰める（`1-100000000` でも巨大なリストを作らない）
+    if args == ("all",):
+        return None
+    ids = []
+    for arg in args:
+        first, _, last = arg.lstrip("#").partition("-")
+        if last:
+            ids.extend(range(max(int(first), 1), min(int(last), last_id) + 1))
+        else:
+            ids.append(int(first))
+    return ids
+
+async def send_withdrawal_result(ctx, label, targets):
+    if not targets:
+        await ctx.send("📭 該当する未処理の申請はありません。")
+        return
+    total = sum(entry["amount"] for _, entry in targets)
+    content = f"{label} {len(targets)} 件 / 計 {total} Spt：" + " ".join(f"#{rid}" for rid, _ in targets)
+    await ctx.send(content[:WITHDRAWAL_MESSAGE_LIMIT])
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def withdrawals(ctx):
+    requests = WITHDRAWALS.open_requests(guild_id=ctx.guild.id)
+    if not requests:
+        await ctx.send("📭 未処理の換金申請はありません。")
+        return
+    content, ids = withdrawal_digests(requests)[0]
+    if len(requests) > len(ids):
+        content += f"\n…ほか {len(requests) - len(ids)} 件"
+    await ctx.send(content, allowed_mentions=discord.AllowedMentions.none())
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def paid(ctx, *request_ids):
+    try:
+        ids = parse_request_ids(request_ids, WITHDRAWALS.last_id())
+    except ValueError:
+        await ctx.send("⚠️ 申請番号は `!paid 12 15 20-40` または `!paid all` の形式で指定してください。")
+        return
+    await send_withdrawal_result(ctx, "✅ 振込済みにしました：", await retry_ledger(WITHDRAWALS.mark_paid, ids, ctx.guild.id))
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def refundw(ctx, *request_ids):
+    try:
+        ids = parse_request_ids(request_ids, WITHDRAWALS.last_id())
+    except ValueError:
+        await ctx.send("⚠️ 申請番号は `!refundw 12 15 20-40` または `!refundw all` の形式で指定してください。")
+        return
+    await send_withdrawal_result(ctx, "↩️ 取り消して返金しました：", await retry_ledger(WITHDRAWALS.cancel, ids, ctx.guild.id))
+
+# 再起動前の卓を復元する（進行中だったハンドは返金して募集中に戻す）
+async def restore_tables():
+    start = time.perf_counter()
+    restored = 0
+    for channel_id, record, refunded in await retry_ledger(TABLE_JOURNAL.recover):
+        if record.get("tournament"):
+            # トーナメントは再開できないので、参加費を返金したことだけを知らせて記録を閉じる
+            channel = bot.get_channel(int(channel_id.split(":")[1]))
+            if channel is not None and refunded:
+                try:
+                    await channel.send(f"♻️ 再起動のためトーナメントを中止し、参加費 計 {refunded} Spt を返金しました。")
+                except discord.HTTPException:
+                    pass
+            TABLE_JOURNAL.write(channel_id, "close")
+            continue
+        channel = bot.get_channel(int(channel_id))
+        if channel is None:
+            TABLE_JOURNAL.write(channel_id, "close")
+            continue
+        game = PokerGameState(owner_id=record["owner"], channel_id=channel.id,
+                              entry_fee=guild_config(channel.guild.id)["entry_fee"])
+        game.players = list(record["players"])
+        game.status = TableStatus(channel, game)
+        POKER_GAMES[channel.id] = game
+        if record["message"]:
+            view = PokerJoinView(channel_id=channel.id)
+            game.views.add(view)
+            bot.add_view(view, message_id=record["message"])
+        if refunded:
+            game.status.log(f"♻️ 再起動のため進行中のハンドを中止し、計 {refunded} Spt を返金しました。")
+        restored += 1
+    if restored:
+        print(f"♻️ 卓を {restored} 件復元しました（{(time.perf_counter() - start) * 1000:.1f} ms）")
+
+async def adopt_orphaned_state():
+    # SHARD_IDS を変えて取り残された卓の記録とハンド履歴を引き継ぐ（restore_tables の前に呼ぶ）
+    # 拠出金は返金し、募集中の卓はこのプロセスの担当チャンネルなら自分の記録に移す。見えないチャンネルの卓は返金して閉じる
+    for tag in sorted(set(orphaned_tags("tables", ".json")) | set(orphaned_tags("tables", ".journal"))):
+        name = f"tables{tag}"
+        if not claim(name):
+            continue
+        journal = TableJournal(f"{name}.json", f"{name}.journal")
+        moved = closed = 0
+        for channel_id, record, refunded in await retry_ledger(journal.recover):
+            if record.get("tournament"):
+                channel = bot.get_channel(int(channel_id.split(":")[1]))
+            else:
+                channel = bot.get_channel(int(channel_id))
+            if channel is not None and refunded:
+                try:
+                    await channel.send(f"♻️ 再起動のため進行中のゲームを中止し、計 {refunded} Spt を返金しました。")
+                except discord.HTTPException:
+                    pass
+            if channel is None or record.get("tournament"):
+                closed += 1
+                continue
+            TABLE_JOURNAL.write(channel_id, "open", record["owner"])
+            for pid in record["players"]:
+                TABLE_JOURNAL.write(channel_id, "join", pid)
+            TABLE_JOURNAL.write(channel_id, "message", data=record["message"])
+            moved += 1
+        journal.journal.close()
+        for path in (journal.snapshot_file, journal.journal_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        release(name)
+        print(f"♻️ {name} を引き継ぎました（卓 {moved} 件を移し、{closed} 件を返金して閉じました）")
+    for tag in orphaned_tags("history"):
+        name = f"history{tag}"
+        if not claim(name):
+            continue
+        HAND_HISTORY.merge(HandHistory(directory=name))
+        shutil.rmtree(name)
+        release(name)
+        print(f"♻️ ハンド履歴 {name} を取り込みました")
+
+# 放置された卓の定期破棄
+@tasks.loop(minutes=1)
+async def evict_idle_tables():
+    POKER_GAMES.evict_idle()
+    HAND_HISTORY.flush()
+
 # 起動時
 @bot.event
 async def on_ready():
+    if not evict_idle_tables.is_running():
+        evict_idle_tables.start()
+    # 台帳は最初の操作を待たずに読み込んでおく（/readyz はこれで準備完了を判断する）
+    if not CURRENCY.loaded:
+        await retry_ledger(CURRENCY.load)
+    if not WITHDRAWALS.loaded:
+        await retry_ledger(WITHDRAWALS.load)
+    # 換金通知のタスクが止まっていたら（再接続のたびに確認して）起動し直す
+    if not WITHDRAWAL_TASKS or WITHDRAWAL_TASKS[-1].done():
+        WITHDRAWAL_TASKS.append(asyncio.create_task(withdrawal_worker()))
+    # 再接続時には何もしない
+    if "ready" in BOOT_TIMES:
+        return
+    BOOT_TIMES["ready"] = time.perf_counter() - BOOT_STARTED_AT
     bot.add_view(PokerJoinView(None))
-    await bot.tree.sync(guild=discord.Object(id=GUILD_ID))
-    print(f"✅ Bot connected as {bot.user}")
-
-# 起動
-keep_alive()
-bot.run(os.environ["DISCORD_TOKEN"])
+    await adopt_orphaned_state()
+    await restore_tables()
+    # 複数のプロセスで動かすときは、シャード0を担当するプロセスだけが同期する
+    synced = await sync_command_tree() if 0 in (bot.shard_ids or [0]) else False
+    BOOT_TIMES["synced"] = time.perf_counter() - BOOT_STARTED_AT
+    await asyncio.gather(*map(asyncio.wrap_future, warm_odds_workers()))
+    # カード画像は描画スレッドで先読みしておく（描画側は必要なら完了を待つ）
+    global CARD_PRELOAD
+    CARD_PRELOAD = asyncio.get_running_loop().run_in_executor(RENDERER.executor, load_card_images)
+    print(f"✅ Bot connected as {bot.user}（コマンド同期：{'実行' if synced else '変更なし'}）")
+    print(f"⏱️ import {BOOT_TIMES['import'] * 1000:.0f} ms / ready {BOOT_TIMES['ready'] * 1000:.0f} ms")
+
+@bot.listen("on_interaction")
+async def record_first_command(interaction: discord.Interaction):
+    if "first_command" not in BOOT_TIMES:
+        BOOT_TIMES["first_command"] = time.perf_counter() - BOOT_STARTED_AT
+        print(f"⏱️ 最初のコマンドまで {BOOT_TIMES['first_command'] * 1000:.0f} ms")
+
+# 管理サーバー（keep_alive）に渡す状態
+def readiness():
+    return {
+        "commands_synced": "synced" in BOOT_TIMES,
+        "ledger_loaded": CURRENCY.loaded,
+    }
+
+def table_summaries():
+    now = time.monotonic()
+    return [{
+        "channel_id": str(channel_id),
+        "shard": shard_of(getattr(game.status.channel.guild, "id", None)) if game.status else None,
+        "owner_id": str(game.owner_id),
+        "phase": game.status.phase if game.status else None,
+        "started": game.started,
+        "players": [str(pid) for pid in game.players],
+        "folded": [str(pid) for pid in game.folded],
+        "pot": game.pot,
+        "current_bet": game.current_bet,
+        "idle_seconds": round(now - game.last_active, 1),
+    } for channel_id, game in POKER_GAMES.items()]
+
+def ledger_totals():
+    totals = CURRENCY.totals()
+    totals["withdrawals"] = WITHDRAWALS.totals()
+    return totals
+
+# 起動（loadtest.py などから import したときは起動しない）
+if __name__ == "__main__":
+    if SHARD_IDS and CURRENCY_BACKEND != "sqlite":
+        sys.exit("⚠️ SHARD_IDS で複数のプロセスに分けるときは CURRENCY_BACKEND=sqlite で台帳を共有してください。")
+    keep_alive(bot, ready=readiness, tables=table_summaries, ledger=ledger_totals)
+    bot.run(os.environ["DISCORD_TOKEN"])
 
 
 
@@ -0,0 +1,131 @@
+# 計測：カウンタ・ゲージ・ヒストグラムを集め、Prometheus のテキスト形式で出力する
+# METRICS_ENABLED=1 のときだけ計測する。無効時は timed() が関数をそのまま返すので、処理の経路には何も足されない
+import asyncio
+import functools
+import os
+import time
+from bisect import bisect_left
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5  # 秒
+
+REGISTRY = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name + _format_labels(self.labels, key), value
+
+# 値は読み出し時に関数を呼んで取る（更新の手間がかからない）
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield self.name, self.func()
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # ラベル -> [バケットごとの件数..., 合計, 件数]
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            row[index] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def samples(self):
+        for key, row in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                yield self.name + "_bucket" + _format_labels(self.labels, key, [("le", bound)]), cumulative
+            yield self.name + "_bucket" + _format_labels(self.labels, key, [("le", "+Inf")]), row[-1]
+            yield self.name + "_sum" + _format_labels(self.labels, key), row[-2]
+            yield self.name + "_count" + _format_labels(self.labels, key), row[-1]
+
+def timed(metric, **labels):
+    # 関数（同期・非同期どちらも）の実行時間をヒストグラムに記録するデコレータ
+    def decorator(func):
+        if not ENABLED:
+            return func
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    metric.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+# イベントループの遅延：一定間隔で眠り、予定より遅れて起きた時間を記録する
+# 直近の値はヘルスチェックでも使うので、計測が無効でも loop_lag だけは更新する
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "Event loop wake-up delay",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+loop_lag = 0.0
+
+async def sample_loop_lag(interval=LOOP_LAG_INTERVAL):
+    global loop_lag
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag = max(0.0, time.perf_counter() - start - interval)
+        if ENABLED:
+            LOOP_LAG.observe(loop_lag)
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, value in metric.samples():
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
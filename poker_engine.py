@@ -0,0 +1,438 @@
+# ポーカーのルール部分（Discordに依存しない）
+# main.py の Discord 側と selfplay.py のシミュレータの両方から使う
+import random
+from collections import namedtuple
+
+# カード定義
+CARD_SUITS = ['spades', 'hearts', 'clubs', 'diamonds']
+CARD_NUMBERS = [str(i) for i in range(2, 11)] + ['J', 'Q', 'K', 'A']
+CARD_DECK = [f"{suit}_{number}" for suit in CARD_SUITS for number in CARD_NUMBERS]
+
+
+# 整数カード表現：ランク（0=2 … 12=A）* 4 + スート
+CARD_SUIT_INDEX = {suit: i for i, suit in enumerate(CARD_SUITS)}
+CARD_RANK_INDEX = {number: i for i, number in enumerate(CARD_NUMBERS)}
+CARD_INT = {f"{suit}_{number}": CARD_RANK_INDEX[number] * 4 + CARD_SUIT_INDEX[suit]
+            for suit in CARD_SUITS for number in CARD_NUMBERS}
+
+CARD_DECK_INT = sorted(CARD_INT.values())
+
+def card_to_int(name):
+    return CARD_INT[name]
+
+def int_to_card(card):
+    return f"{CARD_SUITS[card & 3]}_{CARD_NUMBERS[card >> 2]}"
+
+HAND_NAMES = ["ハイカード", "ワンペア", "ツーペア", "スリーカード", "ストレート",
+              "フラッシュ", "フルハウス", "フォーカード", "ストレートフラッシュ"]
+
+# 役の強さは1つの整数：役カテゴリ << 20 | 比較順に並べたランク（4bit×5）
+def hand_category(strength):
+    return strength >> 20
+
+def _rank_strength(values, is_flush):
+    counts = {v: values.count(v) for v in set(values)}
+    ordered = sorted(counts, key=lambda v: (counts[v], v), reverse=True)
+    shape = sorted(counts.values(), reverse=True)
+
+    straight_high = 0
+    if len(ordered) == 5:
+        if ordered[0] - ordered[4] == 4:
+            straight_high = ordered[0]
+        elif ordered == [14, 5, 4, 3, 2]:
+            straight_high = 5  # A-2-3-4-5（ホイール）
+
+    if is_flush and straight_high:
+        category, ordered = 8, [straight_high]  # ストレートフラッシュ
+    elif shape[0] == 4:
+        category = 7  # フォーカード
+    elif shape == [3, 2]:
+        category = 6  # フルハウス
+    elif is_flush:
+        category = 5  # フラッシュ
+    elif straight_high:
+        category, ordered = 4, [straight_high]  # ストレート
+    elif shape[0] == 3:
+        category = 3  # スリーカード
+    elif shape[:2] == [2, 2]:
+        category = 2  # ツーペア
+    elif shape[0] == 2:
+        category = 1  # ワンペア
+    else:
+        category = 0  # ハイカード
+
+    strength = category
+    for i in range(5):
+        strength = (strength << 4) | (ordered[i] if i < len(ordered) else 0)
+    return strength
+
+# 起動時に全ランク組み合わせの強さを事前計算しておく
+# フラッシュ以外はランク素数の積、フラッシュはランクのビット和で一意に引ける
+RANK_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_CARD_PRIME = [RANK_PRIMES[c >> 2] for c in range(52)]
+_CARD_RANKBIT = [1 << (c >> 2) for c in range(52)]
+_CARD_SUITBIT = [1 << (c & 3) for c in range(52)]
+_PRODUCT_TABLE = {}
+_FLUSH_TABLE = {}
+
+def _build_hand_tables():
+    from itertools import combinations, combinations_with_replacement
+    for ranks in combinations_with_replacement(range(13), 5):
+        if any(ranks.count(r) > 4 for r in ranks):
+            continue
+        product = 1
+        for r in ranks:
+            product *= RANK_PRIMES[r]
+        _PRODUCT_TABLE[product] = _rank_strength([r + 2 for r in ranks], False)
+    for ranks in combinations(range(13), 5):
+        bits = sum(1 << r for r in ranks)
+        _FLUSH_TABLE[bits] = _rank_strength([r + 2 for r in ranks], True)
+
+_build_hand_tables()
+
+def evaluate_cards(cards):
+    a, b, c, d, e = cards
+    if _CARD_SUITBIT[a] & _CARD_SUITBIT[b] & _CARD_SUITBIT[c] & _CARD_SUITBIT[d] & _CARD_SUITBIT[e]:
+        return _FLUSH_TABLE[_CARD_RANKBIT[a] | _CARD_RANKBIT[b] | _CARD_RANKBIT[c] | _CARD_RANKBIT[d] | _CARD_RANKBIT[e]]
+    return _PRODUCT_TABLE[_CARD_PRIME[a] * _CARD_PRIME[b] * _CARD_PRIME[c] * _CARD_PRIME[d] * _CARD_PRIME[e]]
+
+def evaluate_hands(hands):
+    # 多数の手札をまとめて評価（テーブル参照をローカルに束縛してループの負荷を下げる）
+    suitbit, rankbit, prime = _CARD_SUITBIT, _CARD_RANKBIT, _CARD_PRIME
+    flush_table, product_table = _FLUSH_TABLE, _PRODUCT_TABLE
+    results = []
+    append = results.append
+    for a, b, c, d, e in hands:
+        if suitbit[a] & suitbit[b] & suitbit[c] & suitbit[d] & suitbit[e]:
+            append(flush_table[rankbit[a] | rankbit[b] | rankbit[c] | rankbit[d] | rankbit[e]])
+        else:
+            append(product_table[prime[a] * prime[b] * prime[c] * prime[d] * prime[e]])
+    return results
+
+def evaluate_hand(cards):
+    return evaluate_cards([CARD_INT[c] for c in cards])
+
+# ポットの精算：各プレイヤーの総拠出額からメインポット・サイドポットを組み立てて配分する
+def settle_pots(contributions, strengths, order):
+    """contributions: {ID: このハンドでの総拠出額}
+    strengths: {ID: 役の強さ}（ショウダウンに残ったプレイヤーのみ）
+    order: 席順（端数チップはこの順で勝者に1枚ずつ配る）
+    戻り値: ({ID: 受取額}, [(ポット額, 勝者IDのリスト), ...])
+    争う人が1人もいない（残った全員が拠出していない）場合はポットを作らず、拠出額をそのまま返す"""
+    payouts = {}
+    pots = []
+    carry = 0
+    prev = 0
+    for level in sorted({c for c in contributions.values() if c > 0}):
+        amount = carry + sum(min(c, level) - min(c, prev) for c in contributions.values())
+        prev = level
+        eligible = [pid for pid in order if pid in strengths and contributions.get(pid, 0) >= level]
+        if not eligible:
+            # この層を争う人がいない（フォールドした人の超過分）ので直前のポットに加える
+            if pots:
+                pots[-1] = (pots[-1][0] + amount, pots[-1][1])
+                carry = 0
+            else:
+                carry = amount
+            continue
+        carry = 0
+        best = max(strengths[pid] for pid in eligible)
+        pots.append((amount, [pid for pid in eligible if strengths[pid] == best]))
+
+    for amount, winners in pots:
+        share, odd = divmod(amount, len(winners))
+        for i, pid in enumerate(winners):
+            payouts[pid] = payouts.get(pid, 0) + share + (1 if i < odd else 0)
+    if carry:
+        # どの層にも受け取れる人がいなかったので全額返金
+        return {pid: c for pid, c in contributions.items() if c > 0}, []
+    return payouts, pots
+
+def uncalled_bet(pots, contributions):
+    # 最後のポットが、最も多く出した人の誰にもコールされなかった超過分だけなら (ID, 額)。勝ちではなく払い戻し
+    if not pots or len(pots[-1][1]) != 1:
+        return None
+    amount, (pid,) = pots[-1]
+    others = max((c for p, c in contributions.items() if p != pid), default=0)
+    return (pid, amount) if contributions.get(pid, 0) - others == amount else None
+
+# 交換シミュレーション：最大3枚までの全ての捨て方について、残りカードからの引きを試行して役の期待値を求める
+ODDS_SAMPLES = 1500  # 捨て方ごとの試行回数（組み合わせ数がこれ以下なら全列挙）
+
+def discard_odds(hand, samples=ODDS_SAMPLES, rng=None):
+    from itertools import combinations
+    from math import comb
+    rng = rng or random.Random()
+    cards = list(hand)
+    unseen = [c for c in CARD_DECK_INT if c not in cards]  # 本人から見えていないカード
+
+    results = []
+    for k in range(4):
+        for discard in combinations(range(5), k):
+            keep = [cards[i] for i in range(5) if i not in discard]
+            if comb(len(unseen), k) <= samples:
+                draws = combinations(unseen, k)
+            else:
+                draws = (rng.sample(unseen, k) for _ in range(samples))
+            categories = [hand_category(v) for v in evaluate_hands([keep + list(d) for d in draws])]
+            distribution = [categories.count(cat) / len(categories) for cat in range(len(HAND_NAMES))]
+            expected = sum(cat * p for cat, p in enumerate(distribution))
+            results.append((tuple(i + 1 for i in discard), expected, distribution))
+
+    results.sort(key=lambda r: r[1], reverse=True)
+    return results
+
+# 卓のルール設定
+ENTRY_FEE = 100
+MIN_BET = 100
+MAX_BET = 500
+HAND_SIZE = 5
+MAX_EXCHANGE = 3
+MAX_PLAYERS = 6   # 5枚の手札＋交換用3枚を全員に確保しても山札（52枚）が足りる人数
+
+# 卓で起きた出来事（join / deal / fees / bet / call / check / allin / raise / fold / timeout / exchange / settle / abort）
+Event = namedtuple("Event", "kind player amount data")
+
+# showdown の結果：results は [(ID, 役の強さ, 手札)]、payouts は {ID: 受取額}、pots は settle_pots の戻り値
+# contributions は精算前の {ID: 拠出額}（受取額との差が収支）
+Showdown = namedtuple("Showdown", "results payouts pots contributions")
+
+class RuleError(Exception):
+    """ルール上できない操作。メッセージはそのままプレイヤーに表示する"""
+
+# シミュレーション用の残高（Discord 側では台帳につながったものを渡す）
+class DictWallet:
+    def __init__(self, balances=None):
+        self.balances = dict(balances or {})
+
+    def balance(self, user_id):
+        return self.balances.get(user_id, 0)
+
+    def subtract(self, user_id, amount):
+        if self.balances.get(user_id, 0) < amount:
+            return False
+        self.balances[user_id] -= amount
+        return True
+
+    def subtract_many(self, user_ids, amount):
+        return [uid for uid in user_ids if self.subtract(uid, amount)]
+
+    def add_many(self, payouts):
+        for uid, amount in payouts.items():
+            self.balances[uid] = self.balances.get(uid, 0) + amount
+
+class PokerTable:
+    # 卓の状態と状態遷移。各操作はルールを検査してから状態を変え、Event を返す
+    # プレイヤーはID・カードは整数で保持する
+    __slots__ = ("owner_id", "players", "started", "turn_index", "folded", "pot", "round_bets",
+                 "current_bet", "first_round", "hands", "contributions", "all_in", "deck", "reserved",
+                 "wallet", "listener", "entry_fee", "min_bet", "max_bet")
+
+    def __init__(self, owner_id, wallet, entry_fee=ENTRY_FEE, min_bet=MIN_BET, max_bet=MAX_BET):
+        self.owner_id = owner_id
+        self.players = []         # プレイヤーのユーザーID（参加順）
+        self.wallet = wallet
+        self.listener = None      # Event を受け取るコールバック（listener(table, event)）
+        self.entry_fee = entry_fee
+        self.min_bet = min_bet
+        self.max_bet = max_bet
+        self.reset()
+
+    def reset(self):
+        self.started = False
+        self.turn_index = 0
+        self.folded = set()
+        self.pot = 0
+        self.round_bets = {}      # 各プレイヤーがこのラウンドで賭けた額
+        self.current_bet = 0      # 現在の最高ベット額
+        self.first_round = True   # 一巡目フラグ
+        self.hands = {}           # プレイヤーの手札（整数カードのリスト）
+        self.contributions = {}   # このハンドでの各プレイヤーの総拠出額（参加費・ベットを含む）
+        self.all_in = set()       # オールインしたプレイヤー
+        self.deck = []
+        self.reserved = {}        # 交換用に確保したカード
+
+    def _emit(self, kind, player=None, amount=0, data=None):
+        event = Event(kind, player, amount, data)
+        if self.listener:
+            self.listener(self, event)
+        return event
+
+    def contribute(self, player_id, amount):
+        self.contributions[player_id] = self.contributions.get(player_id, 0) + amount
+        self.pot += amount
+
+    # 参加・開始
+    def join(self, player_id):
+        if self.started:
+            raise RuleError("このチャンネルでは参加できません。")
+        if player_id in self.players:
+            raise RuleError("すでに参加しています。")
+        if len(self.players) >= MAX_PLAYERS:
+            raise RuleError(f"満席です（最大{MAX_PLAYERS}人）。")
+        self.players.append(player_id)
+        return self._emit("join", player_id)
+
+    def deal(self, rng=random):
+        if len(self.players) < 2:
+            raise RuleError("プレイヤーが2人以上必要です。")
+        if self.started:
+            raise RuleError("すでにゲームが開始されています。")
+        self.started = True
+        self.deck = CARD_DECK_INT.copy()
+        rng.shuffle(self.deck)
+        for player_id in self.players:
+            self.hands[player_id] = [self.deck.pop() for _ in range(HAND_SIZE)]
+        return self._emit("deal", data=tuple(self.players))
+
+    def collect_entry_fees(self, player_ids=None, fold=()):
+        # 参加費はまとめて1回で徴収し、払えなかった人・徴収対象から外した人はフォールド扱い
+        # fold に挙げた人は参加費を払ったうえでフォールド扱い（トーナメントのアンティ）
+        player_ids = self.players if player_ids is None else player_ids
+        paid = set(self.wallet.subtract_many(player_ids, self.entry_fee))
+        for player_id in self.players:
+            if player_id in paid:
+                self.contribute(player_id, self.entry_fee)
+            if player_id not in paid or player_id in fold:
+                self.folded.add(player_id)
+        self._emit("fees", amount=self.entry_fee, data=tuple(pid for pid in player_ids if pid in paid))
+        return paid
+
+    # ベッティングラウンド
+    def begin_round(self, first_round):
+        self.turn_index = 0
+        self.first_round = first_round
+        self.round_bets = {}
+        self.current_bet = 0
+
+    def next_actor(self):
+        # フォールド済・オールイン済のプレイヤーは飛ばす。ラウンド終了なら None
+        while self.turn_index < len(self.players):
+            player_id = self.players[self.turn_index]
+            if player_id not in self.folded and player_id not in self.all_in:
+                return player_id
+            self.turn_index += 1
+        return None
+
+    def is_opening(self):
+        # 一巡目の1人目ならベットのみ可、それ以外はコール／レイズも可
+        return self.turn_index == 0 and all(v == 0 for v in self.round_bets.values())
+
+    def _start_action(self, player_id):
+        if not self.started or self.next_actor() != player_id:
+            raise RuleError("現在はあなたのターンではありません。")
+
+    def _end_action(self, kind, player_id, amount=0):
+        self.turn_index += 1
+        return self._emit(kind, player_id, amount)
+
+    def bet(self, player_id, amount):
+        self._start_action(player_id)
+        if not self.is_opening():
+            raise RuleError("このアクションは現在使用できません（すでにベットが行われています）。")
+        if not self.min_bet <= amount <= self.max_bet:
+            raise RuleError(f"金額は{self.min_bet}〜{self.max_bet}の間で指定してください。")
+        if not self.wallet.subtract(player_id, amount):
+            raise RuleError("残高が不足しています。")
+        self.round_bets[player_id] = amount
+        self.current_bet = amount
+        self.contribute(player_id, amount)
+        return self._end_action("bet", player_id, amount)
+
+    def call(self, player_id):
+        self._start_action(player_id)
+        if self.is_opening():
+            raise RuleError("現在はコールできません。まずはベットしてください。")
+        required = self.current_bet - self.round_bets.get(player_id, 0)
+        if required <= 0:
+            return self._end_action("check", player_id)
+
+        # 残高が足りない場合は残り全額でオールイン（超過分はサイドポットで精算）
+        amount = min(required, self.wallet.balance(player_id))
+        if amount <= 0 or not self.wallet.subtract(player_id, amount):
+            raise RuleError("残高が不足しています。")
+        self.round_bets[player_id] = self.round_bets.get(player_id, 0) + amount
+        self.contribute(player_id, amount)
+        if amount < required:
+            self.all_in.add(player_id)
+            return self._end_action("allin", player_id, amount)
+        return self._end_action("call", player_id, amount)
+
+    def raise_to(self, player_id, amount):
+        self._start_action(player_id)
+        if self.is_opening():
+            raise RuleError("現在はレイズできません。まずはベットしてください。")
+        if not self.current_bet < amount <= self.max_bet:
+            raise RuleError(f"有効なレイズ額を入力してください（現在のベットより多く、最大{self.max_bet}まで）。")
+        # すでにこのラウンドで賭けた分を差し引いた額だけ支払う
+        charge = amount - self.round_bets.get(player_id, 0)
+        if not self.wallet.subtract(player_id, charge):
+            raise RuleError("残高が不足しています。")
+        self.round_bets[player_id] = amount
+        self.current_bet = amount
+        self.contribute(player_id, charge)
+        return self._end_action("raise", player_id, charge)
+
+    def fold(self, player_id):
+        self._start_action(player_id)
+        self.folded.add(player_id)
+        return self._end_action("fold", player_id)
+
+    def timeout(self, player_id):
+        # 時間切れはフォールドせずに次のプレイヤーへ
+        self._start_action(player_id)
+        return self._end_action("timeout", player_id)
+
+    # 手札交換
+    def reserve_exchange(self):
+        # 交換用のカードを席順に先に確保しておく（返信の到着順によって配られるカードが変わらないように）
+        active = [pid for pid in self.players if pid not in self.folded]
+        self.reserved = {pid: [self.deck.pop() for _ in range(MAX_EXCHANGE) if self.deck] for pid in active}
+        return active
+
+    def exchange(self, player_id, positions):
+        # positions: 交換するカードの位置（0始まり）。空なら交換しない
+        if player_id not in self.reserved:
+            raise RuleError("現在は交換できません。")
+        positions = list(dict.fromkeys(positions))
+        if len(positions) > MAX_EXCHANGE or any(not 0 <= i < HAND_SIZE for i in positions):
+            raise RuleError("入力が無効か、交換枚数が多すぎます。")
+        reserved = self.reserved[player_id]
+        if len(positions) > len(reserved):
+            raise RuleError("山札のカードが足りません。")
+        hand = self.hands[player_id]
+        for i in positions:
+            hand[i] = reserved.pop(0)
+        return self._emit("exchange", player_id, len(positions), tuple(hand))
+
+    def finish_exchange(self):
+        # 使われなかった確保分は山札に戻す
+        for cards in self.reserved.values():
+            self.deck.extend(reversed(cards))
+        self.reserved = {}
+
+    # 精算
+    def settle(self):
+        results = [(pid, evaluate_cards(self.hands[pid]), tuple(self.hands[pid]))
+                   for pid in self.players if pid not in self.folded and pid in self.hands]
+        if results:
+            payouts, pots = settle_pots(self.contributions, {pid: s for pid, s, _ in results}, self.players)
+        else:
+            # 全員フォールドした場合は拠出額をそのまま返金
+            payouts, pots = dict(self.contributions), []
+        self.wallet.add_many(payouts)
+        contributions, self.contributions = self.contributions, {}
+        self.pot = 0
+        self._emit("settle", data=tuple(payouts.items()))
+        return Showdown(results, payouts, pots, contributions)
+
+    def abort(self):
+        # 進行中のハンドを中止し、参加費・ベットを全額返金して卓を初期状態に戻す
+        refunds = {pid: amount for pid, amount in self.contributions.items() if amount}
+        self.wallet.add_many(refunds)
+        self.contributions = {}
+        self.pot = 0
+        event = self._emit("abort", amount=sum(refunds.values()), data=tuple(refunds.items()))
+        self.reset()
+        return event
+
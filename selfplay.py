@@ -0,0 +1,151 @@
+# セルフプレイによるポーカー経済のシミュレーション
+# Discord を使わずに poker_engine のルールでハンドを大量に回し、参加費やベット上限の影響を確かめる
+#
+#   python selfplay.py --hands 1000000 --players 4 --workers 8 --strategies random,caller,aggressive,tight
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from poker_engine import MAX_EXCHANGE, DictWallet, PokerTable, RuleError, evaluate_cards, hand_category
+
+STRATEGIES = ("random", "caller", "aggressive", "tight")
+STARTING_STACK = 10000
+CHUNK_SIZE = 20000  # 1ワーカーにまとめて渡すハンド数
+
+def choose_action(strategy, table, player_id, rng):
+    # (アクション名, 金額) を返す
+    category = hand_category(evaluate_cards(table.hands[player_id]))
+    opening = table.is_opening()
+    if strategy == "random":
+        if rng.random() < 0.1:
+            return "fold", 0
+        if opening:
+            return "bet", rng.randint(table.min_bet, table.max_bet)
+        if table.current_bet < table.max_bet and rng.random() < 0.3:
+            return "raise", rng.randint(table.current_bet + 1, table.max_bet)
+        return "call", 0
+    if strategy == "aggressive":
+        if opening:
+            return "bet", table.max_bet
+        return "call", 0
+    if strategy == "tight" and category == 0:
+        return "fold", 0
+    if opening:
+        return "bet", table.min_bet
+    if strategy == "tight" and category >= 2 and table.current_bet < table.max_bet:
+        return "raise", min(table.current_bet + table.min_bet, table.max_bet)
+    return "call", 0
+
+def choose_discard(strategy, hand, rng):
+    if strategy == "random":
+        return rng.sample(range(len(hand)), rng.randint(0, MAX_EXCHANGE))
+    if hand_category(evaluate_cards(hand)) >= 4:
+        return []  # ストレート以上はそのまま
+    ranks = [c >> 2 for c in hand]
+    singles = [i for i, r in enumerate(ranks) if ranks.count(r) == 1]
+    singles.sort(key=lambda i: ranks[i])
+    return singles[:MAX_EXCHANGE]
+
+def play_hand(table, strategies, rng):
+    table.deal(rng)
+    table.collect_entry_fees()
+    for first_round in (True, False):
+        table.begin_round(first_round)
+        while (player_id := table.next_actor()) is not None:
+            action, amount = choose_action(strategies[player_id], table, player_id, rng)
+            try:
+                if action == "bet":
+                    table.bet(player_id, amount)
+                elif action == "raise":
+                    table.raise_to(player_id, amount)
+                elif action == "call":
+                    table.call(player_id)
+                else:
+                    table.fold(player_id)
+            except RuleError:
+                table.fold(player_id)
+        if first_round:
+            for player_id in table.reserve_exchange():
+                table.exchange(player_id, choose_discard(strategies[player_id], table.hands[player_id], rng))
+            table.finish_exchange()
+    pot = table.pot
+    showdown = table.settle()
+    table.reset()
+    return pot, showdown
+
+def run_chunk(args):
+    hands, strategy_names, seed = args
+    rng = random.Random(seed)
+    strategies = dict(enumerate(strategy_names))
+    wallet = DictWallet({pid: STARTING_STACK for pid in strategies})
+    table = PokerTable(owner_id=0, wallet=wallet)
+    for pid in strategies:
+        table.join(pid)
+
+    stats = {name: {"seats": 0, "wins": 0, "net": 0, "rebuys": 0} for name in set(strategy_names)}
+    pot_total = 0
+    for _ in range(hands):
+        # 残高が少なくなったら買い足す（買い足し額は収支から差し引く）
+        for pid, name in strategies.items():
+            if wallet.balance(pid) < table.max_bet * 2:
+                stats[name]["rebuys"] += STARTING_STACK
+                wallet.balances[pid] += STARTING_STACK
+        pot, showdown = play_hand(table, strategies, rng)
+        pot_total += pot
+        for pid, name in strategies.items():
+            stats[name]["seats"] += 1
+            if pid in showdown.payouts:
+                stats[name]["wins"] += 1
+        # 席順を回して、先手の有利不利をならす
+        table.players.append(table.players.pop(0))
+
+    for pid, name in strategies.items():
+        stats[name]["net"] += wallet.balance(pid) - STARTING_STACK - stats[name]["rebuys"]
+    return hands, pot_total, stats
+
+def merge_stats(total, stats):
+    for name, values in stats.items():
+        into = total.setdefault(name, {"seats": 0, "wins": 0, "net": 0, "rebuys": 0})
+        for key, value in values.items():
+            into[key] += value
+
+def main():
+    parser = argparse.ArgumentParser(description="ポーカーのセルフプレイ・シミュレータ")
+    parser.add_argument("--hands", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help=f"席ごとの戦略（{', '.join(STRATEGIES)}）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    names = args.strategies.split(",")
+    seats = [names[i % len(names)] for i in range(args.players)]
+    chunks = []
+    remaining = args.hands
+    while remaining > 0:
+        size = min(CHUNK_SIZE, remaining)
+        chunks.append((size, seats, args.seed + len(chunks)))
+        remaining -= size
+
+    start = time.perf_counter()
+    total_hands, pot_total, totals = 0, 0, {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for hands, pots, stats in pool.map(run_chunk, chunks):
+            total_hands += hands
+            pot_total += pots
+            merge_stats(totals, stats)
+    elapsed = time.perf_counter() - start
+
+    # 参加費・ベットは全てポットから払い戻されるので、全体の収支は0になるはず
+    drift = sum(values["net"] for values in totals.values())
+    print(f"🃏 {total_hands} ハンド / {elapsed:.1f} 秒（{total_hands / elapsed:,.0f} ハンド/秒）")
+    print(f"💰 平均ポット {pot_total / total_hands:.1f} Spt / Spt のずれ {drift} Spt")
+    for name, values in sorted(totals.items()):
+        win_rate = values["wins"] / values["seats"] if values["seats"] else 0
+        per_hand = values["net"] / values["seats"] if values["seats"] else 0
+        print(f"・{name}: 勝率 {win_rate:.1%} / 1ハンドあたり {per_hand:+.1f} Spt / 買い足し {values['rebuys']} Spt")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# ハンド履歴の読み込み（書き込み途中で落ちた場合の切り詰め）・引き継ぎ（merge）・集計の検査
+#   python -m pytest -q tests
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hand_history import HandHistory
+from poker_engine import card_to_int
+
+PAIR = [card_to_int(c) for c in ("spades_K", "hearts_K", "clubs_9", "spades_7", "diamonds_4")]
+HIGH = [card_to_int(c) for c in ("clubs_A", "diamonds_J", "hearts_8", "clubs_6", "hearts_2")]
+
+def table(channel_id=1, folded=()):
+    return SimpleNamespace(channel_id=channel_id, players=[1, 2], hands={1: PAIR, 2: HIGH}, folded=set(folded))
+
+def open_history(path, **kwargs):
+    history = HandHistory(directory=str(path), **kwargs)
+    history.load()
+    return history
+
+def test_load_truncates_torn_write(tmp_path):
+    history = open_history(tmp_path / "history")
+    history.append(table(), {1: 10, 2: 10}, {1: 20}, [(1, 0, 10)], now=100)
+    history.append(table(), {1: 10, 2: 10}, {2: 20}, [(2, 0, 10)], now=200)
+    history.flush()
+    # 3ハンド目は席と行動の列を書いたところで落ち、時刻列は値の途中で止まった
+    history.append(table(), {1: 10, 2: 10}, {1: 20}, [(1, 0, 10)], now=300)
+    history.seats.flush()
+    history.actions.flush()
+    with open(history.hands.paths["time"], "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    again = open_history(tmp_path / "history")
+    assert list(again.hands.columns["time"]) == [100, 200]
+    assert list(again.seats.columns["hand"]) == [0, 0, 1, 1]
+    assert list(again.actions.columns["hand"]) == [0, 1]
+    assert (again.player_stats(1).hands, again.player_stats(1).net) == (2, 0)
+    # 切り詰めた後に追記しても列がずれない
+    again.append(table(), {1: 10, 2: 10}, {1: 20}, [], now=400)
+    again.flush()
+    assert list(open_history(tmp_path / "history").hands.columns["time"]) == [100, 200, 400]
+
+def test_merge_interleaves_by_time(tmp_path):
+    history = open_history(tmp_path / "history")
+    history.append(table(1), {1: 10, 2: 10}, {1: 20}, [(1, 0, 10)], now=100)
+    history.append(table(1), {1: 10, 2: 10}, {2: 20}, [], now=300)
+    other = open_history(tmp_path / "history-shards-0-1")
+    other.append(table(2), {1: 5, 2: 5}, {2: 10}, [(2, 1, 5), (1, 5, 0)], now=200)
+    other.flush()
+
+    assert history.merge(HandHistory(directory=str(tmp_path / "history-shards-0-1")))
+    assert list(history.hands.columns["time"]) == [100, 200, 300]
+    assert list(history.hands.columns["channel"]) == [1, 2, 1]
+    assert list(history.seats.columns["hand"]) == [0, 0, 1, 1, 2, 2]
+    assert list(history.actions.columns["hand"]) == [0, 1, 1]
+    assert history.player_stats(2).net == 5 - 10 + 10
+    assert not os.path.exists(tmp_path / "history.merging")
+    assert not os.path.exists(tmp_path / "history.old")
+    # 取り込み済みの印があるので、元のディレクトリを消す前に落ちても二重に取り込まない
+    assert not history.merge(HandHistory(directory=str(tmp_path / "history-shards-0-1")))
+    assert len(open_history(tmp_path / "history").hands) == 3
+
+def test_merge_crash_recovery(tmp_path):
+    history = open_history(tmp_path / "history")
+    history.append(table(), {1: 10, 2: 10}, {1: 20}, [], now=100)
+    history.flush()
+    # 入れ替え前に落ちた：書きかけの .merging は捨てて元の履歴を使う
+    os.makedirs(tmp_path / "history.merging")
+    (tmp_path / "history.merging" / "hands.time.bin").write_bytes(b"\0" * 4)
+    assert len(open_history(tmp_path / "history").hands) == 1
+    assert not os.path.exists(tmp_path / "history.merging")
+    # 入れ替えの途中で落ちた：書き終えた .merging を使い、古い .old は消す
+    os.rename(tmp_path / "history", tmp_path / "history.merging")
+    os.makedirs(tmp_path / "history.old")
+    again = open_history(tmp_path / "history")
+    assert list(again.hands.columns["time"]) == [100]
+    assert not os.path.exists(tmp_path / "history.merging")
+    assert not os.path.exists(tmp_path / "history.old")
+
+def test_category_win_rates_skip_folded(tmp_path):
+    history = open_history(tmp_path / "history")
+    history.append(table(), {1: 10, 2: 10}, {1: 20}, [], now=100)
+    history.append(table(folded=[1]), {1: 10, 2: 10}, {2: 20}, [], now=200)
+    rates = history.category_win_rates()
+    assert rates[1] == (1, 1)   # ワンペアはショウダウンの1回だけ（フォールドした回は数えない）
+    assert rates[0] == (2, 1)
+    assert history.category_win_rates(since=150)[1] == (0, 0)
+    assert history.player_stats(1).category_hands[1] == 1
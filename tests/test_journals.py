@@ -0,0 +1,95 @@
+# 台帳ジャーナルの再生・圧縮と、卓ジャーナルからの復旧の検査
+#   python -m pytest -q tests
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from main import LEDGER_SEQ_KEY, CurrencyLedger, JsonCurrencyStore, TableJournal
+
+def open_ledger(tmp_path, **kwargs):
+    ledger = CurrencyLedger(str(tmp_path / "currency.json"), str(tmp_path / "currency.journal"), **kwargs)
+    ledger.load()
+    return ledger
+
+def open_tables(tmp_path):
+    return TableJournal(str(tmp_path / "tables.json"), str(tmp_path / "tables.journal"))
+
+def test_ledger_replays_journal_after_crash(tmp_path):
+    ledger = open_ledger(tmp_path)
+    assert ledger.apply([(1, 500)])
+    assert ledger.apply([(1, -200), (2, 50)])
+    assert not ledger.apply([(2, -51)])  # 残高不足は記録しない
+    ledger.journal.close()               # 圧縮せずに落ちた
+    again = open_ledger(tmp_path)
+    assert (again.get(1), again.get(2), again.seq) == (300, 50, 2)
+
+def test_ledger_ignores_torn_last_line(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.apply([(1, 100)])
+    ledger.journal.write('{"seq":2,"ops":[["1",5')
+    ledger.journal.close()
+    assert open_ledger(tmp_path).get(1) == 100
+
+def test_compact_writes_snapshot_and_skips_old_entries(tmp_path):
+    ledger = open_ledger(tmp_path, compact_every=2)
+    ledger.apply([(1, 10)])
+    ledger.apply([(1, 10)])  # 2件目で圧縮される
+    with open(tmp_path / "currency.json", encoding="utf-8") as f:
+        assert json.load(f) == {"1": 20, LEDGER_SEQ_KEY: 2}
+    assert os.path.getsize(tmp_path / "currency.journal") == 0
+    ledger.apply([(1, 5)])
+    ledger.journal.close()
+    # スナップショットに入っている番号のジャーナル行が残っていても二重に適用しない
+    with open(tmp_path / "currency.journal", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"seq": 1, "ops": [["1", 10]]}) + "\n")
+    again = open_ledger(tmp_path)
+    assert again.get(1) == 25
+    assert again.ranking().top(1) == [("1", 25)]
+
+def test_json_store_takes_over_uncompacted_journal(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.apply([(1, 500)])
+    ledger.compact()
+    ledger.apply([(1, 100), (2, 50)])
+    ledger.journal.close()
+    store = JsonCurrencyStore(str(tmp_path / "currency.json"), str(tmp_path / "currency.journal"))
+    assert (store.get(1), store.get(2)) == (600, 50)
+    assert store.totals() == {"backend": "json", "loaded": True, "accounts": 2, "total": 650}
+    assert not os.path.exists(tmp_path / "currency.journal")
+    # ジャーナル方式に戻しても二重に適用されない
+    assert open_ledger(tmp_path).get(1) == 600
+
+def test_recover_refunds_in_flight_hand(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CURRENCY", open_ledger(tmp_path))
+    journal = open_tables(tmp_path)
+    journal.write("10", "open", 1)
+    journal.write("10", "join", 1)
+    journal.write("10", "join", 2)
+    journal.write("10", "message", data=99)
+    journal.write("10", "deal")
+    journal.write("10", "fees", amount=10, data=[1, 2])
+    journal.write("10", "bet", 1, 30)
+    journal.write("20", "open", 3)
+    journal.write("20", "join", 3)
+    journal.write("30", "open", 4)
+    journal.write("30", "close")
+    journal.journal.close()
+
+    reopened = open_tables(tmp_path)
+    recovered = {channel_id: (record, refunded) for channel_id, record, refunded in reopened.recover()}
+    reopened.journal.close()
+    assert set(recovered) == {"10", "20"}
+    record, refunded = recovered["10"]
+    assert refunded == 50
+    assert (record["players"], record["message"], record["started"], record["contributions"]) == ([1, 2], 99, False, {})
+    assert recovered["20"][1] == 0
+    assert (main.CURRENCY.get(1), main.CURRENCY.get(2)) == (40, 10)
+
+    # 返金は記録済みなので、もう一度復旧しても二重に返金しない
+    again = open_tables(tmp_path)
+    assert [refunded for _, _, refunded in again.recover()] == [0, 0]
+    again.journal.close()
+    assert main.CURRENCY.get(1) == 40
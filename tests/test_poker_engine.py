@@ -0,0 +1,181 @@
+# poker_engine の役判定・ポット精算の検査
+#   python -m pytest -q tests
+import os
+import random
+import sys
+from collections import Counter
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poker_engine import (CARD_DECK, CARD_DECK_INT, DictWallet, PokerTable, card_to_int,
+                          evaluate_cards, evaluate_hand, evaluate_hands, hand_category, settle_pots,
+                          uncalled_bet)
+
+# 5枚の組み合わせ全 2,598,960 通りでの役ごとの出現数
+CATEGORY_COUNTS = {0: 1302540, 1: 1098240, 2: 123552, 3: 54912, 4: 10200,
+                   5: 5108, 6: 3744, 7: 624, 8: 40}
+
+def legacy_evaluate(cards):
+    # 以前の main.py の evaluate_hand（役カテゴリ＋最高位のカード1枚だけを返し、A-2-3-4-5 を認識しない）
+    values_order = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6,
+                    '7': 7, '8': 8, '9': 9, '10': 10,
+                    'J': 11, 'Q': 12, 'K': 13, 'A': 14}
+    suits = [c.split('_')[0] for c in cards]
+    values = sorted([values_order[c.split('_')[1]] for c in cards])
+    counts = {v: values.count(v) for v in set(values)}
+
+    is_flush = len(set(suits)) == 1
+    is_straight = values == list(range(min(values), max(values)+1))
+
+    if is_flush and is_straight:
+        return (8, max(values))
+    elif 4 in counts.values():
+        return (7, max(k for k, v in counts.items() if v == 4))
+    elif sorted(counts.values()) == [2, 3]:
+        return (6, max(k for k, v in counts.items() if v == 3))
+    elif is_flush:
+        return (5, max(values))
+    elif is_straight:
+        return (4, max(values))
+    elif 3 in counts.values():
+        return (3, max(k for k, v in counts.items() if v == 3))
+    elif list(counts.values()).count(2) == 2:
+        return (2, max(k for k, v in counts.items() if v == 2))
+    elif 2 in counts.values():
+        return (1, max(k for k, v in counts.items() if v == 2))
+    else:
+        return (0, max(values))
+
+def strength(*names):
+    return evaluate_hand(list(names))
+
+def is_wheel(cards):
+    return sorted(c.split("_")[1] for c in cards) == sorted(["A", "2", "3", "4", "5"])
+
+def test_category_counts_over_all_hands():
+    counts = Counter(map(hand_category, evaluate_hands(combinations(CARD_DECK_INT, 5))))
+    assert counts == CATEGORY_COUNTS
+
+def test_matches_legacy_evaluator_where_they_agree():
+    # 以前の関数とは A-2-3-4-5 以外で役カテゴリと最高位の札（ストレート・同種の組）が一致する
+    rng = random.Random(0)
+    for _ in range(20000):
+        cards = rng.sample(CARD_DECK, 5)
+        if is_wheel(cards):
+            continue
+        category, high = legacy_evaluate(cards)
+        value = evaluate_hand(cards)
+        assert hand_category(value) == category
+        assert (value >> 16) & 15 == high
+
+def test_wheel_is_lowest_straight():
+    wheel = strength("spades_A", "hearts_2", "clubs_3", "spades_4", "diamonds_5")
+    six_high = strength("spades_6", "hearts_2", "clubs_3", "spades_4", "diamonds_5")
+    ace_high = strength("spades_A", "hearts_K", "clubs_Q", "spades_J", "diamonds_10")
+    assert hand_category(wheel) == 4
+    assert wheel < six_high < ace_high
+    steel_wheel = strength("hearts_A", "hearts_2", "hearts_3", "hearts_4", "hearts_5")
+    assert hand_category(steel_wheel) == 8
+    assert steel_wheel < strength("hearts_6", "hearts_2", "hearts_3", "hearts_4", "hearts_5")
+
+def test_kickers_break_ties():
+    kings_ace = strength("spades_K", "hearts_K", "clubs_A", "spades_7", "diamonds_4")
+    kings_queen = strength("clubs_K", "diamonds_K", "hearts_Q", "hearts_7", "clubs_4")
+    assert kings_ace > kings_queen
+    # ツーペアは高い組 → 低い組 → キッカーの順で比べる
+    assert strength("spades_9", "hearts_9", "clubs_5", "spades_5", "diamonds_A") < \
+        strength("clubs_9", "diamonds_9", "hearts_6", "diamonds_6", "hearts_2")
+    assert strength("spades_9", "hearts_9", "clubs_5", "spades_5", "diamonds_3") < \
+        strength("clubs_9", "diamonds_9", "hearts_5", "diamonds_5", "hearts_4")
+    # フルハウスは3枚組が優先
+    assert strength("spades_3", "hearts_3", "clubs_3", "spades_A", "diamonds_A") > \
+        strength("clubs_2", "diamonds_2", "hearts_2", "diamonds_K", "hearts_K")
+    # スートだけが違う手は同じ強さ
+    assert strength("spades_A", "hearts_J", "clubs_8", "spades_6", "diamonds_2") == \
+        strength("hearts_A", "clubs_J", "diamonds_8", "hearts_6", "spades_2")
+
+def test_batch_matches_single():
+    rng = random.Random(1)
+    hands = [rng.sample(CARD_DECK_INT, 5) for _ in range(5000)]
+    assert evaluate_hands(hands) == [evaluate_cards(hand) for hand in hands]
+    assert all(evaluate_hand(names) == evaluate_cards([card_to_int(n) for n in names])
+               for names in (rng.sample(CARD_DECK, 5) for _ in range(1000)))
+
+def test_side_pots():
+    # 1 はオールイン50、2と3は100ずつ。メインは1、サイドは2が取る
+    payouts, pots = settle_pots({1: 50, 2: 100, 3: 100}, {1: 30, 2: 20, 3: 10}, [1, 2, 3])
+    assert pots == [(150, [1]), (100, [2])]
+    assert payouts == {1: 150, 2: 100}
+
+def test_folded_excess_goes_to_previous_pot():
+    # フォールドした 3 の超過分は、最後に争われたポットに加わる
+    payouts, pots = settle_pots({1: 40, 2: 40, 3: 100}, {1: 5, 2: 9}, [1, 2, 3])
+    assert pots == [(180, [2])]
+    assert payouts == {2: 180}
+
+def test_odd_chips_follow_seat_order():
+    payouts, pots = settle_pots({1: 11, 2: 11, 3: 11}, {1: 7, 2: 7, 3: 7}, [2, 3, 1])
+    assert pots == [(33, [2, 3, 1])]
+    assert payouts == {2: 11, 3: 11, 1: 11}
+    payouts, _ = settle_pots({1: 10, 2: 10, 3: 5}, {2: 7, 3: 7}, [3, 2, 1])
+    assert payouts == {3: 8, 2: 17}
+
+def test_orphaned_contributions_are_refunded():
+    # 残った人が誰も拠出していない場合はチップを失わず、拠出した人に返す
+    assert settle_pots({1: 100}, {2: 9}, [1, 2]) == ({1: 100}, [])
+    assert settle_pots({1: 100, 2: 0}, {}, [1, 2]) == ({1: 100}, [])
+
+def test_uncalled_bet_is_returned_not_won():
+    # 1 はメインポットで負けたが、誰もコールしなかった 50 は戻ってくるだけ（勝ちではない）
+    contributions = {1: 100, 2: 50}
+    payouts, pots = settle_pots(contributions, {1: 1, 2: 5}, [1, 2])
+    assert pots == [(100, [2]), (50, [1])]
+    assert uncalled_bet(pots, contributions) == (1, 50)
+    assert payouts[1] - contributions[1] < 0
+    # フォールドした人の超過分を含むポットは払い戻しではない
+    contributions = {1: 100, 2: 50, 3: 20}
+    _, pots = settle_pots(contributions, {1: 1, 3: 5}, [1, 2, 3])
+    assert uncalled_bet(pots, contributions) == (1, 50)
+    assert pots[-2] == (60, [1])
+    # コールされたベットだけなら払い戻しはない
+    _, pots = settle_pots({1: 50, 2: 50}, {1: 1, 2: 5}, [1, 2])
+    assert uncalled_bet(pots, {1: 50, 2: 50}) is None
+
+def test_settle_conserves_chips():
+    rng = random.Random(2)
+    for _ in range(5000):
+        players = list(range(1, rng.randint(2, 10) + 1))
+        contributions = {pid: rng.choice([0, 10, 25, 50, 100, rng.randint(1, 200)]) for pid in players}
+        alive = rng.sample(players, rng.randint(1, len(players)))
+        strengths = {pid: rng.randint(0, 5) for pid in alive}
+        payouts, pots = settle_pots(contributions, strengths, players)
+        assert sum(payouts.values()) == sum(contributions.values())
+        assert sum(amount for amount, _ in pots) == (sum(contributions.values()) if pots else 0)
+        for amount, winners in pots:
+            assert winners and all(pid in strengths for pid in winners)
+        if pots:
+            # 受け取るのはショウダウンに残った人だけ
+            assert set(payouts) <= set(strengths)
+
+def test_unpaid_and_excluded_players_fold():
+    table = PokerTable(1, DictWallet({1: 100, 2: 0, 3: 100}), entry_fee=10)
+    for pid in (1, 2, 3):
+        table.join(pid)
+    table.deal(random.Random(0))
+    paid = table.collect_entry_fees([1, 2])
+    assert paid == {1}
+    assert table.folded == {2, 3}
+    assert table.contributions == {1: 10}
+
+def test_antes_are_charged_to_folded_seats():
+    # トーナメントのアンティは連絡の取れない人からも取り、その人はフォールド扱いにする
+    table = PokerTable(1, DictWallet({1: 100, 2: 100}), entry_fee=10)
+    for pid in (1, 2):
+        table.join(pid)
+    table.deal(random.Random(0))
+    paid = table.collect_entry_fees([1, 2], fold=[2])
+    assert paid == {1, 2}
+    assert table.folded == {2}
+    assert table.contributions == {1: 10, 2: 10}
+    assert table.wallet.balance(2) == 90
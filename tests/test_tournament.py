@@ -0,0 +1,65 @@
+# トーナメントの席割り（Seating）の検査
+#   python -m pytest -q tests
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tournament import Seating
+
+def check_consistent(seating):
+    # 全員がちょうど1つの卓に座り、バケットが卓の人数と一致している
+    seated = [pid for players in seating.tables.values() for pid in players]
+    assert sorted(seated) == sorted(seating.table_of)
+    for table, players in seating.tables.items():
+        assert all(seating.table_of[pid] == table for pid in players)
+        assert table in seating.buckets[len(players)]
+    assert sum(len(bucket) for bucket in seating.buckets) == len(seating.tables)
+
+def test_seat_all_uses_fewest_tables():
+    seating = Seating(seats=6)
+    seating.seat_all(range(20), random.Random(0))
+    assert len(seating.tables) == 4
+    assert sorted(map(len, seating.tables.values())) == [5, 5, 5, 5]
+    check_consistent(seating)
+
+def test_rebalance_closes_a_table_when_the_rest_fit():
+    seating = Seating(seats=6)
+    seating.seat_all(range(12), random.Random(0))
+    for pid in range(6):
+        seating.remove(pid)
+    moves, closed = seating.rebalance()
+    # 残り6人は1卓に収まるので、少ない方の卓を解散して全員をもう1卓へ移す
+    assert len(closed) == 1 and closed[0] not in seating.tables
+    assert [len(players) for players in seating.tables.values()] == [6]
+    assert all(src == closed[0] and dst in seating.tables for _, src, dst in moves)
+    check_consistent(seating)
+
+def test_rebalance_evens_out_tables():
+    seating = Seating(seats=6)
+    seating.seat_all(range(18), random.Random(0))
+    table = next(iter(seating.tables))
+    for pid in list(seating.tables[table])[:3]:
+        seating.remove(pid)
+    moves, closed = seating.rebalance()
+    # 3人 / 6人 / 6人 → 5人ずつ。移すのは差を埋める2人だけ
+    assert closed == []
+    assert sorted(map(len, seating.tables.values())) == [5, 5, 5]
+    assert len(moves) == 2 and all(dst == table for _, _, dst in moves)
+    check_consistent(seating)
+
+def test_random_eliminations_keep_invariants():
+    rng = random.Random(1)
+    for _ in range(200):
+        seats = rng.randint(2, 9)
+        seating = Seating(seats=seats)
+        seating.seat_all(range(rng.randint(2, 60)), rng)
+        while len(seating) > 1:
+            for pid in rng.sample(list(seating.table_of), rng.randint(1, min(3, len(seating) - 1))):
+                seating.remove(pid)
+            seating.rebalance()
+            check_consistent(seating)
+            sizes = [len(players) for players in seating.tables.values()]
+            assert max(sizes) - min(sizes) <= 1
+            assert len(seating.tables) == -(-len(seating) // seats)
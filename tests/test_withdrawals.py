@@ -0,0 +1,97 @@
+# 換金申請の待ち行列（ジャーナル方式・SQLite 方式）の検査
+#   python -m pytest -q tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from main import CurrencyLedger, SqliteCurrencyStore, SqliteWithdrawalQueue, WithdrawalQueue
+
+@pytest.fixture(params=["journal", "sqlite"])
+def ledger(request, tmp_path, monkeypatch):
+    # (台帳, 申請の待ち行列を開き直す関数)。ファイルはすべて tmp_path に置く
+    monkeypatch.chdir(tmp_path)
+    if request.param == "sqlite":
+        store = SqliteCurrencyStore(str(tmp_path / "currency.db"))
+        factory = lambda: SqliteWithdrawalQueue(store)
+    else:
+        store = CurrencyLedger(str(tmp_path / "currency.json"), str(tmp_path / "currency.journal"))
+        factory = lambda: WithdrawalQueue(str(tmp_path / "withdrawals.json"), str(tmp_path / "withdrawals.journal"))
+    store.load()
+    store.apply([(1, 1000), (2, 1000)])
+    monkeypatch.setattr(main, "CURRENCY", store)
+    yield store, factory
+    if request.param == "sqlite":
+        store.db.close()
+
+def open_queue(factory):
+    queue = factory()
+    queue.load()
+    return queue
+
+def test_request_deducts_and_survives_restart(ledger):
+    store, factory = ledger
+    queue = open_queue(factory)
+    first = queue.request(1, 300, 10)
+    second = queue.request(2, 200, 20)
+    assert queue.request(1, 800, 10) is None  # 残高不足なら記録も引き落としもしない
+    assert (store.get(1), store.get(2)) == (700, 800)
+    assert queue.wake.is_set()
+
+    queue.mark_notified([first])
+    again = open_queue(factory)
+    assert again.last_id() == second
+    assert [(rid, entry["user"], entry["amount"], entry["guild"]) for rid, entry in again.open_requests()] == \
+        [(first, 1, 300, 10), (second, 2, 200, 20)]
+    assert [rid for rid, _ in again.unnotified()] == [second]
+    assert again.pending_count() == 2
+    assert again.totals() == {"loaded": True, "pending": 2, "pending_amount": 500, "unnotified": 1}
+
+def test_cancel_refunds_once_and_respects_guild(ledger):
+    store, factory = ledger
+    queue = open_queue(factory)
+    first = queue.request(1, 300, 10)
+    second = queue.request(1, 100, 20)
+    assert queue.cancel([first], guild_id=20) == []        # 別のサーバーの申請は処理しない
+    assert [rid for rid, _ in queue.cancel([first, second], guild_id=10)] == [first]
+    assert store.get(1) == 900
+    assert queue.cancel([first]) == []                     # 取り消し済みは二度返金しない
+    assert [rid for rid, _ in queue.mark_paid(None, guild_id=20)] == [second]
+    assert queue.cancel([second]) == []                    # 振込済みは取り消せない
+    assert store.get(1) == 900
+    again = open_queue(factory)
+    assert again.open_requests() == [] and again.pending_count() == 0
+
+def test_sqlite_imports_journal_queues_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = SqliteCurrencyStore(str(tmp_path / "currency.db"))
+    store.load()
+    store.apply([(1, 1000)])
+    monkeypatch.setattr(main, "CURRENCY", store)
+    # シャードの割り当てを変える前のプロセスが残したジャーナル方式の申請
+    old = WithdrawalQueue("withdrawals-shards-0-1.json", "withdrawals-shards-0-1.journal")
+    old.load()
+    pending = old.request(1, 300, 10)
+    old.mark_paid([old.request(1, 100, 10)])
+    old.mark_notified([pending])
+    old.journal.close()
+    assert store.get(1) == 600
+    legacy = {name: open(name, "rb").read() for name in os.listdir(".") if name.startswith("withdrawals")}
+
+    queue = open_queue(lambda: SqliteWithdrawalQueue(store))
+    assert not [name for name in os.listdir(".") if name.startswith("withdrawals")]
+    [(rid, entry)] = queue.open_requests()
+    # 番号は振り直すので、改めて通知する
+    assert (entry["user"], entry["amount"], entry["guild"], entry["notified"]) == (1, 300, 10, False)
+    assert queue.wake.is_set()
+    # ファイルを消す前に落ちて、同じ内容がもう一度読まれても二重に取り込まない
+    for name, data in legacy.items():
+        with open(name, "wb") as f:
+            f.write(data)
+    open_queue(lambda: SqliteWithdrawalQueue(store))
+    assert [r for r, _ in queue.open_requests()] == [rid]
+    assert store.get(1) == 600
+    store.db.close()
@@ -0,0 +1,90 @@
+# トーナメントの席割り（Discordに依存しない）
+# 卓を人数ごとのバケットに分けておき、最も空いている卓・混んでいる卓を人数の範囲だけ調べて見つける
+# 卓の数が増えても、着席・移動・卓の解散は1人あたり一定の手間で済む
+import random
+
+from poker_engine import MAX_PLAYERS
+
+class Seating:
+    def __init__(self, seats=MAX_PLAYERS):
+        self.seats = seats
+        self.tables = {}      # 卓番号 -> 着席しているプレイヤーID
+        self.table_of = {}    # プレイヤーID -> 卓番号
+        self.buckets = [set() for _ in range(seats + 1)]  # 人数 -> その人数の卓番号
+        self.next_table = 0
+
+    def __len__(self):
+        return len(self.table_of)
+
+    def open_table(self):
+        table = self.next_table
+        self.next_table += 1
+        self.tables[table] = []
+        self.buckets[0].add(table)
+        return table
+
+    def close_table(self, table):
+        if self.tables[table]:
+            raise ValueError("着席者のいる卓は閉じられません")
+        self.buckets[0].discard(table)
+        del self.tables[table]
+
+    def sit(self, player_id, table):
+        players = self.tables[table]
+        self.buckets[len(players)].discard(table)
+        players.append(player_id)
+        self.buckets[len(players)].add(table)
+        self.table_of[player_id] = table
+
+    def remove(self, player_id):
+        table = self.table_of.pop(player_id)
+        players = self.tables[table]
+        self.buckets[len(players)].discard(table)
+        players.remove(player_id)
+        self.buckets[len(players)].add(table)
+        return table
+
+    def smallest(self, exclude=None):
+        for bucket in self.buckets:
+            for table in bucket:
+                if table != exclude:
+                    return table
+        return None
+
+    def largest(self):
+        for bucket in reversed(self.buckets):
+            for table in bucket:
+                return table
+        return None
+
+    def seat_all(self, players, rng=random):
+        # 必要最小限の卓を開き、シャッフルした順に1人ずつ配る（卓の人数差は最大1人）
+        players = list(players)
+        rng.shuffle(players)
+        tables = [self.open_table() for _ in range(-(-len(players) // self.seats))]
+        for i, player_id in enumerate(players):
+            self.sit(player_id, tables[i % len(tables)])
+
+    def rebalance(self):
+        # ハンドの合間に呼ぶ。(移動したプレイヤー, 元の卓, 移動先の卓) の一覧と、解散した卓の一覧を返す
+        moves, closed = [], []
+        # 1卓減らしても全員座れるなら、最も少ない卓を解散して他の空いている卓に振り分ける
+        while len(self.tables) > 1 and len(self) <= (len(self.tables) - 1) * self.seats:
+            table = self.smallest()
+            for player_id in list(self.tables[table]):
+                self.remove(player_id)
+                target = self.smallest(exclude=table)
+                self.sit(player_id, target)
+                moves.append((player_id, table, target))
+            self.close_table(table)
+            closed.append(table)
+        # 人数の差が2人以上あれば、多い卓から少ない卓へ1人ずつ移す
+        while self.tables:
+            big, small = self.largest(), self.smallest()
+            if len(self.tables[big]) - len(self.tables[small]) <= 1:
+                break
+            player_id = self.tables[big][-1]
+            self.remove(player_id)
+            self.sit(player_id, small)
+            moves.append((player_id, big, small))
+        return moves, closed